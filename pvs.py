@@ -3,14 +3,22 @@ import os
 import shutil
 import sys
 import typing
-from os import listdir
 from time import time
 from collections import Counter
 from datetime import timedelta
-from os.path import isdir, join, isfile
+from os.path import join
 from exiftool import exiftool
 from src import func
 from src.geo import GeoObjects, Address, GeoMultiTrack
+from src.exif_cache import ExifCache
+from src.exif_pool import ExifToolPool
+from src.journal import Journal
+from src.done_folders import DoneFolders
+from src.folder_snapshot import FolderSnapshot
+from src.folder_scheduler import FolderScheduler
+from src.tree_plan import TreePlan
+from src.folder_watch import FolderWatch
+from src.bench import Bench
 from src.settings import Settings
 from src.structures import PVFolder, PVFile
 
@@ -28,20 +36,13 @@ class PVS(Settings):
 
     def new_job_reset(self) -> typing.NoReturn:
         """
-        The names of all processed folders are placed in the done_folders_list.txt file.
+        The names of all processed folders are placed in the done folders registry.
         If the process is interrupted, we can restart it and parse the unfinished folders.
         """
-        done_folders_pickle_file_path = self.get_par('', 'done_folders_pickle_file_path')
-        done_folders_txt_file_path = self.get_par('', 'done_folders_txt_file_path')
         if self.get_par(True, 'new_job_reset'):
-            func.save_struct_as_pickle_file(done_folders_pickle_file_path, [])
-            func.save_struct_as_txt_file(done_folders_txt_file_path, [], 'done_folders')
+            DoneFolders.reset()
         else:
-            try:
-                func.load_pickle_file_as_struct(done_folders_pickle_file_path, [])
-            except FileNotFoundError:
-                func.save_struct_as_pickle_file(done_folders_pickle_file_path, [])
-                func.save_struct_as_txt_file(done_folders_txt_file_path, [], 'done_folders')
+            DoneFolders.load()
 
     def run_systemize(self, folder_path: str) -> bool:
         """
@@ -57,22 +58,96 @@ class PVS(Settings):
 
         self.print_log('i', 'main', f'PVS process started.')
 
-        # Depending on the script launch parameter, whether we clear the done_folders_pickle_file_path list or not.
+        # Depending on the script launch parameter, whether we clear the done folders registry or not.
         self.new_job_reset()
 
+        # Finish changes of files interrupted in the previous run and start the journal of the current run.
+        Journal.recover()
+        Journal.start_journal()
+
         # Load all objects from the local google file.
         GeoObjects.load_google_earth_kml(self.get_par('', 'gogle_geo_object_kml_file_path'))
 
-        # Create object for first folder and start main process
-        pv_folder = PVFolder(folder_path)
-        pv_folder.run_process_folder()
-
-        timedelta(seconds=int(time() - start_time))
-        if PVFile.exif_tool.running:
-            PVFile.exif_tool.terminate()
+        # Walk the whole tree once and order the folders to process.
+        plan = TreePlan(folder_path)
+        plan.walk()
+        plan.print_plan(False)
+        plan.start_run()
+        try:
+            folder_processes = self.get_par(1, 'folder_processes')
+            if folder_processes > 1:
+                # Independent subfolders are processed by several worker processes at once.
+                FolderScheduler.run_process_tree(folder_path, folder_processes, plan)
+            else:
+                # Start the pool of ExifTool processes, which is used by all folders for reading and writing metadata.
+                ExifToolPool.start(max(self.get_par(0, 'exif_read_processes'),
+                                       self.get_par(0, 'num_multi_processes')))
+                # Start main process for the folder and its subfolders
+                PVFolder.run_process_tree(folder_path, plan)
+            plan.save_throughput()
+        finally:
+            # ExifTool processes are stopped also after an interrupt or an error.
+            if PVFile.exif_tool.running:
+                PVFile.exif_tool.terminate()
+            ExifToolPool.terminate()
+            Journal.close_journal()
+            # The text list of done folders is exported once per run.
+            DoneFolders.export_txt()
         self.print_log('i', 'main', f'PVS process finished in {timedelta(seconds=int(time() - start_time))}')
         if Address.osm_connection_num:
             self.print_log('i', 'main', f'Made {Address.osm_connection_num} OSM connections')
+        if ExifCache.connection:
+            self.print_log('i', 'main', f"Metadata cache: {ExifCache.run_stat['hits']} hits, "
+                                        f"{ExifCache.run_stat['misses']} misses")
+            ExifCache.close_exif_cache()
+        return True
+
+    def run_watch(self, folder_path: str) -> bool:
+        """
+        Watch the folder and its subfolders and process the folders, where new or changed files appear, until the
+        script is interrupted.
+        :param folder_path: full path of current folder, string
+        """
+        func.create_new_folder(join(Settings.app_folder, 'data'))
+
+        if not self.activate():
+            return False
+
+        folder_watch = FolderWatch(folder_path)
+        if not folder_watch.start():
+            return False
+        self.print_log('i', 'main', f'PVS watch started.')
+
+        DoneFolders.load()
+        Journal.recover()
+        Journal.start_journal()
+        GeoObjects.load_google_earth_kml(self.get_par('', 'gogle_geo_object_kml_file_path'))
+        ExifToolPool.start(max(self.get_par(0, 'exif_read_processes'), self.get_par(0, 'num_multi_processes')))
+        try:
+            folder_watch.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            folder_watch.stop()
+            if PVFile.exif_tool.running:
+                PVFile.exif_tool.terminate()
+            ExifToolPool.terminate()
+            Journal.close_journal()
+            DoneFolders.export_txt()
+            ExifCache.close_exif_cache()
+        self.print_log('i', 'main', f'PVS watch finished.')
+        return True
+
+    def print_plan(self, folder_path: str) -> bool:
+        """
+        Print the plan of the systematization of the folder and its subfolders without processing them.
+        :param folder_path: full path of current folder, string
+        """
+        if not self.activate():
+            return False
+        plan = TreePlan(folder_path)
+        plan.walk()
+        plan.print_plan(True)
         return True
 
     def activate(self) -> bool:
@@ -103,7 +178,7 @@ class PVS(Settings):
         for pv_file in pv_folder.folder_files.values():
             if pv_file.camera_key.upper() in cameras or 'ALL' in cameras:
                 pv_file.set_new_sd_and_coord_for_erase_coord()
-        pv_folder.set_folder_exif_tags()
+        pv_folder.set_folder_exif_tags(pv_folder.plan_folder_exif_writes())
         if self.get_par(True, 'recurrent'):
             self.recurrent_run(self.erase_folder_coord_rec, folder_path, cameras)
 
@@ -115,6 +190,7 @@ class PVS(Settings):
                                                          pv_file.new_coord,
                                                          pv_file.new_script_data,
                                                          self.get_par('XMP:UserComment', 'script_data_tag_name'))
+        ExifCache.update_files_tags({pv_file.file_path: pv_file.get_new_exif_tags_values()})
         PVFile.exif_tool.terminate()
 
     @staticmethod
@@ -142,7 +218,7 @@ class PVS(Settings):
 
         if pickle_data:
             exif_tags = pickle_data.get(file_path, {}).get('exif_tags', {})
-            sd_data = func.get_dict(str(exif_tags.get(PVS.get_par('', 'script_data_tag_name'), {})))
+            sd_data = func.decode_script_data(exif_tags.get(PVS.get_par('', 'script_data_tag_name'), ''))
         else:
             if func.file_path(scr_par.path):
                 pv_file = PVFile(None, file_path)
@@ -175,6 +251,7 @@ class PVS(Settings):
                               files_data: typing.Dict[str, dict]) -> typing.NoReturn:
         pv_folder = PVFolder(folder_path)
         pv_folder.build_main_data_structures()
+        pv_folder.load_folder_all_exif_tags()
         for pv_file in pv_folder.folder_files.values():
             files_data[pv_file.file_path] = {"group_name": pv_file.pv_group.name,
                                              "file_path": pv_file.file_path,
@@ -186,12 +263,14 @@ class PVS(Settings):
 
     # Get unique values of datasets about files. Can be done recursively for all subfolders.
     # The function for getting data from a file is data_func, which returns the required data.
+    # If data_func uses all metadata tags of files, all_exif_tags is True, so they are read by chunks for each folder.
     def get_files_report(self,
                          folder_path: str,
                          data_func: typing.Callable,
                          pickle_file_path: str,
                          report_type: str,
-                         *args: typing.Any) -> typing.NoReturn:
+                         *args: typing.Any,
+                         all_exif_tags: bool = False) -> typing.NoReturn:
         stat_data = []
         pickle_data = {}
         if pickle_file_path:
@@ -204,7 +283,7 @@ class PVS(Settings):
                 func.add_to_list(stat_data, data_func(file_data, *args))
         else:
             if func.dir_path(folder_path):
-                self.get_files_data_rec(folder_path, data_func, stat_data, *args)
+                self.get_files_data_rec(folder_path, data_func, stat_data, *args, all_exif_tags=all_exif_tags)
             else:
                 return
 
@@ -227,13 +306,17 @@ class PVS(Settings):
                            folder_path: str,
                            data_func: typing.Callable,
                            stat_data: typing.List[typing.Tuple[str, str]],
-                           *args: typing.Any) -> typing.NoReturn:
+                           *args: typing.Any,
+                           all_exif_tags: bool = False) -> typing.NoReturn:
         pv_folder = PVFolder(folder_path)
         pv_folder.build_main_data_structures()
+        if all_exif_tags:
+            pv_folder.load_folder_all_exif_tags()
         for pv_file in pv_folder.folder_files.values():
             func.add_to_list(stat_data, data_func(pv_file, *args))
         if self.get_par(True, 'recurrent'):
-            self.recurrent_run(self.get_files_data_rec, folder_path, data_func, stat_data, *args)
+            self.recurrent_run(self.get_files_data_rec, folder_path, data_func, stat_data, *args,
+                               all_exif_tags=all_exif_tags)
 
     @staticmethod
     def data_func_get_sd_all_tags(data_source: typing.Union[dict, PVFile]) -> \
@@ -242,7 +325,7 @@ class PVS(Settings):
         exif_tags = func.get_attr(data_source, 'exif_tags')
         sd_tag_val = []
         if exif_tags:
-            sd_data = func.get_dict(str(exif_tags.get(PVS.get_par('', 'script_data_tag_name'), {})))
+            sd_data = func.decode_script_data(exif_tags.get(PVS.get_par('', 'script_data_tag_name'), ''))
             if sd_data:
                 file_path = func.get_attr(data_source, 'file_path')
                 for sd_tag, sd_val in sd_data.items():
@@ -273,26 +356,27 @@ class PVS(Settings):
             return True
         return False
 
+    @staticmethod
+    def get_camera_info(data_source: typing.Union[dict, PVFile]) -> typing.Tuple[bool, str, str]:
+        # Camera of PVFile is already known, it is calculated only for the pre-read data.
+        if type(data_source) is PVFile:
+            return data_source.camera_found, data_source.camera_key, data_source.camera_full_key
+        return PVFile.get_file_camera_key(PVS.get_par([], 'EXIF_camera_id_tags_names'),
+                                          PVS.get_par({}, 'cameras'),
+                                          data_source['exif_tags'])
+
     @staticmethod
     def data_func_get_cam_data(data_source: typing.Union[dict, PVFile]) -> \
             typing.Union[typing.List[typing.Tuple[str, str]],
                          typing.Tuple[str, str]]:
-        exif_tags = func.get_attr(data_source, 'exif_tags')
-        cam_info = PVFile.get_file_camera_key(PVS.get_par([], 'EXIF_camera_id_tags_names'),
-                                              PVS.get_par({}, 'cameras'),
-                                              exif_tags)
-        camera_found, camera_key, camera_full_key = cam_info
+        camera_found, camera_key, camera_full_key = PVS.get_camera_info(data_source)
         return [(func.get_attr(data_source, 'file_path'), camera_full_key)]
 
     @staticmethod
     def data_func_get_cam_not(data_source: typing.Union[dict, PVFile]) -> \
             typing.Union[typing.List[typing.Tuple[str, str]],
                          typing.Tuple[str, str]]:
-        exif_tags = func.get_attr(data_source, 'exif_tags')
-        cam_info = PVFile.get_file_camera_key(PVS.get_par([], 'EXIF_camera_id_tags_names'),
-                                              PVS.get_par({}, 'cameras'),
-                                              exif_tags)
-        camera_found, camera_key, camera_full_key = cam_info
+        camera_found, camera_key, camera_full_key = PVS.get_camera_info(data_source)
         if camera_found:
             return [(func.get_attr(data_source, 'file_path'), 'camera_found')]
         else:
@@ -302,11 +386,7 @@ class PVS(Settings):
     def data_func_get_cam_ok(data_source: typing.Union[dict, PVFile]) -> \
             typing.Union[typing.List[typing.Tuple[str, str]],
                          typing.Tuple[str, str]]:
-        exif_tags = func.get_attr(data_source, 'exif_tags')
-        cam_info = PVFile.get_file_camera_key(PVS.get_par([], 'EXIF_camera_id_tags_names'),
-                                              PVS.get_par({}, 'cameras'),
-                                              exif_tags)
-        camera_found, camera_key, camera_full_key = cam_info
+        camera_found, camera_key, camera_full_key = PVS.get_camera_info(data_source)
         if camera_found:
             return [(func.get_attr(data_source, 'file_path'), camera_key)]
         else:
@@ -348,6 +428,21 @@ class PVS(Settings):
     def update_address_cache():
         Address.update_address_cache()
 
+    def print_exif_cache_stat(self) -> typing.NoReturn:
+        stat = ExifCache.get_exif_cache_stat()
+        if not stat:
+            self.print_log('w', 'tool', "Metadata cache is not used. Check 'use_exif_cache' setting.")
+            return
+        hits = stat.get('hits', 0)
+        misses = stat.get('misses', 0)
+        hit_ratio = f'{hits / (hits + misses):.1%}' if hits + misses else '-'
+        self.print_log('i', 'tool', f"Metadata cache: {ExifCache.db_file_path}")
+        self.print_log('i', 'tool', f" files = {stat['files']} of {self.get_par(0, 'exif_cache_max_files')}, "
+                                    f"size = {stat['size_mb']} MB")
+        self.print_log('i', 'tool', f" hits = {hits}, misses = {misses}, hit ratio = {hit_ratio}")
+        self.print_log('i', 'tool', f" updated after writing = {stat.get('patched', 0)}, "
+                                    f"evicted = {stat.get('evicted', 0)}")
+
     def all_file_types(self, folder_path, target_folder_path):
         target_folder_path = target_folder_path if target_folder_path else pvs_tool.get_par('', 'all_types_folder_path')
         if target_folder_path:
@@ -378,19 +473,19 @@ class PVS(Settings):
 
     def all_file_types_rec(self, folder_path, file_types):
         self.print_counter(f'Searching all file types. Folder: {folder_path}')
-        for file in [file for file in listdir(folder_path) if isfile(join(folder_path, file))]:
+        for file in FolderSnapshot(folder_path).get_files_names():
             ext = file.split('.')[-1].upper()
             if ext not in file_types.keys():
                 file_types[ext] = join(folder_path, file)
         if self.get_par(True, 'recurrent'):
             self.recurrent_run(self.all_file_types_rec, folder_path, file_types)
 
-    def recurrent_run(self, method, folder_path, *args):
+    def recurrent_run(self, method, folder_path, *args, **kwargs):
         ignore_sing = self.get_par('', 'ignore_sing')
         ignor_sign_len = len(ignore_sing)
-        for step_folder in [folder for folder in listdir(folder_path) if isdir(join(folder_path, folder))]:
+        for step_folder in FolderSnapshot(folder_path).folders:
             if (len(step_folder) >= ignor_sign_len and step_folder[:ignor_sign_len] != ignore_sing) or not ignore_sing:
-                method(join(folder_path, step_folder), *args)
+                method(join(folder_path, step_folder), *args, **kwargs)
 
 
 def create_parser():
@@ -408,6 +503,15 @@ def create_parser():
     sys_parser.add_argument('-rec_all', action='store_true')
     sys_parser.add_argument('-no_rec', action='store_true')
     sys_parser.add_argument('-mode', nargs='+', type=str, default='')
+    sys_parser.add_argument('-plan', action='store_true')
+
+    # Watch command parser.
+    watch_parser = subparsers.add_parser('watch')
+    watch_parser.add_argument('path')
+    watch_parser.add_argument('-rec', action='store_true')
+    watch_parser.add_argument('-rec_all', action='store_true')
+    watch_parser.add_argument('-no_rec', action='store_true')
+    watch_parser.add_argument('-mode', nargs='+', type=str, default='')
 
     # Tool command parser.
     # Common settings
@@ -436,6 +540,8 @@ def create_parser():
 
     tool_parser.add_argument('-update_address_cache', '-upd_cache', action='store_true')  # tool
 
+    tool_parser.add_argument('-exif_cache_stat', '-ecs', action='store_true')  # tool
+
     tool_parser.add_argument('-tzones', action='store_true')  # tool
 
     tool_parser.add_argument('-data2pickle', '-d2p', action='store_true')  # tool
@@ -443,6 +549,11 @@ def create_parser():
 
     tool_parser.add_argument('-all_file_types', '-at', action='store_true')  # tool
 
+    tool_parser.add_argument('-bench', nargs='+',
+                             choices=['exif_decode', 'script_data', 'objects', 'datetimes', 'exif_backends',
+                                      'grouping'])  # tool
+    tool_parser.add_argument('-bench_n', type=int, default=5000)  # parameter
+
     # Tools. Reports.
     # Common reports settings
     tool_parser.add_argument('-report_type', '-rt', choices=['all', 'a', 'unique', 'u'], default='u')  # parameter
@@ -478,7 +589,21 @@ if __name__ == '__main__':
                                       (scr_par.no_rec, '-no_rec', False))
         if run_flag and func.dir_path(scr_par.path):
             app = PVS(manual_settings=params, mode_preset_list=scr_par.mode)
-            app.run_systemize(scr_par.path)
+            if scr_par.plan:
+                app.print_plan(scr_par.path)
+            else:
+                app.run_systemize(scr_par.path)
+
+    elif scr_par.command == 'watch':
+        run_flag = func.set_man_flag(params, 'recurrent',
+                                     (scr_par.rec, '-rec', True),
+                                     (scr_par.rec_all, '-rec_all', True),
+                                     (scr_par.no_rec, '-no_rec', False))
+        run_flag &= func.set_man_flag(params, 'ignore_sing',
+                                      (scr_par.rec_all, '-rec_all', ''))
+        if run_flag and func.dir_path(scr_par.path):
+            app = PVS(manual_settings=params, mode_preset_list=scr_par.mode)
+            app.run_watch(scr_par.path)
 
     elif scr_par.command == 'tool':
         run_flag = func.set_man_flag(params, 'recurrent',
@@ -487,10 +612,12 @@ if __name__ == '__main__':
                                      (scr_par.no_rec, '-no_rec', False))
         run_flag &= func.set_man_flag(params, 'ignore_sing',
                                       (scr_par.rec_all, '-rec_all', ''))
+        # Tools select and report files by camera key.
+        PVFile.read_camera_tags = True
 
         # Print file EXIF tags
         if scr_par.exif:
-            pvs_tool = PVS()
+            pvs_tool = PVS(manual_settings=params)
             if pvs_tool.activate():
                 pvs_tool.print_exif_tags_file(scr_par.path, scr_par.pickle_file_path)
 
@@ -506,10 +633,33 @@ if __name__ == '__main__':
             if pvs_tool.activate():
                 pvs_tool.update_address_cache()
 
+        # Print metadata cache statistic
+        elif scr_par.exif_cache_stat:
+            pvs_tool = PVS()
+            if pvs_tool.activate():
+                pvs_tool.print_exif_cache_stat()
+
         # Print all available t-zones
         elif scr_par.tzones:
             func.print_all_t_zones()
 
+        # Run micro-benchmarks
+        elif scr_par.bench:
+            pvs_tool = PVS()
+            if pvs_tool.activate():
+                if 'exif_decode' in scr_par.bench:
+                    Bench.bench_exif_decode(scr_par.bench_n)
+                if 'script_data' in scr_par.bench:
+                    Bench.bench_script_data(scr_par.bench_n)
+                if 'objects' in scr_par.bench:
+                    Bench.bench_objects(scr_par.bench_n)
+                if 'datetimes' in scr_par.bench:
+                    Bench.bench_datetimes(scr_par.bench_n)
+                if 'exif_backends' in scr_par.bench:
+                    Bench.bench_exif_backends(scr_par.bench_n)
+                if 'grouping' in scr_par.bench:
+                    Bench.bench_grouping(scr_par.bench_n)
+
         # Manual add EXIF tag
         elif scr_par.add_exif_tag:
             if func.file_path(scr_par.path):
@@ -550,7 +700,8 @@ if __name__ == '__main__':
                 pvs_tool.get_files_report(scr_par.path,
                                           pvs_tool.data_func_get_sd_all_tags,
                                           scr_par.pickle_file_path,
-                                          scr_par.report_type)
+                                          scr_par.report_type,
+                                          all_exif_tags=True)
 
         # Print camera_key statistic
         elif run_flag and scr_par.cam_data:
@@ -587,7 +738,8 @@ if __name__ == '__main__':
                                           pvs_tool.data_func_get_exif_by_smpl,
                                           scr_par.pickle_file_path,
                                           scr_par.report_type,
-                                          scr_par.exif_tags)
+                                          scr_par.exif_tags,
+                                          all_exif_tags=True)
 
         # Copy one file for each file type to the folder
         elif run_flag and scr_par.all_file_types:
@@ -595,3 +747,7 @@ if __name__ == '__main__':
                 pvs_tool = PVS(manual_settings=params)
                 if pvs_tool.activate():
                     pvs_tool.all_file_types(scr_par.path, scr_par.target_folder_path)
+
+        # Save changes of the metadata cache made by the tool and stop reading processes.
+        ExifCache.close_exif_cache()
+        ExifToolPool.terminate()
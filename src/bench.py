@@ -0,0 +1,297 @@
+from __future__ import annotations
+import ast
+import json
+import os
+import re
+import sys
+import tempfile
+import tracemalloc
+import typing
+import uuid
+from datetime import datetime, timedelta
+from time import perf_counter
+from exiftool import exiftool
+from src import func
+from src.exif_pool import ExifToolPool
+from src.grouping import GroupPatterns
+from src.geo import Address
+from src.settings import Settings
+from src.structures import PVFile, PVGroup
+
+
+class Bench(Settings):
+    """
+    Micro-benchmarks of the script internals on synthetic data. They are run by the 'tool -bench' command.
+    """
+
+    @staticmethod
+    def measure(bench_func: typing.Callable, *args: typing.Any) -> typing.Tuple[float, float]:
+        """
+        Run the function twice: to measure time and to measure peak memory allocated by it.
+        :return: (time in seconds, peak memory in MB)
+        """
+        start = perf_counter()
+        bench_func(*args)
+        run_time = perf_counter() - start
+        tracemalloc.start()
+        bench_func(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        return run_time, peak_memory
+
+    @staticmethod
+    def print_results(title: str,
+                      results: typing.Dict[str, typing.Tuple[float, float]],
+                      items_num: int = 0) -> typing.NoReturn:
+        """
+        :param items_num: if it is set, the peak memory per item is printed too
+        """
+        Bench.print_log('i', 'tool', f'-------{title}-------')
+        for name, (run_time, peak_memory) in results.items():
+            per_item = f', {peak_memory * 1024 * 1024 / items_num:.0f} bytes per item' if items_num else ''
+            Bench.print_log('i', 'tool', f' {name}: {run_time:.3f} s, peak memory {peak_memory:.1f} MB{per_item}')
+
+    @staticmethod
+    def gen_exif_json_records(files_num: int, tags_num: int) -> typing.List[str]:
+        """
+        Generate records of ExifTool '-j -G -n' output for files_num files with tags_num tags each.
+        """
+        records = []
+        for file_num in range(files_num):
+            exif_tags = {'SourceFile': f'/photo/2020_05/IMG_{file_num:05}.JPG'}
+            for tag_num in range(tags_num):
+                exif_tags[f'EXIF:Tag{tag_num}'] = tag_num * 1.5 if tag_num % 3 else f'Value {tag_num}\nof {file_num}'
+            records.append(json.dumps(exif_tags, indent=2, ensure_ascii=False))
+        return records
+
+    @staticmethod
+    def bench_exif_decode(files_num: int) -> typing.NoReturn:
+        """
+        Compare the decoding of ExifTool output: the previous way - text of every file by ast.literal_eval and text of
+        a chunk of files by json.loads, the current way - records from raw bytes by func.get_exif_json_records.
+        """
+        records = Bench.gen_exif_json_records(files_num, 100)
+        files_exif_info = [('[' + record + ']\n').encode('utf-8') for record in records]
+        exif_info = ('[' + ',\n'.join(records) + ']\n').encode('utf-8')
+        del records
+
+        def decode_files_literal_eval():
+            for info in files_exif_info:
+                ast.literal_eval(info.decode('utf-8'))[0]
+
+        def decode_files_records():
+            for info in files_exif_info:
+                next(func.get_exif_json_records(info))
+
+        def decode_chunk_json_loads():
+            {tags['SourceFile']: tags for tags in json.loads(exif_info.decode('utf-8'))}
+
+        def decode_chunk_records():
+            {tags['SourceFile']: tags for tags in func.get_exif_json_records(exif_info)}
+
+        Bench.print_results(f'ExifTool output decoding, {files_num} files, 100 tags, '
+                            f'{len(exif_info) / 1024 / 1024:.1f} MB',
+                            {'one file, ast.literal_eval (previous)': Bench.measure(decode_files_literal_eval),
+                             'one file, records from bytes': Bench.measure(decode_files_records),
+                             'chunk, json.loads of text (previous)': Bench.measure(decode_chunk_json_loads),
+                             'chunk, records from bytes': Bench.measure(decode_chunk_records)})
+
+    @staticmethod
+    def bench_script_data(files_num: int) -> typing.NoReturn:
+        """
+        Compare reading of the script data tag in the legacy format (Python representation of the dictionary) and in
+        the current format (minified JSON with short keys), and the size of the tag in both formats.
+        """
+        script_data = {'pvs': '1.01', 'dt': '2016:08:11 14:46:02', 'dt_type': 'utc', 'dt_source': 'exif',
+                       't_zone': 'Europe/Rome', 'utc_dt': '2016:08:11 11:46:03', 'coord_source': 'geo_track',
+                       'address': {'road': 'Via San Giovanni Bosco', 'city': 'Ravenna', 'state': 'Emilia-Romagna',
+                                   'country': 'Italia', 'country_code': 'it', 'source': 'osm'},
+                       'first_dt': '2016:08:11 14:46:02', 'camera': 'NIKON_D300',
+                       'gr_id': '80609d14-259f-459c-b690-46224336adac', 'f_id': 'c1ac1eef-3098-46a6-a296-e641349460b4'}
+        legacy_tags = [str(dict(script_data, f_id=str(file_num))) for file_num in range(files_num)]
+        tags = [func.encode_script_data(dict(script_data, f_id=str(file_num))) for file_num in range(files_num)]
+
+        def read_legacy_tags():
+            for tag in legacy_tags:
+                func.sd_data(tag)
+
+        def read_tags():
+            for tag in tags:
+                func.sd_data(tag)
+
+        Bench.print_results(f'Script data reading, {files_num} tags. Tag size: legacy {len(legacy_tags[0])} bytes, '
+                            f'current {len(tags[0].encode("utf-8"))} bytes',
+                            {'legacy format': Bench.measure(read_legacy_tags),
+                             'current format': Bench.measure(read_tags)})
+
+    @staticmethod
+    def bench_objects(files_num: int) -> typing.NoReturn:
+        """
+        Compare the memory used by the objects of files and groups: the previous way - objects with __dict__, own
+        strings of camera keys and own empty address of each group, the current way - PVFile, PVGroup and Address
+        with __slots__, interned strings and the shared empty address. Each group has one file.
+        """
+        class DictObject:
+            pass
+
+        def new_dict_object(cls: type) -> DictObject:
+            return DictObject()
+
+        def new_dict_address() -> DictObject:
+            address = DictObject()
+            address.address = {}
+            address.tags = []
+            return address
+
+        def make_objects(new_object: typing.Callable, get_string: typing.Callable, new_address: typing.Callable):
+            base_datetime = datetime(2020, 5, 3, 10, 11, 12)
+            pv_groups = []
+            for file_num in range(files_num):
+                file_datetime = base_datetime + timedelta(seconds=file_num)
+                file_name = f'IMG_{file_num:05}.JPG'
+                pv_group = new_object(PVGroup)
+                for name, value in {'gr_id': str(uuid.uuid4()), 'pv_folder': None, 'name': file_name,
+                                    'new_name': f'2020_05_03-{file_num:05}.JPG', 'folder_path': '/photo/2020_05',
+                                    'folder_dt_name': '2020_05', 'group_files': [], 'file_datetime': file_datetime,
+                                    'utc_datetime': file_datetime, 'utc_relative_base_time': None,
+                                    'naming_datetime': file_datetime, 'local_datetime': file_datetime,
+                                    'local_datetime_type': 'utc', 'dt_offset': '', 'naming_warning': '',
+                                    'camera_key': get_string('NIKON', '_D300'), 'camera_found': True,
+                                    't_zone': 'Europe/Moscow', 'coord': (55.7, 37.6), 'coord_source': '', 'alt': 0,
+                                    'dt_source': 'exif', 'address': new_address(), 'sort_key': str(file_datetime),
+                                    'sort_ts': func.datetime_to_epoch(file_datetime),
+                                    'mac_tags_names': [], 'num': '', 'object_tags': [], 'new_f_name_core': ''}.items():
+                    setattr(pv_group, name, value)
+                pv_file = new_object(PVFile)
+                for name, value in {'prev_sd_value': '', 'f_id': str(uuid.uuid4()), 'gr_id': pv_group.gr_id,
+                                    'pv_group': pv_group, 'file_path': '/photo/2020_05/' + file_name,
+                                    'file_name': file_name, 'new_file_name': pv_group.new_name,
+                                    'new_file_path': '/photo/2020_05/' + pv_group.new_name,
+                                    'new_name_parts': {'prefix': '', 'suffix': '', 'ext': ''}, 'all_exif_tags': None,
+                                    'coord_source': get_string('', ''), 'coord': (55.7, 37.6), 'alt': 0,
+                                    'prev_alt': 0, 'prev_coord': (55.7, 37.6), 'script_data': {},
+                                    'new_script_data': {}, 'new_coord': {}, 'utc_datetime': file_datetime,
+                                    'file_datetime': file_datetime, 'first_datetime': file_datetime,
+                                    'file_naming_datetime': file_datetime,
+                                    'file_ts': func.datetime_to_epoch(file_datetime),
+                                    'dt_source': get_string('ex', 'if'),
+                                    'camera_key': get_string('NIKON', '_D300'),
+                                    'camera_full_key': get_string('EXIF:Make=NIKON CORPORATION_',
+                                                                  'EXIF:Model=NIKON D300'),
+                                    'camera_found': True, 'mac_tags_names': [], 'sidecar_path': ''}.items():
+                    setattr(pv_file, name, value)
+                pv_group.group_files.append(pv_file)
+                pv_groups.append(pv_group)
+            return pv_groups
+
+        def make_dict_objects():
+            make_objects(new_dict_object, lambda *parts: ''.join(parts), new_dict_address)
+
+        def make_slots_objects():
+            make_objects(object.__new__, lambda *parts: sys.intern(''.join(parts)), Address.get_empty_address)
+
+        Bench.print_results(f'Objects of files and groups, {files_num} files',
+                            {'objects with __dict__ (previous)': Bench.measure(make_dict_objects),
+                             'objects with __slots__': Bench.measure(make_slots_objects)},
+                            files_num)
+
+    @staticmethod
+    def bench_datetimes(files_num: int) -> typing.NoReturn:
+        """
+        Compare parsing of creation date and time tags: the previous way - datetime.strptime for each value, the current
+        way - func.parse_exif_datetimes for the values of all files at once. Every tenth value has subseconds and
+        a time zone offset, every hundredth value is malformed.
+        """
+        base_datetime = datetime(2020, 5, 3, 10, 11, 12)
+        dt_values = []
+        for file_num in range(files_num):
+            dt_value = (base_datetime + timedelta(seconds=file_num // 3)).strftime('%Y:%m:%d %H:%M:%S')
+            if not file_num % 100:
+                dt_value = '0000:00:00 00:00:00'
+            elif not file_num % 10:
+                dt_value += '.25+03:00'
+            dt_values.append(dt_value)
+
+        def parse_strptime():
+            [func.string_to_datetime(dt_value, '%Y:%m:%d %H:%M:%S') for dt_value in dt_values]
+
+        def parse_batch():
+            func.parse_exif_datetimes(dt_values)
+
+        Bench.print_results(f'Date and time parsing, {files_num} values',
+                            {'datetime.strptime of each value (previous)': Bench.measure(parse_strptime),
+                             'batch fixed format parsing': Bench.measure(parse_batch)})
+
+    @staticmethod
+    def bench_exif_backends(files_num: int) -> typing.NoReturn:
+        """
+        Compare writing of the script data and coordinates to XMP files by one ExifTool process and by the pool of
+        'num_multi_processes' ExifTool processes with the 'process' and 'thread' backends. Starting and stopping of
+        the processes are included in the time.
+        """
+        num_proc = max(Bench.get_par(0, 'num_multi_processes'), 1)
+        chunk_size = max(Bench.get_par(100, 'exif_write_chunk_size'), 1)
+        script_data_tag_name = Bench.get_par('XMP:UserComment', 'script_data_tag_name')
+        with tempfile.TemporaryDirectory(prefix='pvs_bench_') as folder_path:
+            files_exif_data = []
+            for file_num in range(files_num):
+                file_path = os.path.join(folder_path, f'IMG_{file_num:05}.xmp')
+                with open(file_path, 'w', encoding='utf-8') as xmp_file:
+                    xmp_file.write("<?xpacket begin='' id='W5M0MpCehiHzreSzNTczkc9d'?>\n"
+                                   "<x:xmpmeta xmlns:x='adobe:ns:meta/'></x:xmpmeta>\n<?xpacket end='w'?>")
+                files_exif_data.append({'file_path': file_path, 'sidecar': True,
+                                        'new_coord': {'GPSLatitude': f'{55.7 + file_num / 1e5:.6f}',
+                                                      'GPSLatitudeRef': 'N', 'GPSLongitude': '37.6',
+                                                      'GPSLongitudeRef': 'E', 'GPSAltitude': '150.0',
+                                                      'GPSAltitudeRef': '0'},
+                                        'new_script_data': {'f_id': str(uuid.uuid4()), 'pvs': '1.01'}})
+
+            def write_one_process():
+                exif_tool = exiftool.ExifTool()
+                exif_tool.run()
+                for i in range(0, files_num, chunk_size):
+                    func.set_files_exif_tags(exif_tool, files_exif_data[i:i + chunk_size], script_data_tag_name)
+                exif_tool.terminate()
+
+            def write_pool(backend: str):
+                ExifToolPool.start(num_proc, backend)
+                try:
+                    ExifToolPool.set_files_exif_tags(files_exif_data, chunk_size, num_proc, script_data_tag_name)
+                finally:
+                    ExifToolPool.terminate()
+
+            Bench.print_results(f'Writing metadata of {files_num} XMP files by {chunk_size} files, '
+                                f'{num_proc} processes',
+                                {'one process': Bench.measure(write_one_process),
+                                 'process backend': Bench.measure(write_pool, 'process'),
+                                 'thread backend': Bench.measure(write_pool, 'thread')})
+
+    @staticmethod
+    def bench_grouping(files_num: int) -> typing.NoReturn:
+        """
+        Compare getting the name keys of files by the 'masters', 'slaves' and 'additions' patterns of the settings:
+        the previous way - re.findall with upper-cased pattern and file name for each pair of file and pattern,
+        the current way - GroupPatterns compiled once for each setting.
+        """
+        patterns_settings = [Bench.get_par({}, pattern_type) for pattern_type in ('masters', 'slaves', 'additions')]
+        case_sens = Bench.get_par(False, 'group_pattern_case_sensitive')
+        extensions = ['NEF', 'jpg', 'xmp', 'MOV', 'JPG', 'DNG']
+        files_names = [f'DSC_{file_num // 3:05}.{extensions[file_num % len(extensions)]}'
+                       for file_num in range(files_num)]
+
+        def get_keys_findall():
+            for file in files_names:
+                for patterns in patterns_settings:
+                    for pattern in patterns:
+                        re.findall(pattern, file) if case_sens else re.findall(pattern.upper(), file.upper())
+
+        def get_keys_compiled():
+            group_patterns = [GroupPatterns(patterns, case_sens) for patterns in patterns_settings]
+            for file in files_names:
+                for patterns in group_patterns:
+                    patterns.get_name_keys(file)
+
+        Bench.print_results(f'Name keys of files for grouping, {files_num} files, '
+                            f'{sum(len(patterns) for patterns in patterns_settings)} patterns',
+                            {'re.findall for each file and pattern (previous)': Bench.measure(get_keys_findall),
+                             'patterns compiled once': Bench.measure(get_keys_compiled)})
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import json
+import os
+import typing
+from src import func
+from src.settings import Settings
+
+
+class DoneFolders(Settings):
+    """
+    Registry of the processed folders. The registry file is append-only: one line with the folder path in JSON format
+    is added after each processed folder. The file is read once by each process into a set, so checking a folder and
+    adding it do not depend on the number of processed folders. The text list 'done_folders_txt_file_path' is
+    exported from the registry at the end of the run.
+    """
+    done_folders = None
+    registry_file_path = ''
+
+    @staticmethod
+    def reset() -> typing.NoReturn:
+        """
+        Start a new job: the registry is cleared.
+        """
+        DoneFolders.registry_file_path = DoneFolders.get_par('', 'done_folders_file_path')
+        with DoneFolders.lock_shared_files():
+            open(DoneFolders.registry_file_path, 'w').close()
+        DoneFolders.done_folders = set()
+
+    @staticmethod
+    def load() -> typing.NoReturn:
+        """
+        Read the registry, if it is not read yet. An incomplete last line after an interrupt is ignored and closed,
+        so the next folder is added by a new line. The registry is created from the list of done folders of previous
+        versions of the script, stored in the default pickle file, if there is no registry yet.
+        """
+        registry_file_path = DoneFolders.get_par('', 'done_folders_file_path')
+        if DoneFolders.done_folders is not None and DoneFolders.registry_file_path == registry_file_path:
+            return
+        DoneFolders.registry_file_path = registry_file_path
+        DoneFolders.done_folders = set()
+        with DoneFolders.lock_shared_files():
+            if not os.path.isfile(registry_file_path):
+                DoneFolders.import_pickle_list()
+                return
+            with open(registry_file_path, 'r', encoding='utf-8') as file:
+                body = file.read()
+            for line in body.splitlines():
+                try:
+                    DoneFolders.done_folders.add(json.loads(line))
+                except ValueError:
+                    continue
+            if body and not body.endswith('\n'):
+                with open(registry_file_path, 'a', encoding='utf-8') as file:
+                    file.write('\n')
+
+    @staticmethod
+    def import_pickle_list() -> typing.NoReturn:
+        pickle_file_path = os.path.join(DoneFolders.app_folder, 'data', 'pvs_done_folders_list.pickle')
+        done_folders_list = func.load_pickle_file_as_struct(pickle_file_path, []) \
+            if os.path.isfile(pickle_file_path) else []
+        with open(DoneFolders.registry_file_path, 'w', encoding='utf-8') as file:
+            for folder_path in done_folders_list:
+                file.write(json.dumps(folder_path, ensure_ascii=False) + '\n')
+        DoneFolders.done_folders.update(done_folders_list)
+
+    @staticmethod
+    def is_done(folder_path: str) -> bool:
+        DoneFolders.load()
+        return folder_path in DoneFolders.done_folders
+
+    @staticmethod
+    def add(folder_path: str) -> typing.NoReturn:
+        """
+        Add the folder to the registry. The line is written to the disk before the next folder is started.
+        """
+        DoneFolders.load()
+        if folder_path in DoneFolders.done_folders:
+            return
+        with DoneFolders.lock_shared_files():
+            with open(DoneFolders.registry_file_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(folder_path, ensure_ascii=False) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+        DoneFolders.done_folders.add(folder_path)
+
+    @staticmethod
+    def discard(folder_path: str) -> typing.NoReturn:
+        """
+        Let the folder be processed again in the current run. The registry file is not changed, the folder is added
+        to it again after the processing.
+        """
+        DoneFolders.load()
+        DoneFolders.done_folders.discard(folder_path)
+
+    @staticmethod
+    def export_txt() -> typing.NoReturn:
+        """
+        Save the list of done folders of the registry in the text file 'done_folders_txt_file_path'. The registry file
+        is read again, because folders can be added to it by other processes.
+        """
+        txt_file_path = DoneFolders.get_par('', 'done_folders_txt_file_path')
+        registry_file_path = DoneFolders.get_par('', 'done_folders_file_path')
+        if not txt_file_path or not os.path.isfile(registry_file_path):
+            return
+        done_folders = {}
+        with open(registry_file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    done_folders[json.loads(line)] = True
+                except ValueError:
+                    continue
+        func.save_struct_as_txt_file(txt_file_path, list(done_folders), 'done_folders')
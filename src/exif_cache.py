@@ -0,0 +1,229 @@
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import typing
+from time import time
+from src.settings import Settings
+
+
+class ExifCache(Settings):
+    """
+    Persistent cache of the files metadata stored in the SQLite database. Cached metadata of a file is used while
+    the path, size, modification time and inode of the file are the same as when the metadata was read.
+    """
+    connection = None
+    db_file_path = ''
+    # The database is used by several worker processes at once, see FolderScheduler. Each change is committed at once,
+    # so a process does not keep the database locked while it processes a folder.
+    shared = False
+    # Statistic of the current run and the part of it already saved in the database.
+    run_stat = {'hits': 0, 'misses': 0, 'patched': 0, 'evicted': 0}
+    saved_stat = {'hits': 0, 'misses': 0, 'patched': 0, 'evicted': 0}
+    # Last use time of cache entries, which is not saved yet. It is used for eviction of the oldest entries.
+    used_paths = {}
+
+    @staticmethod
+    def connect() -> bool:
+        """
+        Open the cache database if the cache is switched on by the 'use_exif_cache' setting.
+        :return: True if the cache is ready to use
+        """
+        if not ExifCache.get_par(False, 'use_exif_cache'):
+            return False
+        if ExifCache.connection:
+            return True
+        db_file_path = ExifCache.get_par('', 'exif_cache_file_path')
+        if not db_file_path:
+            return False
+        try:
+            if ExifCache.shared:
+                ExifCache.connection = sqlite3.connect(db_file_path, timeout=60, isolation_level=None)
+                ExifCache.connection.execute("PRAGMA journal_mode=WAL")
+            else:
+                ExifCache.connection = sqlite3.connect(db_file_path)
+            ExifCache.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "inode INTEGER, read_args TEXT, tags TEXT, last_used REAL);"
+                "CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used);"
+                "CREATE TABLE IF NOT EXISTS stat (name TEXT PRIMARY KEY, value INTEGER);")
+        except sqlite3.Error as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.connect) Can't open metadata cache {db_file_path}: {ex}")
+            ExifCache.connection = None
+            return False
+        ExifCache.db_file_path = db_file_path
+        return True
+
+    @staticmethod
+    def get_file_key(file_path: str, stat_func: typing.Callable = os.stat) -> typing.Optional[typing.Tuple[int, ...]]:
+        """
+        :return: (size, modification time, inode) of the file. The stat of a folder scan has no inode on Windows,
+        so it is taken by os.stat then, as the keys written after the metadata writes are.
+        """
+        try:
+            file_stat = stat_func(file_path)
+            if not file_stat.st_ino and stat_func is not os.stat:
+                file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+    @staticmethod
+    def get_files_tags(files_paths: typing.List[str],
+                       read_args: typing.List[str],
+                       stat_func: typing.Callable[[str], os.stat_result] = os.stat) -> typing.Dict[str, dict]:
+        """
+        Get cached metadata of files.
+        Metadata read with all tags ('full' read mode) is suitable for any read arguments.
+        :param files_paths: list of full files paths
+        :param read_args: ExifTool read arguments, see PVFile.get_exif_read_args
+        :param stat_func: function to get the stat of a file, for example FolderSnapshot.get_stat
+        :return: {file_path: exif_tags} only for files found in the cache
+        """
+        if not ExifCache.connect() or not files_paths:
+            return {}
+        read_args_str = ' '.join(read_args)
+        tags_by_file_path = {}
+        now = time()
+        try:
+            for i in range(0, len(files_paths), 500):
+                chunk = files_paths[i:i + 500]
+                rows = ExifCache.connection.execute(f"SELECT path, size, mtime_ns, inode, read_args, tags FROM files "
+                                                    f"WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                for path, size, mtime_ns, inode, entry_read_args, tags in rows:
+                    if (entry_read_args == read_args_str or not entry_read_args) and \
+                            ExifCache.get_file_key(path, stat_func) == (size, mtime_ns, inode):
+                        tags_by_file_path[path] = json.loads(tags)
+                        ExifCache.used_paths[path] = now
+        except (sqlite3.Error, ValueError) as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.get_files_tags) {ex}")
+        ExifCache.run_stat['hits'] += len(tags_by_file_path)
+        ExifCache.run_stat['misses'] += len(files_paths) - len(tags_by_file_path)
+        return tags_by_file_path
+
+    @staticmethod
+    def put_files_tags(tags_by_file_path: typing.Dict[str, dict],
+                       read_args: typing.List[str],
+                       stat_func: typing.Callable[[str], os.stat_result] = os.stat) -> typing.NoReturn:
+        """
+        :param stat_func: function to get the stat of a file, for example FolderSnapshot.get_stat
+        """
+        if not ExifCache.connect() or not tags_by_file_path:
+            return
+        read_args_str = ' '.join(read_args)
+        now = time()
+        rows = []
+        for file_path, exif_tags in tags_by_file_path.items():
+            file_key = ExifCache.get_file_key(file_path, stat_func)
+            if file_key and exif_tags:
+                rows.append((file_path, *file_key, read_args_str, json.dumps(exif_tags), now))
+        try:
+            ExifCache.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.put_files_tags) {ex}")
+
+    @staticmethod
+    def update_files_tags(new_tags_by_file_path: typing.Dict[str, dict]) -> typing.NoReturn:
+        """
+        Update cached metadata after writing tags by the script.
+        If the file was not changed by ExifTool (write error), the entry is kept as is. Entries read with all tags
+        are removed, because the written tags also change other tags of the file.
+        :param new_tags_by_file_path: {file_path: {tag_name: new value or None to remove the tag}}
+        """
+        if not ExifCache.connect() or not new_tags_by_file_path:
+            return
+        try:
+            for file_path, new_tags in new_tags_by_file_path.items():
+                row = ExifCache.connection.execute("SELECT size, mtime_ns, inode, read_args, tags FROM files "
+                                                   "WHERE path = ?", (file_path,)).fetchone()
+                if not row:
+                    continue
+                file_key = ExifCache.get_file_key(file_path)
+                if file_key == tuple(row[:3]):
+                    continue
+                if not file_key or not row[3]:
+                    ExifCache.remove_file(file_path)
+                    continue
+                exif_tags = json.loads(row[4])
+                for tag_name, tag_value in new_tags.items():
+                    if tag_value is None:
+                        exif_tags.pop(tag_name, None)
+                    else:
+                        exif_tags[tag_name] = tag_value
+                ExifCache.connection.execute("UPDATE files SET size = ?, mtime_ns = ?, inode = ?, tags = ? "
+                                             "WHERE path = ?", (*file_key, json.dumps(exif_tags), file_path))
+                ExifCache.run_stat['patched'] += 1
+        except (sqlite3.Error, ValueError) as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.update_files_tags) {ex}")
+
+    @staticmethod
+    def rename_file(file_path: str, new_file_path: str) -> typing.NoReturn:
+        if not ExifCache.connect() or file_path == new_file_path:
+            return
+        try:
+            ExifCache.connection.execute("DELETE FROM files WHERE path = ?", (new_file_path,))
+            ExifCache.connection.execute("UPDATE files SET path = ? WHERE path = ?", (new_file_path, file_path))
+        except sqlite3.Error as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.rename_file) {ex}")
+        if file_path in ExifCache.used_paths:
+            ExifCache.used_paths[new_file_path] = ExifCache.used_paths.pop(file_path)
+
+    @staticmethod
+    def remove_file(file_path: str) -> typing.NoReturn:
+        if not ExifCache.connect():
+            return
+        try:
+            ExifCache.connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+        except sqlite3.Error as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.remove_file) {ex}")
+        ExifCache.used_paths.pop(file_path, None)
+
+    @staticmethod
+    def save_exif_cache() -> typing.NoReturn:
+        """
+        Save use time of entries and statistic, remove the least recently used entries over 'exif_cache_max_files'
+        and commit changes.
+        """
+        if not ExifCache.connection:
+            return
+        try:
+            ExifCache.connection.executemany("UPDATE files SET last_used = ? WHERE path = ?",
+                                             [(used, path) for path, used in ExifCache.used_paths.items()])
+            ExifCache.used_paths.clear()
+
+            max_files = ExifCache.get_par(0, 'exif_cache_max_files')
+            files_num = ExifCache.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            if 0 < max_files < files_num:
+                ExifCache.connection.execute("DELETE FROM files WHERE path IN "
+                                             "(SELECT path FROM files ORDER BY last_used LIMIT ?)",
+                                             (files_num - max_files,))
+                ExifCache.run_stat['evicted'] += files_num - max_files
+
+            for name, value in ExifCache.run_stat.items():
+                ExifCache.connection.execute("INSERT OR IGNORE INTO stat VALUES (?, 0)", (name,))
+                ExifCache.connection.execute("UPDATE stat SET value = value + ? WHERE name = ?",
+                                             (value - ExifCache.saved_stat[name], name))
+                ExifCache.saved_stat[name] = value
+            ExifCache.connection.commit()
+        except sqlite3.Error as ex:
+            ExifCache.print_log('e', 'main', f"(ExifCache.save_exif_cache) {ex}")
+
+    @staticmethod
+    def close_exif_cache() -> typing.NoReturn:
+        if ExifCache.connection:
+            ExifCache.save_exif_cache()
+            ExifCache.connection.close()
+            ExifCache.connection = None
+
+    @staticmethod
+    def get_exif_cache_stat() -> typing.Dict[str, typing.Any]:
+        """
+        Get the statistic of the cache: number of entries, size of the database file and the saved counters of all
+        runs.
+        """
+        if not ExifCache.connect():
+            return {}
+        stat = {'files': ExifCache.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                'size_mb': round(os.path.getsize(ExifCache.db_file_path) / 1024 / 1024, 2)}
+        stat.update({name: value for name, value in ExifCache.connection.execute("SELECT name, value FROM stat")})
+        return stat
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import math
+import queue
+import typing
+import multiprocessing.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
+from exiftool import exiftool
+from src import func
+from src.settings import Settings
+
+
+class ExifToolPool(Settings):
+    """
+    Pool of persistent ExifTool processes for parallel reading and writing of the files metadata.
+    The pool is started once for the whole run and is used by all folders. Backends:
+    'thread' - each pool thread takes a free ExifTool process for a chunk of files, so the processes work at the same
+    time while the threads only wait for their answers. Files data is not copied between processes.
+    'process' - each worker process of the pool runs its own ExifTool process. Files data and results are pickled.
+    """
+    exif_tools = []
+    free_exif_tools = queue.Queue()
+    executor = None
+    backend = ''
+    num_proc = 0
+    # ExifTool of the current worker process of the 'process' backend
+    process_exif_tool = None
+
+    @staticmethod
+    def start(num_proc: int, backend: str = '') -> typing.NoReturn:
+        """
+        Start the pool of num_proc ExifTool processes. A running pool with enough processes is kept as is.
+        :param backend: 'thread' or 'process', by default from the 'exif_tool_backend' setting
+        """
+        backend = backend or ExifToolPool.get_par('thread', 'exif_tool_backend')
+        if ExifToolPool.executor and ExifToolPool.backend == backend and ExifToolPool.num_proc >= num_proc:
+            return
+        ExifToolPool.terminate()
+        if num_proc <= 0:
+            return
+        if backend == 'process':
+            ExifToolPool.executor = ProcessPoolExecutor(max_workers=num_proc,
+                                                        initializer=ExifToolPool.init_worker_process)
+        else:
+            for _ in range(num_proc):
+                exif_tool = exiftool.ExifTool()
+                exif_tool.run()
+                ExifToolPool.exif_tools.append(exif_tool)
+                ExifToolPool.free_exif_tools.put(exif_tool)
+            ExifToolPool.executor = ThreadPoolExecutor(max_workers=num_proc, thread_name_prefix='exif_tool')
+        ExifToolPool.backend = backend
+        ExifToolPool.num_proc = num_proc
+
+    @staticmethod
+    def init_worker_process() -> typing.NoReturn:
+        """
+        Start ExifTool of a worker process of the 'process' backend. It is stopped when the worker process exits.
+        """
+        exif_tool = exiftool.ExifTool()
+        exif_tool.run()
+        ExifToolPool.process_exif_tool = exif_tool
+        multiprocessing.util.Finalize(exif_tool, exif_tool.terminate, exitpriority=10)
+
+    @staticmethod
+    def terminate() -> typing.NoReturn:
+        """
+        Stop the pool. Chunks not started yet are cancelled, started chunks are finished before ExifTool processes
+        are stopped, so no file is left half-written.
+        """
+        if ExifToolPool.executor:
+            ExifToolPool.executor.shutdown(wait=True, cancel_futures=True)
+            ExifToolPool.executor = None
+        for exif_tool in ExifToolPool.exif_tools:
+            if exif_tool.running:
+                exif_tool.terminate()
+        ExifToolPool.exif_tools = []
+        ExifToolPool.free_exif_tools = queue.Queue()
+        ExifToolPool.backend = ''
+        ExifToolPool.num_proc = 0
+
+    @staticmethod
+    def get_chunk_size(files_num: int, chunk_size: int, num_proc: int) -> int:
+        """
+        Every process gets its share of the files, but no more than chunk_size files in one chunk.
+        :param num_proc: number of processes to share the files among, 0 - all processes of the pool
+        """
+        num_proc = min(num_proc, ExifToolPool.num_proc) if num_proc > 0 else ExifToolPool.num_proc
+        return max(1, min(chunk_size, math.ceil(files_num / num_proc)))
+
+    @staticmethod
+    def take_exif_tool() -> exiftool.ExifTool:
+        return ExifToolPool.process_exif_tool or ExifToolPool.free_exif_tools.get()
+
+    @staticmethod
+    def release_exif_tool(exif_tool: exiftool.ExifTool) -> typing.NoReturn:
+        if exif_tool is not ExifToolPool.process_exif_tool:
+            ExifToolPool.free_exif_tools.put(exif_tool)
+
+    @staticmethod
+    def read_chunk(files_paths: typing.List[str], *args: str) -> typing.Dict[str, dict]:
+        exif_tool = ExifToolPool.take_exif_tool()
+        try:
+            return func.get_files_exif_tags(exif_tool, files_paths, len(files_paths), *args)
+        finally:
+            ExifToolPool.release_exif_tool(exif_tool)
+
+    @staticmethod
+    def write_chunk(files_exif_data: typing.List[dict], script_data_tag_name: str) -> typing.Dict[str, str]:
+        exif_tool = ExifToolPool.take_exif_tool()
+        try:
+            return func.set_files_exif_tags(exif_tool, files_exif_data, script_data_tag_name)
+        finally:
+            ExifToolPool.release_exif_tool(exif_tool)
+
+    @staticmethod
+    def get_files_exif_tags(files_paths: typing.List[str],
+                            chunk_size: int,
+                            num_proc: int,
+                            *args: str) -> typing.Dict[str, dict]:
+        """
+        Read metadata of the files by the processes of the pool.
+        :param files_paths: full paths of the files
+        :param chunk_size: maximum number of files in one ExifTool call
+        :param num_proc: number of processes to share the files among, 0 - all processes of the pool
+        :param args: additional ExifTool arguments, for example the list of tags to read
+        :return: dictionary {file path: exif tags} in the order of files_paths. Files that could not be read are
+        missing in the result.
+        """
+        if not ExifToolPool.executor or not files_paths:
+            return {}
+        chunk_size = ExifToolPool.get_chunk_size(len(files_paths), chunk_size, num_proc)
+        futures = [ExifToolPool.executor.submit(ExifToolPool.read_chunk, files_paths[i:i + chunk_size], *args)
+                   for i in range(0, len(files_paths), chunk_size)]
+        files_exif_tags = {}
+        for future in futures:
+            # Files of a failed chunk are missing in the result, for example if the worker process crashed.
+            try:
+                files_exif_tags.update(future.result())
+            except Exception as ex:
+                ExifToolPool.print_log('e', 'main', f"(ExifToolPool.get_files_exif_tags) {ex!r}")
+        return {file_path: files_exif_tags[file_path] for file_path in files_paths if file_path in files_exif_tags}
+
+    @staticmethod
+    def set_files_exif_tags(files_exif_data: typing.List[dict],
+                            chunk_size: int,
+                            num_proc: int,
+                            script_data_tag_name: str,
+                            progress: typing.Callable[[int, int], typing.Any] = None) -> typing.Dict[str, str]:
+        """
+        Write metadata of the files by the processes of the pool.
+        :param files_exif_data: list of files data, see func.set_files_exif_tags
+        :param chunk_size: maximum number of files in one ExifTool call
+        :param num_proc: number of processes to share the files among, 0 - all processes of the pool
+        :param script_data_tag_name: name of the tag to write the script data
+        :param progress: function called after each chunk with the number of the first file of the chunk in
+        files_exif_data and the number of files in the chunk
+        :return: dictionary {file path: error} of files with errors
+        """
+        if not ExifToolPool.executor or not files_exif_data:
+            return {}
+        chunk_size = ExifToolPool.get_chunk_size(len(files_exif_data), chunk_size, num_proc)
+        futures: typing.Dict[Future, int] = {}
+        for chunk_begin in range(0, len(files_exif_data), chunk_size):
+            futures[ExifToolPool.executor.submit(ExifToolPool.write_chunk,
+                                                 files_exif_data[chunk_begin:chunk_begin + chunk_size],
+                                                 script_data_tag_name)] = chunk_begin
+        exif_errors = {}
+        for future in as_completed(futures):
+            chunk = files_exif_data[futures[future]:futures[future] + chunk_size]
+            try:
+                exif_errors.update(future.result())
+            except Exception as ex:
+                exif_errors.update({file_exif_data['file_path']: str(ex) for file_exif_data in chunk})
+            if progress:
+                progress(futures[future], len(chunk))
+        return exif_errors
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import math
+import os
+import sys
+import typing
+
+AT_FDCWD = -100
+STATX_MTIME = 0x40
+STATX_BTIME = 0x800
+
+
+class StatxTimestamp(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_int64), ('tv_nsec', ctypes.c_uint32), ('reserved', ctypes.c_int32)]
+
+
+class Statx(ctypes.Structure):
+    """
+    struct statx of Linux, see statx(2).
+    """
+    _fields_ = [('stx_mask', ctypes.c_uint32), ('stx_blksize', ctypes.c_uint32),
+                ('stx_attributes', ctypes.c_uint64),
+                ('stx_nlink', ctypes.c_uint32), ('stx_uid', ctypes.c_uint32), ('stx_gid', ctypes.c_uint32),
+                ('stx_mode', ctypes.c_uint16), ('spare0', ctypes.c_uint16),
+                ('stx_ino', ctypes.c_uint64), ('stx_size', ctypes.c_uint64), ('stx_blocks', ctypes.c_uint64),
+                ('stx_attributes_mask', ctypes.c_uint64),
+                ('stx_atime', StatxTimestamp), ('stx_btime', StatxTimestamp),
+                ('stx_ctime', StatxTimestamp), ('stx_mtime', StatxTimestamp),
+                ('stx_rdev_major', ctypes.c_uint32), ('stx_rdev_minor', ctypes.c_uint32),
+                ('stx_dev_major', ctypes.c_uint32), ('stx_dev_minor', ctypes.c_uint32),
+                ('spare2', ctypes.c_uint64 * 14)]
+
+
+class FileTimes:
+    """
+    Creation (birth) and modification times of files from the file system, used when a file has no creation date and
+    time in its metadata. The birth time is taken from the stat result where the system provides it (macOS, BSD,
+    Windows), and by the statx call of the C library on Linux, where one call gives both times. If the file system
+    does not store the birth time, it is NaN and the modification time is used.
+    """
+    # statx function of the C library, False if it is not available
+    statx = None
+
+    @staticmethod
+    def get_statx() -> typing.Optional[typing.Callable]:
+        if FileTimes.statx is None:
+            FileTimes.statx = False
+            if sys.platform.startswith('linux'):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                    statx = libc.statx
+                    statx.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint,
+                                      ctypes.POINTER(Statx)]
+                    statx.restype = ctypes.c_int
+                    FileTimes.statx = statx
+                except (OSError, AttributeError):
+                    pass
+        return FileTimes.statx or None
+
+    @staticmethod
+    def get_file_times(file_path: str,
+                       file_stat: typing.Optional[os.stat_result] = None) -> typing.Tuple[float, float]:
+        """
+        :param file_stat: stat result of the file if it is known already, it is used when it has the birth time
+        :return: (birth time or NaN, modification time) in epoch seconds
+        """
+        if file_stat is not None and hasattr(file_stat, 'st_birthtime'):
+            return file_stat.st_birthtime or math.nan, file_stat.st_mtime
+        statx = FileTimes.get_statx()
+        if statx:
+            buf = Statx()
+            if statx(AT_FDCWD, os.fsencode(file_path), 0, STATX_BTIME | STATX_MTIME, ctypes.byref(buf)) == 0:
+                birthtime = buf.stx_btime.tv_sec + buf.stx_btime.tv_nsec / 1e9 \
+                    if buf.stx_mask & STATX_BTIME and buf.stx_btime.tv_sec else math.nan
+                return birthtime, buf.stx_mtime.tv_sec + buf.stx_mtime.tv_nsec / 1e9
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+        return getattr(file_stat, 'st_birthtime', 0) or math.nan, file_stat.st_mtime
@@ -0,0 +1,148 @@
+from __future__ import annotations
+import heapq
+import io
+import logging
+import math
+import multiprocessing as mp
+import multiprocessing.util
+import re
+import sys
+import typing
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from exiftool import exiftool
+from src.geo import GeoObjects, Address
+from src.exif_cache import ExifCache
+from src.exif_pool import ExifToolPool
+from src.journal import Journal
+from src.settings import Settings
+from src.structures import PVFolder, PVFile
+from src.tree_plan import TreePlan
+
+
+class WholeLinesOutput(io.TextIOBase):
+    """
+    Output of a worker process, which writes only whole lines, one line by one write, so the lines printed by
+    the workers at the same time are not mixed. A line ends with a new line or with a carriage return of the
+    counter lines, see Settings.print_counter.
+    """
+
+    def __init__(self, stream: typing.TextIO):
+        self.stream = stream
+        self.line = ''
+
+    def write(self, text: str) -> int:
+        self.line += text
+        lines = re.findall(r'[^\r\n]*[\r\n]', self.line)
+        for line in lines:
+            self.stream.write(line)
+            self.stream.flush()
+        self.line = self.line[sum(map(len, lines)):]
+        return len(text)
+
+
+class FolderScheduler(Settings):
+    """
+    Processing of the folders tree by several worker processes at once. The subfolders of a folder are independent,
+    so they are given to the workers as soon as the folder is finished, in the order of the plan of the run, see
+    TreePlan, and each worker processes its folder as in PVFolder.run_process_tree. A folder is always finished
+    before its subfolders are started, so files moved to subfolders by 'sort_files' are processed there.
+    Each worker has its own settings, which it loads for each folder, its own pool of ExifTool processes and its own
+    journal of changes. The log records of the workers are written by the main process. The done folders list and
+    the address cache are changed under a lock shared by the workers, the metadata cache is shared by SQLite.
+    """
+
+    @staticmethod
+    def run_process_tree(folder_path: str, num_proc: int, plan: TreePlan) -> typing.NoReturn:
+        """
+        :param folder_path: full path of the root folder
+        :param num_proc: number of worker processes
+        :param plan: plan of the run, the ready folder with the highest priority is given to the next free worker
+        """
+        log_queue = mp.Queue()
+        log_listener = QueueListener(log_queue, *(Settings.app_log.handlers if Settings.app_log else []))
+        log_listener.start()
+        # Workers open their own connections to the metadata cache.
+        ExifCache.close_exif_cache()
+        executor = ProcessPoolExecutor(max_workers=num_proc,
+                                       initializer=FolderScheduler.init_worker_process,
+                                       initargs=(Settings.settings, Settings.manual_settings,
+                                                 Settings.mode_preset_list, Settings.app_folder,
+                                                 mp.Lock(), log_queue, num_proc))
+        try:
+            ready = [(plan.get_priority(folder_path), folder_path)]
+            futures: typing.Set[Future] = set()
+            while ready or futures:
+                while ready and len(futures) < num_proc:
+                    folder_path = heapq.heappop(ready)[1]
+                    if plan.is_done(folder_path):
+                        FolderScheduler.print_log('i', 'main', f'Skipped done: {folder_path}')
+                        for subfolder_path in plan.jobs[folder_path].subfolders_paths:
+                            heapq.heappush(ready, (plan.get_priority(subfolder_path), subfolder_path))
+                    else:
+                        futures.add(executor.submit(FolderScheduler.process_folder, folder_path))
+                if not futures:
+                    continue
+                done_futures, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    for subfolder_path in future.result():
+                        heapq.heappush(ready, (plan.get_priority(subfolder_path), subfolder_path))
+        finally:
+            # Folders not started yet are cancelled, started folders are finished.
+            executor.shutdown(wait=True, cancel_futures=True)
+            log_listener.stop()
+
+    @staticmethod
+    def init_worker_process(settings: dict,
+                            manual_settings: dict,
+                            mode_preset_list: typing.List[str],
+                            app_folder: str,
+                            files_lock: typing.Any,
+                            log_queue: typing.Any,
+                            num_proc: int) -> typing.NoReturn:
+        """
+        Prepare a worker process: the state of the main process is not shared with it, even when the worker is forked.
+        """
+        Settings.settings = dict(settings)
+        Settings.manual_settings = manual_settings
+        Settings.mode_preset_list = mode_preset_list
+        Settings.app_folder = app_folder
+        Settings.files_lock = files_lock
+
+        # Log records are passed to the main process, printed lines are written whole.
+        Settings.app_log = logging.getLogger('root')
+        for handler in list(Settings.app_log.handlers):
+            Settings.app_log.removeHandler(handler)
+        Settings.app_log.addHandler(QueueHandler(log_queue))
+        Settings.app_log.setLevel(logging.INFO)
+        sys.stdout = WholeLinesOutput(sys.stdout)
+
+        if not GeoObjects.points and not GeoObjects.polygons:
+            GeoObjects.load_google_earth_kml(Settings.get_par('', 'gogle_geo_object_kml_file_path'))
+        ExifCache.connection = None
+        ExifCache.shared = True
+        PVFile.exif_tool = exiftool.ExifTool()
+        # The ExifTool processes of the settings are divided among the workers.
+        ExifToolPool.start(math.ceil(max(Settings.get_par(0, 'exif_read_processes'),
+                                         Settings.get_par(0, 'num_multi_processes')) / num_proc))
+        Journal.start_journal(f'.{mp.current_process().pid}')
+        multiprocessing.util.Finalize(None, FolderScheduler.finish_worker_process, exitpriority=10)
+
+    @staticmethod
+    def finish_worker_process() -> typing.NoReturn:
+        if PVFile.exif_tool.running:
+            PVFile.exif_tool.terminate()
+        ExifToolPool.terminate()
+        Journal.close_journal()
+        ExifCache.close_exif_cache()
+        if Address.num_new_address:
+            Address.save_address_cache()
+
+    @staticmethod
+    def process_folder(folder_path: str) -> typing.List[str]:
+        """
+        :return: paths of the subfolders to process after the folder
+        """
+        pv_folder = PVFolder(folder_path)
+        pv_folder.run_process_folder()
+        return pv_folder.subfolders_paths
@@ -0,0 +1,108 @@
+from __future__ import annotations
+import os
+import typing
+from src.file_times import FileTimes
+
+
+class FolderSnapshot:
+    """
+    Entries of a folder read by one os.scandir pass. The types of entries are known from the scan, and the stat of
+    a file is taken once and cached, so the stages of the folder processing do not list the folder and stat its
+    entries again. The snapshot is updated when the script renames, moves or creates files in the folder.
+    """
+    __slots__ = ('folder_path', 'files', 'folders', 'times')
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        # {file name: DirEntry of the scan, stat result or None if the stat is not known yet}
+        self.files: typing.Dict[str, typing.Union[os.DirEntry, os.stat_result, None]] = {}
+        self.folders: typing.List[str] = []
+        # {file name: (birth time or NaN, modification time)}, see FileTimes
+        self.times: typing.Dict[str, typing.Tuple[float, float]] = {}
+        self.scan()
+
+    def scan(self) -> typing.NoReturn:
+        self.files.clear()
+        self.folders.clear()
+        self.times.clear()
+        try:
+            with os.scandir(self.folder_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        self.files[entry.name] = entry
+                    elif entry.is_dir():
+                        self.folders.append(entry.name)
+        except OSError:
+            pass
+
+    def get_files_names(self, file_types: typing.Optional[typing.Iterable[str]] = None) -> typing.List[str]:
+        """
+        :param file_types: upper case extensions of the files, all files if None
+        """
+        if file_types is None:
+            return list(self.files)
+        file_types = set(file_types)
+        return [file_name for file_name in self.files if file_name.split('.')[-1].upper() in file_types]
+
+    def is_file(self, file_path: str) -> bool:
+        folder_path, file_name = os.path.split(file_path)
+        return folder_path == self.folder_path and file_name in self.files
+
+    def get_stat(self, file_path: str) -> os.stat_result:
+        """
+        Get the stat of the folder file. Files outside the folder are stat directly.
+        """
+        folder_path, file_name = os.path.split(file_path)
+        if folder_path != self.folder_path or file_name not in self.files:
+            return os.stat(file_path)
+        file_stat = self.files[file_name]
+        if not isinstance(file_stat, os.stat_result):
+            file_stat = file_stat.stat() if file_stat else os.stat(file_path)
+            self.files[file_name] = file_stat
+        return file_stat
+
+    def load_files_times(self, files_paths: typing.Iterable[str]) -> typing.NoReturn:
+        """
+        Get the times of the folder files in bulk, with one system call per file: statx on Linux, where the birth time
+        is not in the stat result, otherwise the stat, which is cached and is not taken again.
+        """
+        use_stat = not FileTimes.get_statx()
+        for file_path in files_paths:
+            folder_path, file_name = os.path.split(file_path)
+            if folder_path == self.folder_path and file_name in self.files and file_name not in self.times:
+                self.times[file_name] = FileTimes.get_file_times(file_path,
+                                                                 self.get_stat(file_path) if use_stat else None)
+
+    def get_file_times(self, file_path: str) -> typing.Tuple[float, float]:
+        """
+        :return: (birth time or NaN, modification time) of the file, see FileTimes.get_file_times
+        """
+        folder_path, file_name = os.path.split(file_path)
+        if folder_path != self.folder_path or file_name not in self.files:
+            return FileTimes.get_file_times(file_path)
+        if file_name not in self.times:
+            self.load_files_times([file_path])
+        return self.times[file_name]
+
+    def add_file(self, file_path: str) -> typing.NoReturn:
+        """
+        Add a new file of the folder or forget the cached stat of a changed one.
+        """
+        folder_path, file_name = os.path.split(file_path)
+        if folder_path == self.folder_path:
+            self.files[file_name] = None
+            self.times.pop(file_name, None)
+
+    def move_file(self, file_path: str, new_file_path: str) -> typing.NoReturn:
+        """
+        Update the snapshot after a file is renamed or moved into or out of the folder.
+        """
+        folder_path, file_name = os.path.split(file_path)
+        if folder_path == self.folder_path:
+            self.files.pop(file_name, None)
+            self.times.pop(file_name, None)
+        self.add_file(new_file_path)
+
+    def add_folder(self, folder_name: str) -> typing.NoReturn:
+        if folder_name not in self.folders:
+            self.folders.append(folder_name)
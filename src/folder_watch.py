@@ -0,0 +1,225 @@
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import typing
+from time import monotonic
+from os.path import join
+from src.done_folders import DoneFolders
+from src.settings import Settings
+from src.structures import PVFolder
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+# struct inotify_event of Linux without the name: wd, mask, cookie, len, see inotify(7)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FolderWatch(Settings):
+    """
+    Watch mode: the folders tree is watched by inotify of Linux, and each folder is processed when new or changed media
+    or .gpx files appear in it. The folder is processed after no file of it was created, written or moved to it for
+    'watch_debounce_seconds', so a copy of many files is finished first. Only the folders with changes are processed,
+    the tree is listed once at start to watch its folders, and new subfolders are watched when they are created.
+    The files changed by the script itself in the processed folder are recognized by their size and modification time
+    after the processing, so they do not start the processing again.
+    """
+    # inotify functions of the C library, False if they are not available
+    libc = None
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+        self.fd = -1
+        # {watch descriptor: folder path}
+        self.folders_paths: typing.Dict[int, str] = {}
+        # {folder path: [time to process, changed file names or None for all files]}
+        self.pending: typing.Dict[str, list] = {}
+        # {folder path: {file name: (size, modification time)}} of the files after the folder was processed
+        self.records: typing.Dict[str, typing.Dict[str, typing.Tuple[int, int]]] = {}
+        self.file_types = frozenset([file_type.upper() for file_type in self.get_par([], 'media_types')] + ['GPX'])
+        self.ignore_sing = self.get_par('', 'ignore_sing')
+        self.recurrent = self.get_par(True, 'recurrent')
+        self.debounce = max(self.get_par(5, 'watch_debounce_seconds'), 0)
+
+    @staticmethod
+    def get_libc() -> typing.Optional[ctypes.CDLL]:
+        if FolderWatch.libc is None:
+            FolderWatch.libc = False
+            if sys.platform.startswith('linux'):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                    libc.inotify_init1.argtypes = [ctypes.c_int]
+                    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    FolderWatch.libc = libc
+                except (OSError, AttributeError):
+                    pass
+        return FolderWatch.libc or None
+
+    def start(self) -> bool:
+        libc = self.get_libc()
+        if not libc:
+            self.print_log('e', 'main', 'Watch mode needs inotify of Linux.')
+            return False
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.print_log('e', 'main', f'Watch mode: inotify is not started: {os.strerror(ctypes.get_errno())}')
+            return False
+        self.add_watch_tree(self.root_path)
+        self.print_log('i', 'main', f'Watch {len(self.folders_paths)} folders: {self.root_path}')
+        return True
+
+    def stop(self) -> typing.NoReturn:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch_tree(self, folder_path: str) -> typing.List[str]:
+        """
+        Watch the folder and its subfolders, except the subfolders, whose names begin with 'ignore_sing'.
+        :return: paths of the watched folders
+        """
+        watched = []
+        stack = [folder_path]
+        while stack:
+            folder_path = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder_path), WATCH_MASK)
+            if wd < 0:
+                self.print_log('e', 'main', f'Watch mode: {folder_path} is not watched: '
+                                            f'{os.strerror(ctypes.get_errno())}, see fs.inotify.max_user_watches')
+                continue
+            self.folders_paths[wd] = folder_path
+            watched.append(folder_path)
+            if not self.recurrent:
+                continue
+            try:
+                with os.scandir(folder_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and not self.is_ignored(entry.name):
+                            stack.append(join(folder_path, entry.name))
+            except OSError:
+                pass
+        return watched
+
+    def is_ignored(self, folder_name: str) -> bool:
+        ignore_sing_len = len(self.ignore_sing)
+        return bool(self.ignore_sing) and (len(folder_name) < ignore_sing_len or
+                                           folder_name[:ignore_sing_len] == self.ignore_sing)
+
+    def add_pending(self, folder_path: str, file_name: typing.Optional[str]) -> typing.NoReturn:
+        """
+        :param file_name: changed file, None - all files of the folder
+        """
+        pending = self.pending.setdefault(folder_path, [0.0, set()])
+        pending[0] = monotonic() + self.debounce
+        if file_name is None:
+            pending[1] = None
+        elif pending[1] is not None:
+            pending[1].add(file_name)
+
+    def read_events(self) -> typing.NoReturn:
+        try:
+            buffer = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                # Changes of the lost events are not known, so all watched folders are checked once.
+                self.print_log('w', 'main', 'Watch mode: too many events, all watched folders are processed.')
+                for folder_path in self.folders_paths.values():
+                    self.add_pending(folder_path, None)
+                continue
+            folder_path = self.folders_paths.get(wd)
+            if folder_path is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                if mask & IN_IGNORED:
+                    del self.folders_paths[wd]
+                self.pending.pop(folder_path, None)
+                continue
+            if mask & IN_ISDIR:
+                # Files of a new folder may be created before it is watched, so all its files are processed.
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recurrent and not self.is_ignored(name):
+                    for new_folder_path in self.add_watch_tree(join(folder_path, name)):
+                        self.add_pending(new_folder_path, None)
+                continue
+            self.add_pending(folder_path, name)
+
+    def get_changed_files(self, folder_path: str, files_names: typing.Set[str]) -> typing.List[str]:
+        """
+        :return: media and .gpx files of the folder changed after it was processed
+        """
+        record = self.records.get(folder_path, {})
+        changed = []
+        for file_name in files_names:
+            if file_name.split('.')[-1].upper() not in self.file_types:
+                continue
+            try:
+                file_stat = os.stat(join(folder_path, file_name))
+            except OSError:
+                continue
+            if record.get(file_name) != (file_stat.st_size, file_stat.st_mtime_ns):
+                changed.append(file_name)
+        return changed
+
+    def process_folder(self, folder_path: str) -> typing.NoReturn:
+        # The folder is processed again after each change, the done folders registry does not stop it.
+        DoneFolders.discard(folder_path)
+        pv_folder = PVFolder(folder_path)
+        pv_folder.run_process_folder()
+        record = {}
+        for file_name in pv_folder.snapshot.files:
+            try:
+                file_stat = os.stat(join(folder_path, file_name))
+            except OSError:
+                continue
+            record[file_name] = (file_stat.st_size, file_stat.st_mtime_ns)
+        self.records[folder_path] = record
+
+    def run(self) -> typing.NoReturn:
+        """
+        Process the changed folders until the script is interrupted.
+        """
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(min(pending[0] for pending in self.pending.values()) - monotonic(), 0) * 1000
+            if poll.poll(timeout):
+                self.read_events()
+                continue
+            now = monotonic()
+            for folder_path in [path for path, pending in self.pending.items() if pending[0] <= now]:
+                files_names = self.pending.pop(folder_path)[1]
+                if not os.path.isdir(folder_path):
+                    continue
+                if files_names is None:
+                    self.print_log('i', 'main', f'Watch mode: all files of {folder_path}')
+                else:
+                    changed = self.get_changed_files(folder_path, files_names)
+                    if not changed:
+                        continue
+                    self.print_log('i', 'main', f"Watch mode: changes in {folder_path}: {', '.join(sorted(changed))}")
+                # An error in one folder does not stop the watch of the others.
+                try:
+                    self.process_folder(folder_path)
+                except Exception as ex:
+                    self.print_log('e', 'main', f'Watch mode: {folder_path} is not processed: {ex!r}')
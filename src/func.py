@@ -1,11 +1,15 @@
 import ast
+import json
+import math
 import os
 import pickle
 import re
+import sys
 import time
 import typing
 
 import pytz
+from array import array
 from datetime import datetime, timedelta
 
 # Standard macOS tags colors
@@ -48,6 +52,74 @@ def string_to_datetime(dt_str: str, pattern: str) -> typing.Optional[datetime]:
         return None
 
 
+EPOCH_DATETIME = datetime(1970, 1, 1)
+EPOCH_UTC_DATETIME = pytz.timezone('UTC').localize(EPOCH_DATETIME)
+
+
+def parse_exif_datetime(dt_value: typing.Any) -> typing.Tuple[typing.Optional[datetime], float]:
+    """
+    Parse date and time in ExifTool format 'YYYY:MM:DD HH:MM:SS[.ss][+hh:mm|-hh:mm|Z]' by the fixed positions of its
+    parts, which is several times faster than datetime.strptime.
+    :param dt_value: value of the metadata tag
+    :return: (date and time without subseconds and time zone offset as it is shown by the camera clock, epoch seconds
+    of the same date and time with subseconds). If the value has another format: (None, nan).
+    """
+    if type(dt_value) is not str or len(dt_value) < 19 or dt_value[4] != ':' or dt_value[7] != ':' or \
+            dt_value[10] != ' ' or dt_value[13] != ':' or dt_value[16] != ':':
+        return None, math.nan
+    parts = (dt_value[:4], dt_value[5:7], dt_value[8:10], dt_value[11:13], dt_value[14:16], dt_value[17:19])
+    if not all(part.isdigit() for part in parts):
+        return None, math.nan
+    try:
+        date_time = datetime(*map(int, parts))
+    except ValueError:
+        return None, math.nan
+
+    sub_sec = 0.0
+    rest = dt_value[19:]
+    if rest[:1] == '.':
+        sub_sec_str = rest[1:].split('+')[0].split('-')[0].split('Z')[0]
+        if not sub_sec_str.isdigit():
+            return None, math.nan
+        sub_sec = int(sub_sec_str) / 10 ** len(sub_sec_str)
+        rest = rest[1 + len(sub_sec_str):]
+    if rest and rest != 'Z' and not (len(rest) == 6 and rest[0] in '+-' and rest[3] == ':' and
+                                     rest[1:3].isdigit() and rest[4:].isdigit()):
+        return None, math.nan
+    return date_time, (date_time - EPOCH_DATETIME).total_seconds() + sub_sec
+
+
+def parse_exif_datetimes(dt_values: typing.Iterable[typing.Any]) -> \
+        typing.Tuple[typing.List[typing.Optional[datetime]], array]:
+    """
+    Parse a batch of date and time values, see parse_exif_datetime. Equal values, for example of burst shots, are
+    parsed once.
+    :return: list of datetime or None for values of other format and array of epoch seconds, nan for those values
+    """
+    parsed_values = {}
+    datetimes = []
+    epoch_seconds = array('d')
+    for dt_value in dt_values:
+        key = dt_value if type(dt_value) is str else None
+        if key not in parsed_values:
+            parsed_values[key] = parse_exif_datetime(dt_value)
+        date_time, seconds = parsed_values[key]
+        datetimes.append(date_time)
+        epoch_seconds.append(seconds)
+    return datetimes, epoch_seconds
+
+
+def datetime_to_epoch(date_time: typing.Optional[datetime]) -> float:
+    """
+    Get epoch seconds of date and time. Naive date and time is counted as UTC. None is counted as the latest time.
+    """
+    if date_time is None:
+        return math.inf
+    if date_time.tzinfo:
+        return (date_time - EPOCH_UTC_DATETIME).total_seconds()
+    return (date_time - EPOCH_DATETIME).total_seconds()
+
+
 def save_struct_as_txt_file(txt_file_path: str,
                             struct_to_file: typing.Any,
                             file_type: str):
@@ -85,8 +157,23 @@ def load_pickle_file_as_struct(pickle_file_path: str,
 
 def save_struct_as_pickle_file(pickle_file_path: str,
                                struct_to_file: typing.Any) -> typing.NoReturn:
-    with open(pickle_file_path, 'wb') as file:
+    """
+    The file is written under a temporary name and then replaces the old one, so the file is never read half-written.
+    """
+    tmp_file_path = f'{pickle_file_path}.{os.getpid()}.tmp'
+    with open(tmp_file_path, 'wb') as file:
         pickle.dump(struct_to_file, file)
+    os.replace(tmp_file_path, pickle_file_path)
+
+
+def get_file_mtime(file_path: str) -> typing.Optional[int]:
+    """
+    :return: modification time of the file in nanoseconds or None if there is no file
+    """
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
 
 
 def load_txt_file_as_struct(txt_file_path: str, empty_struct: typing.Any) -> typing.Any:
@@ -256,6 +343,44 @@ def diff_utc_and_stamp(utc_datetime: datetime,
     return int(utc_datetime.timestamp() - stamp)
 
 
+def get_sidecar_tag_name(tag_name: str) -> str:
+    """
+    Get the name of the tag in the XMP sidecar, for example 'XMP:UserComment' for 'EXIF:UserComment'.
+    """
+    return 'XMP:' + tag_name.split(':')[-1]
+
+
+def get_exif_write_args(coordinates: dict,
+                        script_data: dict,
+                        script_data_tag_name: str,
+                        sidecar: bool = False) -> typing.List[bytes]:
+    """
+    Get ExifTool arguments to store the script data and geolocation in the file's metadata.
+    :param coordinates: values of GPS tags. Only the tags present in the dictionary are stored.
+    :param sidecar: the arguments are for the XMP sidecar, where latitude and longitude are signed and have no
+    reference tags
+    :return: list of arguments or empty list if there is nothing to store
+    """
+    write_args = []
+    if coordinates and sidecar:
+        for tag_name, neg_ref in (('GPSLatitude', 'S'), ('GPSLongitude', 'W')):
+            if tag_name in coordinates:
+                value = coordinates[tag_name]
+                value = '-' + value if value and coordinates[tag_name + 'Ref'] == neg_ref else value
+                write_args.append(('-XMP:' + tag_name + '=' + value).encode("utf-8"))
+        if 'GPSAltitude' in coordinates:
+            write_args += [('-XMP:' + tag_name + '=' + coordinates[tag_name]).encode("utf-8")
+                           for tag_name in ('GPSAltitudeRef', 'GPSAltitude')]
+    elif coordinates:
+        write_args += [('-' + tag_name + '=' + coordinates[tag_name]).encode("utf-8")
+                       for tag_name in ('GPSLatitude', 'GPSLatitudeRef', 'GPSLongitude', 'GPSLongitudeRef',
+                                        'GPSAltitudeRef', 'GPSAltitude') if tag_name in coordinates]
+    if script_data:
+        tag_name = get_sidecar_tag_name(script_data_tag_name) if sidecar else script_data_tag_name
+        write_args.append(('-' + tag_name + '=' + encode_script_data(script_data)).encode("utf-8"))
+    return write_args
+
+
 def set_script_data_and_coord_to_file_exif_tags(exif_tool,
                                                 file_path_for_set_exif: str,
                                                 coordinates: dict,
@@ -264,33 +389,127 @@ def set_script_data_and_coord_to_file_exif_tags(exif_tool,
     """
     Use ExifTool to store the script data and geolocation in the file's metadata.
     """
+    exif_errors = set_files_exif_tags(exif_tool,
+                                      [{'file_path': file_path_for_set_exif,
+                                        'new_coord': coordinates,
+                                        'new_script_data': script_data}],
+                                      script_data_tag_name)
+    return exif_errors.get(file_path_for_set_exif, '')
+
+
+def set_files_exif_tags(exif_tool,
+                        files_exif_data: typing.List[dict],
+                        script_data_tag_name: str) -> typing.Dict[str, str]:
+    """
+    Use ExifTool to store the script data and geolocation in the metadata of many files by one call.
+    Each file is written by its own ExifTool command, but files with the same arguments, for example only
+    the same coordinates of a burst, are written by one command. The commands are separated by '-execute', so ExifTool
+    runs them one after another without a round trip for each of them. After each command its number is printed to
+    stderr, so the errors are assigned to the files of their command.
+    A new XMP sidecar is created from scratch by its own command.
+    :param exif_tool: running ExifTool instance
+    :param files_exif_data: list of dictionaries {'file_path': ..., 'new_coord': ..., 'new_script_data': ...}, with
+    'sidecar': True if the file is the XMP sidecar of a media file
+    :param script_data_tag_name: name of the tag to store the script data
+    :return: {file_path: error} for files with errors
+    """
+    files_paths_by_command = {}
+    for exif_data in files_exif_data:
+        sidecar = exif_data.get('sidecar', False)
+        write_args = get_exif_write_args(exif_data['new_coord'], exif_data['new_script_data'], script_data_tag_name,
+                                         sidecar)
+        if write_args:
+            new_file_path = exif_data['file_path'] if sidecar and not os.path.exists(exif_data['file_path']) else ''
+            files_paths_by_command.setdefault((tuple(write_args), new_file_path), []).append(exif_data['file_path'])
+    if not files_paths_by_command:
+        return {}
+
+    params = []
+    commands_files_paths = []
+    for command_num, ((write_args, new_file_path), files_paths) in enumerate(files_paths_by_command.items()):
+        if command_num:
+            params.append(b'-execute')
+        if new_file_path:
+            params += [*write_args, b'-o', new_file_path.encode("utf-8")]
+        else:
+            params += [b'-overwrite_original', *write_args, *[path.encode("utf-8") for path in files_paths]]
+        params += [b'-echo4', f'#pvs_command {command_num}'.encode("utf-8")]
+        commands_files_paths.append(files_paths)
     try:
-        if script_data and coordinates:
-            exif_tool.execute(b'-overwrite_original',
-                              ('-GPSLatitude=' + coordinates['GPSLatitude']).encode("utf-8"),
-                              ('-GPSLatitudeRef=' + coordinates['GPSLatitudeRef']).encode("utf-8"),
-                              ('-GPSLongitude=' + coordinates['GPSLongitude']).encode("utf-8"),
-                              ('-GPSLongitudeRef=' + coordinates['GPSLongitudeRef']).encode("utf-8"),
-                              ('-GPSAltitudeRef=' + coordinates['GPSAltitudeRef']).encode("utf-8"),
-                              ('-GPSAltitude=' + coordinates['GPSAltitude']).encode("utf-8"),
-                              ('-' + script_data_tag_name + '=' + str(script_data)).encode("utf-8"),
-                              file_path_for_set_exif.encode("utf-8"))
-        elif script_data and not coordinates:
-            exif_tool.execute(b'-overwrite_original',
-                              ('-' + script_data_tag_name + '=' + str(script_data)).encode("utf-8"),
-                              file_path_for_set_exif.encode("utf-8"))
-        elif not script_data and coordinates:
-            exif_tool.execute(b'-overwrite_original',
-                              ('-GPSLatitude=' + coordinates['GPSLatitude']).encode("utf-8"),
-                              ('-GPSLatitudeRef=' + coordinates['GPSLatitudeRef']).encode("utf-8"),
-                              ('-GPSLongitude=' + coordinates['GPSLongitude']).encode("utf-8"),
-                              ('-GPSLongitudeRef=' + coordinates['GPSLongitudeRef']).encode("utf-8"),
-                              ('-GPSAltitudeRef=' + coordinates['GPSAltitudeRef']).encode("utf-8"),
-                              ('-GPSAltitude=' + coordinates['GPSAltitude']).encode("utf-8"),
-                              file_path_for_set_exif.encode("utf-8"))
+        exif_tool.execute(*params)
     except Exception as ex:
-        return str(ex)
-    return ''
+        return {path: str(ex) for files_paths in commands_files_paths for path in files_paths}
+
+    exif_errors = {}
+    command_errors = []
+    command_num = 0
+    for line in str(exif_tool.last_stderr).splitlines():
+        if line.startswith('#pvs_command '):
+            files_paths = commands_files_paths[command_num] if command_num < len(commands_files_paths) else []
+            for error in command_errors:
+                # ExifTool ends the error message with the file path. Errors without path belong to all files.
+                error_paths = [path for path in files_paths if error.endswith(' - ' + path)] or files_paths
+                for path in error_paths:
+                    exif_errors[path] = (exif_errors[path] + ' ' + error) if path in exif_errors else error
+            command_errors = []
+            command_num += 1
+        elif line.startswith('Error'):
+            command_errors.append(line.strip())
+    return exif_errors
+
+
+def get_exif_json_records(exif_info: bytes) -> typing.Iterator[dict]:
+    """
+    Decode ExifTool JSON output ('-j') record by record without decoding the whole output at once.
+    ExifTool prints each record from '{' to '}' at the beginning of a line, and line breaks inside values are escaped,
+    so a record ends with the first line beginning with '}'. If the output has another format, it is decoded as a whole.
+    :param exif_info: raw bytes of ExifTool output
+    :return: iterator of records - dictionaries of the files tags
+    """
+    records_num = 0
+    try:
+        begin = exif_info.find(b'{')
+        while begin >= 0:
+            end = exif_info.find(b'\n}', begin)
+            if end < 0:
+                raise ValueError('Unexpected end of ExifTool JSON output')
+            record = json.loads(exif_info[begin:end + 2].decode('utf-8', 'replace'))
+            records_num += 1
+            # Tags names are interned, so that the records of all files keep references to the same strings.
+            yield {sys.intern(tag_name): value for tag_name, value in record.items()}
+            begin = exif_info.find(b'{', end + 2)
+    except ValueError:
+        yield from json.loads(exif_info.decode('utf-8', 'replace'))[records_num:]
+
+
+def get_files_exif_tags(exif_tool,
+                        files_paths: typing.List[str],
+                        chunk_size: int,
+                        *args: str) -> typing.Dict[str, dict]:
+    """
+    Use ExifTool to read the metadata of many files. Files are read in chunks, one ExifTool call per chunk.
+    :param exif_tool: running ExifTool instance
+    :param files_paths: full paths of the files
+    :param chunk_size: maximum number of files in one ExifTool call
+    :param args: additional ExifTool arguments, for example the list of tags to read
+    :return: dictionary {file path: exif tags}. Files that could not be read are missing in the result.
+    """
+    files_exif_tags = {}
+    chunk_size = max(chunk_size, 1)
+    for chunk_begin in range(0, len(files_paths), chunk_size):
+        chunk = files_paths[chunk_begin:chunk_begin + chunk_size]
+        # ExifTool returns 'SourceFile' with forward slashes on all platforms.
+        path_by_source_file = {path.replace('\\', '/'): path for path in chunk}
+        try:
+            exif_info = exif_tool.execute('-j', *args, *chunk, raw_bytes=True)
+            for exif_tags in get_exif_json_records(exif_info):
+                if type(exif_tags) is dict:
+                    path = path_by_source_file.get(str(exif_tags.get('SourceFile', '')).replace('\\', '/'))
+                    if path:
+                        files_exif_tags[path] = exif_tags
+        except Exception:
+            continue
+    return files_exif_tags
 
 
 def set_tag_to_file_exif_tags(exif_tool, file_path_for_set_exif: str, new_tag: list) -> str:
@@ -375,6 +594,62 @@ def add_to_list(main_list: list, new_element: typing.Any) -> typing.NoReturn:
         main_list.append(new_element)
 
 
+# Format of the script data stored in the file's metadata tag: minified JSON with short keys. The format version is
+# stored by the 'sd' key. Previous versions of the script stored the Python representation of the dictionary.
+SCRIPT_DATA_FORMAT_VERSION = 2
+SCRIPT_DATA_SHORT_KEYS = {'pvs': 'v',
+                          'dt': 'd',
+                          'dt_type': 'dy',
+                          'dt_source': 'ds',
+                          't_zone': 'z',
+                          'utc_dt': 'u',
+                          'coord_source': 'cs',
+                          'address': 'a',
+                          'first_dt': 'f',
+                          'camera': 'c',
+                          'gr_id': 'g',
+                          'f_id': 'i',
+                          'prev_value': 'p',
+                          'dt_offset': 'o'}
+SCRIPT_DATA_LONG_KEYS = {short_key: key for key, short_key in SCRIPT_DATA_SHORT_KEYS.items()}
+# Values repeated in the script data of many files.
+SCRIPT_DATA_INTERNED_KEYS = ('pvs', 'dt_type', 'dt_source', 't_zone', 'coord_source', 'camera')
+
+
+def encode_script_data(script_data: dict) -> str:
+    """
+    Encode the script data for storing in the file's metadata tag.
+    :param script_data: script data with full keys
+    :return: minified JSON string with short keys and the format version
+    """
+    encoded_data = {'sd': SCRIPT_DATA_FORMAT_VERSION}
+    encoded_data.update({SCRIPT_DATA_SHORT_KEYS.get(key, key): value for key, value in script_data.items()})
+    return json.dumps(encoded_data, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_script_data(tag_string: typing.Any) -> dict:
+    """
+    Decode the dictionary from the file's metadata tag. Both the current format of the script data and the Python
+    representation of the dictionary written by previous versions of the script are accepted.
+    :param tag_string: value of the file's metadata tag
+    :return: dictionary with full keys or empty dictionary if there is no dictionary in the tag
+    """
+    if type(tag_string) is not str:
+        return {}
+    tag_string = tag_string.strip()
+    if tag_string[:2] == '{"':
+        try:
+            tag_structure = json.loads(tag_string)
+        except ValueError:
+            return {}
+        if type(tag_structure) is dict and tag_structure.pop('sd', None) == SCRIPT_DATA_FORMAT_VERSION:
+            return {SCRIPT_DATA_LONG_KEYS.get(key, key): value for key, value in tag_structure.items()}
+        return tag_structure if type(tag_structure) is dict else {}
+    if tag_string[:1] == '{':
+        return get_dict(tag_string)
+    return {}
+
+
 def get_dict(dict_str: str) -> dict:
     try:
         dict_ast = ast.literal_eval(dict_str)
@@ -391,13 +666,13 @@ def sd_data(tag_string: str) -> dict:
     :param tag_string: file's metadata tag
     :return: value of the script data or empty dictionary if there is no a script data in this tag
     """
-    try:
-        tag_structure = ast.literal_eval(tag_string)
-        if type(tag_structure) is dict and 'pvs' in tag_structure:
-            return tag_structure
-    except (ValueError, TypeError, SyntaxError):
-        pass
-    return {}
+    tag_structure = decode_script_data(tag_string)
+    if 'pvs' not in tag_structure:
+        return {}
+    for key in SCRIPT_DATA_INTERNED_KEYS:
+        if type(tag_structure.get(key)) is str:
+            tag_structure[key] = sys.intern(tag_structure[key])
+    return tag_structure
 
 
 def str_after_sing(checking_string: str, sub_str: str) -> str:
@@ -11,8 +11,7 @@ import geopy
 import gpxpy
 import pytz
 from datetime import datetime, timedelta
-from os import listdir
-from os.path import isfile, join
+from os.path import join
 from bs4 import BeautifulSoup
 from geopy import Nominatim
 from geopy.distance import distance
@@ -20,6 +19,7 @@ from shapely.geometry import Polygon, Point, MultiPoint
 from shapely.ops import nearest_points
 from timezonefinder import TimezoneFinder
 from src import func
+from src.folder_snapshot import FolderSnapshot
 from src.settings import Settings
 
 
@@ -99,25 +99,27 @@ class ManualData(Settings):
                                 else:
                                     self.add_manual_data(file_name, line_data)
 
-    def save_folder_manual_data_file(self) -> typing.NoReturn:
-        manual_data_file_path = join(self.folder_path, self.manual_data_file_name)
-        manual_date_time_format = self.get_par('', 'manual_date_time_format')
-        if self.manual_data and manual_data_file_path:
-            with open(manual_data_file_path, 'w') as file:
-                for group_name, group_data in self.manual_data.items():
-                    line = self.save_ready_string(group_name, group_data, self.split_sign, manual_date_time_format)
-                    if line:
-                        print(line, file=file)
+    def get_manual_data_file_path(self) -> str:
+        return join(self.folder_path, self.manual_data_file_name)
 
-                if self.common_data:
-                    line = self.save_ready_string('All', self.common_data, self.split_sign, manual_date_time_format)
-                    if line:
-                        print(line, file=file)
+    def get_manual_data_file_lines(self) -> typing.List[str]:
+        """
+        Get the lines of the manual data file to save.
+        """
+        manual_date_time_format = self.get_par('', 'manual_date_time_format')
+        lines = [self.save_ready_string(group_name, group_data, self.split_sign, manual_date_time_format)
+                 for group_name, group_data in self.manual_data.items()]
+        if self.common_data:
+            lines.append(self.save_ready_string('All', self.common_data, self.split_sign, manual_date_time_format))
+        lines += [self.save_ready_string(file_name, file_data, self.split_sign, manual_date_time_format)
+                  for file_name, file_data in self.wrong_file_manual_data.items()]
+        return [line for line in lines if line]
 
-                for file_name, file_data in self.wrong_file_manual_data.items():
-                    line = self.save_ready_string(file_name, file_data, self.split_sign, manual_date_time_format)
-                    if line:
-                        print(line, file=file)
+    def save_folder_manual_data_file(self) -> typing.NoReturn:
+        if self.manual_data:
+            with open(self.get_manual_data_file_path(), 'w') as file:
+                for line in self.get_manual_data_file_lines():
+                    print(line, file=file)
 
     @staticmethod
     def save_ready_string(group_name: str,
@@ -301,11 +303,22 @@ class Address(Settings):
     last_osm_connection = time.time()
     ctx = None
     osm_geo_locator = None
+    empty_address = None
+    __slots__ = ('address', 'tags')
 
     def __init__(self, *args: typing.Dict[str, str]):
         self.address = args[0] if args and args[0] else {}
         self.tags = []
 
+    @staticmethod
+    def get_empty_address() -> Address:
+        """
+        Get the empty address shared by all objects without address. It must not be changed.
+        """
+        if Address.empty_address is None:
+            Address.empty_address = Address()
+        return Address.empty_address
+
     def set_address(self, new_address: dict) -> typing.NoReturn:
         if new_address:
             self.address = new_address
@@ -319,7 +332,7 @@ class Address(Settings):
         if args and args[0]:
             addr_parts_types = args[0]
         else:
-            addr_parts_types = self.get_par([], 'addr_parts_types')
+            addr_parts_types = self.get_snapshot().addr_parts_types
         self.tags = [self.address[key] for key in addr_parts_types if key in self.address]
 
     def copy(self):
@@ -342,7 +355,7 @@ class Address(Settings):
         if args:
             address_sources = args[0]
         else:
-            address_sources = self.get_par([], 'address_source_ordered')
+            address_sources = self.get_snapshot().address_source_ordered
 
         if coord and address_sources:
             for addr_source in address_sources:
@@ -352,7 +365,7 @@ class Address(Settings):
                     address = Address.get_address_by_coord_osm(coord)
                     if address:
                         Address.add_cache_address(coord, address)
-            if not address and self.check_par('use_geo_point'):
+            if not address and self.get_snapshot().use_geo_point:
                 # no address with coordinates -> address is 'geo_point': '{lat} {lon}'
                 address = {'geo_point': str(coord[0]) + " " + str(coord[1])}
                 Address.add_cache_address(coord, address)
@@ -447,7 +460,16 @@ class Address(Settings):
 
     @staticmethod
     def save_address_cache() -> typing.NoReturn:
-        func.save_struct_as_pickle_file(Address.pickle_file_path, Address.addr_cache)
+        """
+        When folders are processed by several worker processes, addresses found by other processes are added to the
+        cache before it is saved, so they are not lost.
+        """
+        with Address.lock_shared_files():
+            if Address.files_lock:
+                for coord, address in func.load_pickle_file_as_struct(Address.pickle_file_path, {}).items():
+                    Address.addr_cache.setdefault(coord, address)
+                Address.shapely_multipoint = MultiPoint(list(Address.addr_cache.keys()))
+            func.save_struct_as_pickle_file(Address.pickle_file_path, Address.addr_cache)
 
     @staticmethod
     def activate_osm_connection() -> typing.NoReturn:
@@ -495,6 +517,7 @@ class Address(Settings):
 
 
 class GeoTrackPoint:
+    __slots__ = ('coord', 'elevation', 'utc_dt')
 
     def __init__(self, **kwargs):
         self.coord = kwargs['coord'] if 'coord' in kwargs else ()
@@ -534,10 +557,13 @@ class GeoMultiTrack(Settings):
     def __init__(self):
         self.tracks = []
 
-    def load_gpx_folder(self, folder_path: str) -> typing.NoReturn:
+    def load_gpx_folder(self, folder_path: str, snapshot: typing.Optional[FolderSnapshot] = None) -> typing.NoReturn:
+        """
+        :param snapshot: entries of the folder, if they are already read
+        """
         self.print_log('i', 'stage', f"{folder_path}: Loading gpx files.")
-        gpx_file_list = [join(folder_path, f) for f in listdir(folder_path) if isfile(join(folder_path, f)) and
-                         f.split('.')[-1].upper() == 'GPX']
+        snapshot = snapshot if snapshot else FolderSnapshot(folder_path)
+        gpx_file_list = [join(folder_path, f) for f in snapshot.get_files_names(['GPX'])]
         for gpx_file_path in gpx_file_list:
             gpx_file_name = os.path.split(gpx_file_path)[1]
             if self.get_par('', 'exist_pv_gpx_track_file') == gpx_file_name:
@@ -0,0 +1,35 @@
+from __future__ import annotations
+import re
+import typing
+
+
+class GroupPatterns:
+    """
+    Patterns of one grouping setting ('masters', 'slaves' or 'additions') compiled once for the folder.
+    The name key of a file is what the first match of the pattern gives, see re.findall. Files are joined into groups
+    by the name key through the dictionary PVFolder.pv_groups_by_name_key.
+    """
+    __slots__ = ('patterns', 'case_sens')
+
+    def __init__(self, patterns_settings: typing.Dict[str, dict], case_sens: bool):
+        """
+        :param patterns_settings: {pattern: scheme of the new name}
+        :param case_sens: patterns are case-sensitive, see 'group_pattern_case_sensitive'
+        """
+        self.case_sens = case_sens
+        self.patterns = [(re.compile(pattern if case_sens else pattern.upper()), scheme)
+                         for pattern, scheme in patterns_settings.items()]
+
+    def get_name_keys(self, file_name: str) -> typing.List[typing.Tuple[typing.Any, dict]]:
+        """
+        Get the name keys of the file by all patterns matching it. A file matching more than one pattern is
+        a conflict of the settings, so all patterns are applied.
+        :return: list of (name key, scheme of the new name)
+        """
+        name = file_name if self.case_sens else file_name.upper()
+        name_keys = []
+        for pattern, scheme in self.patterns:
+            found = pattern.findall(name)
+            if found:
+                name_keys.append((found[0], scheme))
+        return name_keys
@@ -0,0 +1,202 @@
+from __future__ import annotations
+import glob
+import json
+import os
+import typing
+from exiftool import exiftool
+from src import func
+from src.exif_cache import ExifCache
+from src.done_folders import DoneFolders
+from src.settings import Settings
+
+
+class Journal(Settings):
+    """
+    Append-only journal of the changes of files made by the script: metadata writes, moves to subfolders and
+    two-phase renames. Each record is one JSON line.
+    Before the changes are started, their plan is recorded: {'id': ..., 'op': 'moves' or 'folder', ...}.
+    Progress records {'id': ..., ...} are added while the plan is carried out, and the record {'id': ..., 'end': true}
+    after it is finished. If the run is interrupted, the next run finishes the plans without the end record,
+    see Journal.recover.
+    """
+    journal_file = None
+    last_id = 0
+    # Ids of the plans without the end record
+    open_ids = set()
+
+    @staticmethod
+    def get_journal_file_path() -> str:
+        return Journal.get_par('', 'journal_file_path') if Journal.get_par(False, 'use_journal') else ''
+
+    @staticmethod
+    def get_journal_files_paths() -> typing.List[str]:
+        """
+        :return: paths of the journal of the run and of the journals of its worker processes, see FolderScheduler.
+        A worker journal is named by the journal path, a dot and the process id, other files are not journals.
+        """
+        journal_file_path = Journal.get_journal_file_path()
+        if not journal_file_path:
+            return []
+        workers_journals_paths = sorted(path for path in glob.glob(glob.escape(journal_file_path) + '.*')
+                                        if path[len(journal_file_path) + 1:].isdigit())
+        return [journal_file_path] + workers_journals_paths
+
+    @staticmethod
+    def start_journal(suffix: str = '') -> typing.NoReturn:
+        """
+        Start the journal of the current run. The journal of the previous run must be recovered before.
+        :param suffix: suffix of the journal file name of a worker process
+        """
+        journal_file_path = Journal.get_journal_file_path()
+        Journal.journal_file = None
+        Journal.open_ids = set()
+        if not journal_file_path:
+            return
+        try:
+            Journal.journal_file = open(journal_file_path + suffix, 'w', encoding='utf-8')
+        except OSError as ex:
+            Journal.print_log('e', 'main', f"(Journal.start_journal) Can't open journal {journal_file_path}: {ex}")
+
+    @staticmethod
+    def close_journal() -> typing.NoReturn:
+        """
+        Close the journal of the current run. If all plans are finished, the journal is removed.
+        """
+        if not Journal.journal_file:
+            return
+        Journal.journal_file.close()
+        if not Journal.open_ids:
+            os.remove(Journal.journal_file.name)
+        Journal.journal_file = None
+
+    @staticmethod
+    def add_record(record: dict) -> typing.NoReturn:
+        Journal.journal_file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        Journal.journal_file.flush()
+        os.fsync(Journal.journal_file.fileno())
+
+    @staticmethod
+    def plan(op: str, folder_path: str, **plan_data: typing.Any) -> int:
+        """
+        Record the plan of changes of the folder files.
+        :param op: 'moves' - moves of files to subfolders, plan_data: moves - list of [path, new path];
+        'folder' - final changes of the folder, see PVFolder.plan_folder_changes
+        :return: id of the plan or 0 if the journal is not used
+        """
+        if not Journal.journal_file:
+            return 0
+        Journal.last_id += 1
+        Journal.add_record({'id': Journal.last_id, 'op': op, 'folder': folder_path, **plan_data})
+        Journal.open_ids.add(Journal.last_id)
+        return Journal.last_id
+
+    @staticmethod
+    def progress(plan_id: int, **progress_data: typing.Any) -> typing.NoReturn:
+        """
+        :param progress_data: exif - numbers of written files in the plan list; renamed - true after the first step
+        of renaming
+        """
+        if plan_id and Journal.journal_file:
+            Journal.add_record({'id': plan_id, **progress_data})
+
+    @staticmethod
+    def end(plan_id: int) -> typing.NoReturn:
+        if plan_id and Journal.journal_file:
+            Journal.add_record({'id': plan_id, 'end': True})
+            Journal.open_ids.discard(plan_id)
+
+    @staticmethod
+    def load_unfinished_plans(journal_file_path: str) -> typing.List[dict]:
+        """
+        Load the plans without the end record from the journal of the previous run. The progress of a plan is
+        stored in it: 'exif_done' - set of numbers of written files, 'renamed' - the first step of renaming is finished.
+        An incomplete last line of the journal is ignored.
+        """
+        if not os.path.isfile(journal_file_path):
+            return []
+        plans = {}
+        with open(journal_file_path, 'r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                plan_id = record.get('id')
+                if 'op' in record:
+                    plans[plan_id] = dict(record, exif_done=set(), renamed=False)
+                elif plan_id in plans:
+                    if record.get('end'):
+                        del plans[plan_id]
+                    else:
+                        plans[plan_id]['exif_done'].update(record.get('exif', []))
+                        plans[plan_id]['renamed'] |= record.get('renamed', False)
+        return list(plans.values())
+
+    @staticmethod
+    def recover() -> typing.NoReturn:
+        """
+        Finish the changes interrupted in the previous run. Only the unfinished parts of the plans are carried out:
+        - moves: files not moved yet are moved, if the new path is free;
+        - folder: metadata of the files not written yet is written, files are renamed in two steps as in
+          PVFile.file_rename, the manual data file is saved and the folder is added to the done folders list.
+        So the folder is not processed again. The journals of the worker processes of the previous run are removed
+        after recovering, the journal of the run is overwritten by the current run.
+        """
+        journal_files_paths = Journal.get_journal_files_paths()
+        plans = [plan for journal_file_path in journal_files_paths
+                 for plan in Journal.load_unfinished_plans(journal_file_path)]
+        if plans:
+            Journal.print_log('w', 'main', f"Found {len(plans)} unfinished changes of the previous run. Recovering.")
+        for plan in plans:
+            if plan['op'] == 'moves':
+                Journal.recover_renames(plan['moves'])
+            elif plan['op'] == 'folder':
+                Journal.recover_exif_writes(plan)
+                if not plan['renamed']:
+                    Journal.recover_renames(plan['renames'], plan['job_sing'])
+                for _, new_file_path in plan['renames']:
+                    if os.path.exists(new_file_path + plan['job_sing']) and not os.path.exists(new_file_path):
+                        os.rename(new_file_path + plan['job_sing'], new_file_path)
+                if plan['manual_data_lines'] is not None:
+                    with open(plan['manual_data_file_path'], 'w') as file:
+                        for line in plan['manual_data_lines']:
+                            print(line, file=file)
+                DoneFolders.add(plan['folder'])
+            Journal.print_log('i', 'main', f"Recovered: {plan['folder']}")
+        if plans:
+            ExifCache.save_exif_cache()
+        for journal_file_path in journal_files_paths[1:]:
+            os.remove(journal_file_path)
+
+    @staticmethod
+    def recover_exif_writes(plan: dict) -> typing.NoReturn:
+        files_exif_data = [exif_data for num, exif_data in enumerate(plan['exif']) if num not in plan['exif_done']]
+        if not files_exif_data:
+            return
+        chunk_size = max(Journal.get_par(100, 'exif_write_chunk_size'), 1)
+        exif_tool = exiftool.ExifTool()
+        exif_tool.run()
+        try:
+            for chunk_begin in range(0, len(files_exif_data), chunk_size):
+                chunk = files_exif_data[chunk_begin:chunk_begin + chunk_size]
+                exif_errors = func.set_files_exif_tags(exif_tool, chunk, plan['script_data_tag_name'])
+                for file_path, exif_error in exif_errors.items():
+                    Journal.print_log('e', 'main', f"{file_path}: Setting exif tags error: {exif_error}")
+                for exif_data in chunk:
+                    ExifCache.remove_file(exif_data['file_path'])
+        finally:
+            exif_tool.terminate()
+        Journal.print_log('i', 'main', f"{plan['folder']}: Metadata of {len(files_exif_data)} files written.")
+
+    @staticmethod
+    def recover_renames(renames: typing.List[typing.List[str]], job_sing: str = '') -> typing.NoReturn:
+        """
+        Move or rename files, which are still in their old places, if their new places are free.
+        :param renames: list of [path, new path]
+        :param job_sing: technological rename sign added to the new path
+        """
+        for file_path, new_file_path in renames:
+            if os.path.exists(file_path) and not os.path.exists(new_file_path + job_sing):
+                os.rename(file_path, new_file_path + job_sing)
+                ExifCache.rename_file(file_path, new_file_path)
+                Journal.print_log('i', 'rename', f"{file_path} -> {new_file_path}")
@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import typing
 from logging.handlers import RotatingFileHandler
@@ -5,6 +6,7 @@ import os
 import platform
 import shutil
 import sys
+import types
 import pytz
 import multiprocessing as mp
 from datetime import datetime
@@ -12,14 +14,28 @@ from os.path import join
 from pathlib import Path
 
 from src import func
+from src.settings_snapshot import SettingsSnapshot
 
 
 class Settings:
+    # No instance attributes, so that subclasses with __slots__ have no per-instance __dict__.
+    __slots__ = ()
     settings = {}
     manual_settings = {}
     mode_preset_list = []
     app_folder = ''
     app_log = None
+    # Lock of the files shared by the worker processes of the folders scheduler, see FolderScheduler
+    files_lock = None
+    # Main settings with default values and mode presets, see Settings.load_settings. They are not changed, folder and
+    # manual settings are applied to the copy of them in Settings.settings.
+    base_settings = types.MappingProxyType({})
+    # Modification times of the main settings and mode presets files and the modes of the loaded base settings
+    base_settings_key = None
+    # {folder settings file path: (modification time, checked folder settings)}
+    folder_settings_cache = {}
+    # Compiled current settings, see Settings.get_snapshot
+    snapshot = None
 
     @staticmethod
     def set_manual_settings(man_settings) -> typing.NoReturn:
@@ -30,11 +46,30 @@ class Settings:
         if mode_preset_list:
             Settings.mode_preset_list = mode_preset_list
 
+    @staticmethod
+    def lock_shared_files() -> typing.ContextManager:
+        """
+        Lock the files shared by the worker processes of the folders scheduler: the done folders list and the address
+        cache. Nothing is locked when the folders are processed by one process.
+        """
+        return Settings.files_lock or contextlib.nullcontext()
+
     @staticmethod
     def transfer_manual_settings_to_settings() -> typing.NoReturn:
         # Overwrite settings by manual settings
         for param in Settings.manual_settings.keys():
             Settings.settings[param] = Settings.manual_settings[param]
+        Settings.snapshot = None
+
+    @staticmethod
+    def get_snapshot() -> SettingsSnapshot:
+        """
+        Get the compiled current settings for the loops over files and groups. The snapshot is compiled again if
+        the settings are replaced or changed by Settings.set_settings_parameter.
+        """
+        if Settings.snapshot is None or Settings.snapshot.settings is not Settings.settings:
+            Settings.snapshot = SettingsSnapshot(Settings.settings)
+        return Settings.snapshot
 
     @staticmethod
     def get_par(none_value: typing.Any, *args: str) -> typing.Any:
@@ -112,10 +147,44 @@ class Settings:
 
     @staticmethod
     def load_settings(*args: str) -> bool:
+        """
+        Load settings in layers: the main settings with default values and mode presets are parsed and checked once
+        and kept as Settings.base_settings until their files change. The folder settings are laid over a copy of them,
+        and the manual settings from the script parameters over all.
+        :param args: path of the folder, whose folder settings file is applied
+        """
         Settings.app_folder = os.path.split(sys.argv[0])[0] if sys.argv else ''
+        settings_file_path = join(Settings.app_folder, 'pvs_settings.json')
+        mode_preset_file_path = join(Settings.app_folder, 'pvs_mode_preset.json')
+        base_settings_key = (func.get_file_mtime(settings_file_path),
+                             func.get_file_mtime(mode_preset_file_path) if Settings.mode_preset_list else None,
+                             tuple(Settings.mode_preset_list))
+        if base_settings_key != Settings.base_settings_key:
+            if not Settings.load_base_settings(settings_file_path, mode_preset_file_path):
+                Settings.base_settings_key = None
+                return False
+            Settings.base_settings = types.MappingProxyType(Settings.settings)
+            Settings.base_settings_key = base_settings_key
+        Settings.settings = dict(Settings.base_settings)
+
+        # If we have folder path, load folder settings and update main settings
+        if args:
+            folder_settings = Settings.load_folder_settings(args[0])
+            if folder_settings is None:
+                return False
+            Settings.settings.update(folder_settings)
 
+        # After all updates, apply the settings with manual settings from the script parameters
+        Settings.transfer_manual_settings_to_settings()
+
+        # Check if number of processes more than real number of cores
+        Settings.check_real_core_num()
+        Settings.snapshot = SettingsSnapshot(Settings.settings)
+        return True
+
+    @staticmethod
+    def load_base_settings(settings_file_path: str, mode_preset_file_path: str) -> bool:
         # Load settings from file
-        settings_file_path = join(Settings.app_folder, 'pvs_settings.json')
         Settings.settings = func.load_txt_file_as_struct(settings_file_path, {})
         if not Settings.settings:
             Settings.print_log('w', 'main', f"Can't get settings from file {settings_file_path}")
@@ -135,9 +204,8 @@ class Settings:
         # If some settings are empty, get default values
         Settings.get_default_settings_values()
 
-        # If we have folder path, load folder settings and update main settings
+        # Update main settings by the settings of the modes
         if Settings.mode_preset_list:
-            mode_preset_file_path = join(Settings.app_folder, 'pvs_mode_preset.json')
             mode_presets: dict = func.load_txt_file_as_struct(mode_preset_file_path, {})
             if not mode_presets:
                 Settings.print_log('w', 'main', f"Can't get mode settings from file {mode_preset_file_path}")
@@ -148,21 +216,30 @@ class Settings:
                     return False
                 if not Settings.load_additional_settings(mode_presets[mode], f"'{mode}' mode"):
                     return False
-
-        # If we have folder path, load folder settings and update main settings
-        if args:
-            folder_settings_file_path = join(args[0], Settings.get_par('', 'folder_settings_file'))
-            folder_settings = func.load_txt_file_as_struct(folder_settings_file_path, {})
-            if not Settings.load_additional_settings(folder_settings, args[0]):
-                return False
-
-        # After all updates, apply the settings with manual settings from the script parameters
-        Settings.transfer_manual_settings_to_settings()
-
-        # Check if number of processes more than real number of cores
-        Settings.check_real_core_num()
         return True
 
+    @staticmethod
+    def load_folder_settings(folder_path: str) -> typing.Optional[dict]:
+        """
+        Load the folder settings file. Checked folder settings are cached until the file is changed.
+        :return: folder settings, empty if there is no file, None if they are incorrect
+        """
+        folder_settings_file_path = join(folder_path, Settings.get_par('', 'folder_settings_file'))
+        mtime = func.get_file_mtime(folder_settings_file_path)
+        if mtime is None:
+            return {}
+        cached = Settings.folder_settings_cache.get(folder_settings_file_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        folder_settings = func.load_txt_file_as_struct(folder_settings_file_path, {})
+        if folder_settings and not Settings.check_settings(f"{folder_path} settings",
+                                                           Settings.gen_additional_settings_template(),
+                                                           folder_settings):
+            Settings.print_log('w', 'main', f'Process was interrupted - incorrect {folder_path} settings.')
+            return None
+        Settings.folder_settings_cache[folder_settings_file_path] = mtime, folder_settings
+        return folder_settings
+
     @staticmethod
     def check_real_core_num() -> typing.NoReturn:
         num_multi_processes = Settings.get_par(0, 'num_multi_processes')
@@ -192,6 +269,7 @@ class Settings:
     @staticmethod
     def set_settings_parameter(param: str, value: typing.Any) -> typing.NoReturn:
         Settings.settings[param] = value
+        Settings.snapshot = None
 
     @staticmethod
     def get_os_alias() -> bool:
@@ -207,9 +285,12 @@ class Settings:
     @staticmethod
     def get_default_settings_values() -> typing.NoReturn:
         def_sett = {"done_folders_txt_file_path": join(Settings.app_folder, 'data', 'pvs_done_folders_list.txt'),
-                    "done_folders_pickle_file_path": join(Settings.app_folder, 'data', 'pvs_done_folders_list.pickle'),
+                    "done_folders_file_path": join(Settings.app_folder, 'data', 'pvs_done_folders.jsonl'),
                     "addr_cache_pickle_file_path": join(Settings.app_folder, 'data', 'pvs_address_cache.pickle'),
                     "files_data_pickle_file_path": join(Settings.app_folder, 'data', 'pvs_files_data.pickle'),
+                    "exif_cache_file_path": join(Settings.app_folder, 'data', 'pvs_exif_cache.sqlite'),
+                    "journal_file_path": join(Settings.app_folder, 'data', 'pvs_journal.jsonl'),
+                    "plan_stat_file_path": join(Settings.app_folder, 'data', 'pvs_plan_stat.json'),
                     "all_types_folder_path": join(Settings.app_folder, 'data', 'pvs_all_file_types'),
                     "log_file_path": join(Settings.app_folder, 'data', 'pvs_report.log'),
                     "folder_settings_file": "_pvs_folder_settings.json",
@@ -230,6 +311,7 @@ class Settings:
                         Settings.settings[def_parameter] = def_value
                 else:
                     Settings.settings[def_parameter] = def_value
+        Settings.snapshot = None
 
     @staticmethod
     def gen_settings_template() -> dict:
@@ -254,6 +336,21 @@ class Settings:
             "new_job_reset": (bool, None, True),
             "recurrent": (bool, None, True),
             "num_multi_processes": (int, None, True),
+            "exif_tool_backend": (str, ["thread", "process"], True),
+            "folder_processes": (int, None, True),
+            "plan_order": (str, ["tree", "size", "device"], True),
+            "plan_stat_file_path": (str, None, True),
+            "watch_debounce_seconds": (int, None, True),
+            "exif_read_chunk_size": (int, None, True),
+            "exif_read_mode": (str, ["full", "lean"], True),
+            "exif_read_processes": (int, None, True),
+            "use_exif_cache": (bool, None, True),
+            "exif_cache_file_path": (str, None, True),
+            "exif_cache_max_files": (int, None, True),
+            "exif_write_chunk_size": (int, None, True),
+            "exif_sidecar_types": (list, str, True),
+            "use_journal": (bool, None, True),
+            "journal_file_path": (str, None, True),
             "folder_dt_name_format": (str, None, True),
             "name_core_format": (str, None, True),
             "new_name_order": (list, ("num", "prefix", "name_core", "suffix"), True),
@@ -265,7 +362,7 @@ class Settings:
             "log_file_path": (str, None, True),
             "max_log_size_mb": (int, None, True),
             "done_folders_txt_file_path": (str, None, True),
-            "done_folders_pickle_file_path": (str, None, True),
+            "done_folders_file_path": (str, None, True),
             "files_data_pickle_file_path": (str, None, True),
             "addr_cache_pickle_file_path": (str, None, True),
             "all_types_folder_path": (str, None, True),
@@ -575,11 +672,12 @@ class Settings:
 
     @staticmethod
     def print_counter(msg: str, *args: str) -> typing.NoReturn:
+        snapshot = Settings.get_snapshot()
         if args:
-            show_counter_flag = not Settings.check_par('log_mode', args[0] + '_print')
+            show_counter_flag = not snapshot.get_log_flags(args[0])[1]
         else:
             show_counter_flag = True
-        if show_counter_flag and Settings.check_par('log_mode', 'counter_print'):
+        if show_counter_flag and snapshot.counter_print:
             if msg:
                 log_msg = 'INFO: count ' + datetime.now().strftime("%Y:%m:%d-%H:%M:%S") + ' ' + msg
                 print('\r' + log_msg[:shutil.get_terminal_size().columns - 2] + '\x1b[K', end='\r', flush=True)
@@ -595,9 +693,9 @@ class Settings:
         :param message:
         :return:
         """
-        if Settings.no_empty_par('log_mode'):
-            log_flag = Settings.check_par('log_mode', (proc + '_log'))
-            print_flag = Settings.check_par('log_mode', (proc + '_print'))
+        snapshot = Settings.get_snapshot()
+        if snapshot.has_log_mode:
+            log_flag, print_flag = snapshot.get_log_flags(proc)
             if log_flag or print_flag:
                 if m_type == 'i':
                     log_msg = ' ' + proc + ' ' + datetime.now().strftime("%Y:%m:%d-%H:%M:%S") + ' ' + message
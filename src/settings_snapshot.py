@@ -0,0 +1,67 @@
+from __future__ import annotations
+import typing
+from src import func
+
+
+class SettingsSnapshot:
+    """
+    Settings used in the loops over files and groups, compiled once from the current settings: lists of flags are
+    frozensets, nested values are resolved and the log mode flags are computed in advance. The snapshot is compiled
+    again after the settings are loaded or changed, see Settings.get_snapshot.
+    """
+    __slots__ = ('settings', 'log_mode', 'has_log_mode', 'counter_print', 'log_flags', 'get', 'set',
+                 'new_name_order', 'new_name_case', 'job_sing', 'mactag_keep_signs', 'mactag_order', 'mactags',
+                 'addr_parts_types', 'address_source_ordered', 'use_geo_point')
+
+    def __init__(self, settings: dict):
+        """
+        :param settings: settings to compile, the snapshot is valid while they are the current settings
+        """
+        self.settings = settings
+        log_mode = settings.get('log_mode')
+        self.log_mode = self.get_flags(log_mode)
+        self.has_log_mode = bool(log_mode) or log_mode == 0
+        self.counter_print = 'counter_print' in self.log_mode
+        # {process name: (log flag, print flag)}, filled on demand
+        self.log_flags: typing.Dict[str, typing.Tuple[bool, bool]] = {}
+        self.get = self.get_flags(settings.get('get'))
+        self.set = self.get_flags(settings.get('set'))
+
+        self.new_name_order = tuple(settings.get('new_name_order') or ())
+        self.new_name_case = settings.get('new_name_case', 'as_is')
+        self.job_sing = settings.get('job_sing', '-_t_-')
+
+        self.mactag_keep_signs = tuple(settings.get('mactag_keep_signs', ()))
+        self.mactag_order = tuple(settings.get('mactag_order', ()))
+        # {macOS tag setting name: (active, prefix, color code)}
+        self.mactags: typing.Dict[str, typing.Tuple[bool, str, int]] = {}
+        for name, value in settings.items():
+            if name.startswith('mactag_') and isinstance(value, dict):
+                self.mactags[name] = (value.get('active', False), value.get('prefix', ''),
+                                      func.get_macos_tag_color_code(value.get('color', 'NONE')))
+
+        self.addr_parts_types = tuple(settings.get('addr_parts_types', ()))
+        self.address_source_ordered = tuple(settings.get('address_source_ordered', ()))
+        # The parameter is switched off by the '-' sign before its name, so it is on when it is present.
+        self.use_geo_point = 'use_geo_point' in settings
+
+    @staticmethod
+    def get_flags(value: typing.Any) -> typing.FrozenSet:
+        """
+        Flags of a list setting. A single value is the only flag, as Settings.check_par compares it.
+        """
+        if value is None:
+            return frozenset()
+        if isinstance(value, (list, tuple, dict)):
+            return frozenset(value)
+        return frozenset((value,))
+
+    def get_log_flags(self, proc: str) -> typing.Tuple[bool, bool]:
+        """
+        :param proc: name of the process of the message, see Settings.print_log
+        :return: (log the message, print the message)
+        """
+        flags = self.log_flags.get(proc)
+        if flags is None:
+            flags = self.log_flags[proc] = (proc + '_log' in self.log_mode, proc + '_print' in self.log_mode)
+        return flags
@@ -1,22 +1,29 @@
 from __future__ import annotations
-import ast
-import json
+import heapq
+import math
 import os
 import re
 import statistics
+import sys
 import typing
 import uuid
 import pytz
-import multiprocessing as mp
 from time import time
 from math import log10
-from os import listdir
-from os.path import isfile, isdir, join
+from os.path import join
 from datetime import datetime, timedelta
 from exiftool import exiftool
 from multipledispatch import dispatch
 from timezonefinder import TimezoneFinder
 from src.geo import ManualData, GeoMultiTrack, GeoTrackPoint, Address, GeoObjects, CalibrateCameraClocks
+from src.exif_cache import ExifCache
+from src.exif_pool import ExifToolPool
+from src.journal import Journal
+from src.done_folders import DoneFolders
+from src.tree_plan import TreePlan
+from src.folder_snapshot import FolderSnapshot
+from src.file_times import FileTimes
+from src.grouping import GroupPatterns
 from src import func
 from src.settings import Settings
 
@@ -30,6 +37,14 @@ class PVFile(Settings):
     # Tool to read and update exif-tags
     exif_tool = exiftool.ExifTool()
     tf = TimezoneFinder()
+    # Read camera id tags in 'lean' read mode even if the settings don't need the camera key. Used by tools.
+    read_camera_tags = False
+    # There are as many objects as files, so they have no per-instance __dict__.
+    __slots__ = ('prev_sd_value', 'f_id', 'gr_id', 'pv_group', 'file_path', 'file_name', 'new_file_name',
+                 'new_file_path', 'new_name_parts', 'all_exif_tags', 'coord_source', 'coord', 'alt', 'prev_alt',
+                 'prev_coord', 'script_data', 'new_script_data', 'new_coord', 'utc_datetime', 'file_datetime',
+                 'first_datetime', 'file_naming_datetime', 'file_ts', 'dt_source', 'camera_key', 'camera_full_key',
+                 'camera_found', 'mac_tags_names', 'sidecar_path')
 
     def __init__(self,
                  pv_group: typing.Optional[PVGroup],
@@ -46,7 +61,8 @@ class PVFile(Settings):
         self.new_name_parts = {'prefix': kwargs['name_prefix'] if 'name_prefix' in kwargs else '',
                                'suffix': kwargs['name_suffix'] if 'name_suffix' in kwargs else '',
                                'ext': kwargs['name_ext'] if 'name_ext' in kwargs else ''}
-        self.exif_tags = {}
+        # All metadata tags of the file. They are read on demand, see exif_tags property.
+        self.all_exif_tags = None
         self.coord_source = ''
         self.coord = ()
         self.alt = 0
@@ -59,57 +75,149 @@ class PVFile(Settings):
         self.file_datetime = None
         self.first_datetime = None
         self.file_naming_datetime = None
+        # Epoch seconds of file_datetime with subseconds if they are in the metadata.
+        self.file_ts = math.nan
         self.dt_source = ''
         self.camera_key = ''
         self.camera_full_key = ''
         self.camera_found = False
         self.mac_tags_names = []
+        # XMP sidecar to store the script data and coordinates instead of the file, see 'exif_sidecar_types'.
+        pv_folder = pv_group.pv_folder if pv_group else None
+        self.sidecar_path = pv_folder.sidecar_path_by_file_path.get(file_path, '') if pv_folder else ''
 
         if not PVFile.exif_tool.running:
             PVFile.exif_tool.run()
         self.get_file_info()
 
-    def get_file_exif_tags(self) -> typing.NoReturn:
+    @property
+    def exif_tags(self) -> typing.Dict[str, typing.Any]:
+        """
+        All metadata tags of the file. In 'lean' read mode only the tags used by the script are read when the object
+        is created, so all tags are read the first time they are requested.
+        """
+        if self.all_exif_tags is None:
+            self.all_exif_tags = self.get_file_exif_tags(True)
+        return self.all_exif_tags
+
+    @exif_tags.setter
+    def exif_tags(self, exif_tags: typing.Dict[str, typing.Any]) -> typing.NoReturn:
+        self.all_exif_tags = exif_tags
+
+    def get_file_exif_tags(self, all_tags: bool = False) -> typing.Dict[str, typing.Any]:
+        """
+        Read metadata tags of the file.
+        :param all_tags: read all tags, otherwise tags according to the 'exif_read_mode' setting
+        """
+        read_args = [] if all_tags else self.get_exif_read_args()
+        # Take metadata previously read in batch for the whole folder.
+        pv_folder = self.pv_group.pv_folder if self.pv_group else None
+        if not all_tags and pv_folder and self.file_path in pv_folder.exif_tags_by_file_path:
+            return pv_folder.exif_tags_by_file_path.pop(self.file_path)
+
+        # Files of a folder have been already looked for in the cache before the batch read.
+        if not pv_folder or all_tags:
+            exif_tags = ExifCache.get_files_tags([self.file_path], read_args)
+            if exif_tags:
+                return exif_tags[self.file_path]
+
         exif_info = None
         exif_tags = {}
+        if not PVFile.exif_tool.running:
+            PVFile.exif_tool.run()
         # Use the exif_tool to read and wright file statistic in EXIF:
-        if PVFile.exif_tool.running:
-            try:
-                exif_info = PVFile.exif_tool.execute('-j', self.file_path)
-            except Exception as ex:
-                self.print_log('e', 'main', '(get_file_exif_tags) exif_tool.execute ' + str(ex) + ' ' + self.file_path)
-                exif_info = None
+        try:
+            exif_info = PVFile.exif_tool.execute('-j', *read_args, self.file_path, raw_bytes=True)
+        except Exception as ex:
+            self.print_log('e', 'main', '(get_file_exif_tags) exif_tool.execute ' + str(ex) + ' ' + self.file_path)
 
         if exif_info:
             try:
-                exif_tags = ast.literal_eval(exif_info)[0]
-            except ValueError:
-                try:
-                    exif_tags = json.loads(exif_info)[0]
-                except ValueError:
-                    self.print_log('e', 'main', '(get_file_exif_tags) exif_tags_error ' + self.file_path)
+                exif_tags = next(func.get_exif_json_records(exif_info), {})
+            except (ValueError, TypeError):
+                self.print_log('e', 'main', '(get_file_exif_tags) exif_tags_error ' + self.file_path)
 
-        self.exif_tags = exif_tags
+        ExifCache.put_files_tags({self.file_path: exif_tags}, read_args)
+        return exif_tags
+
+    @staticmethod
+    def get_exif_read_tags_names() -> typing.List[str]:
+        """
+        Get the minimal list of metadata tags used by the current settings and mode presets.
+        """
+        tags_names = [t_name for t_name in PVFile.get_par([], 'EXIF_create_dt_tag_name') if t_name[:1] != '-']
+        # Script data keeps the source of coordinates, so it is needed to decide if the coordinates are original.
+        tags_names.append(PVFile.get_par('XMP:UserComment', 'script_data_tag_name'))
+        tags_names += ['Composite:GPSLatitude', 'Composite:GPSLongitude', 'Composite:GPSAltitude']
+
+        # Camera key is needed only by some of the stages.
+        camera_key_shift = PVFile.get_par({}, 'time_shift_by_settings', 'camera_key_shift')
+        camera_needed = PVFile.check_par('get', ('get_utc_calibrate_by_track',
+                                                 'get_file_data_from_manual_file',
+                                                 'get_file_data_by_file_tags')) or \
+            PVFile.check_par('set', 'exif_set') or \
+            (PVFile.check_par('set', 'mac_tags_set') and PVFile.check_par('mactag_order', 'mactag_camera_key')) or \
+            (PVFile.get_par(False, 'create_exist_track') and PVFile.get_par(False, 'split_exist_track_by_cameras')) or \
+            bool(camera_key_shift)
+        if camera_needed or PVFile.read_camera_tags:
+            tags_names += PVFile.get_par([], 'EXIF_camera_id_tags_names')
+
+        # Tags of XMP sidecars.
+        if PVFile.get_par([], 'exif_sidecar_types'):
+            tags_names += [func.get_sidecar_tag_name(PVFile.get_par('XMP:UserComment', 'script_data_tag_name')),
+                           'XMP:GPSLatitude', 'XMP:GPSLongitude', 'XMP:GPSAltitude', 'XMP:GPSAltitudeRef']
+
+        tags_names = [t_name.strip() for t_name in tags_names if t_name.strip()]
+        return list(dict.fromkeys(tags_names))
 
-    def get_exif_script_data(self) -> typing.NoReturn:
+    @staticmethod
+    def get_exif_read_args() -> typing.List[str]:
+        """
+        Get ExifTool arguments for reading metadata according to the 'exif_read_mode' setting:
+        'full' - read all tags, 'lean' - read only tags used by the script with ExifTool fast scan options.
+        """
+        if PVFile.get_par('full', 'exif_read_mode') != 'lean':
+            return []
+        tags_names = PVFile.get_exif_read_tags_names()
+        # '-fast2' also skips MakerNotes, so it is used only if no MakerNotes tags are needed.
+        fast_arg = '-fast' if any(t_name.upper().startswith('MAKERNOTES:') for t_name in tags_names) else '-fast2'
+        return [fast_arg] + ['-' + t_name for t_name in tags_names]
+
+    @staticmethod
+    def merge_sidecar_exif_tags(exif_tags: typing.Dict[str, typing.Any],
+                                sidecar_tags: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """
+        Take the script data and coordinates from the XMP sidecar of the file instead of the file's own tags.
+        """
+        exif_tags = dict(exif_tags)
+        script_data_tag_name = PVFile.get_par('XMP:UserComment', 'script_data_tag_name')
+        sidecar_script_data_tag_name = func.get_sidecar_tag_name(script_data_tag_name)
+        if sidecar_script_data_tag_name in sidecar_tags:
+            exif_tags[script_data_tag_name] = sidecar_tags[sidecar_script_data_tag_name]
+        if sidecar_tags.get('XMP:GPSLatitude', '') != '' and sidecar_tags.get('XMP:GPSLongitude', '') != '':
+            exif_tags['Composite:GPSLatitude'] = sidecar_tags['XMP:GPSLatitude']
+            exif_tags['Composite:GPSLongitude'] = sidecar_tags['XMP:GPSLongitude']
+            exif_tags.pop('Composite:GPSAltitude', None)
+            if sidecar_tags.get('XMP:GPSAltitude', '') != '':
+                altitude = sidecar_tags['XMP:GPSAltitude']
+                exif_tags['Composite:GPSAltitude'] = \
+                    '-' + str(altitude) if str(sidecar_tags.get('XMP:GPSAltitudeRef', '')) == '1' else altitude
+        return exif_tags
+
+    def get_exif_script_data(self, exif_tags: typing.Dict[str, typing.Any]) -> typing.NoReturn:
         # Get previous calculation.
         self.script_data = {}
-        script_data_str = self.exif_tags.get(self.get_par('', 'script_data_tag_name'), '')
+        script_data_str = exif_tags.get(self.get_par('', 'script_data_tag_name'), '')
         if script_data_str:
-            self.prev_sd_value = script_data_str.strip()
-            try:
-                self.script_data = ast.literal_eval(script_data_str)
-                if type(self.script_data) is dict and 'pvs' in self.script_data:
-                    self.coord_source = self.script_data.get('coord_source', '')
-                    self.first_datetime = func.string_to_datetime(self.script_data['first_dt'], '%Y:%m:%d %H:%M:%S') \
-                        if 'first_dt' in self.script_data else None
-                    self.gr_id = self.script_data.get('gr_id', '')
-                    self.f_id = self.script_data.get('f_id', '')
-                    self.prev_sd_value = self.script_data.get('prev_value', '')
-                else:
-                    self.script_data = {}
-            except (ValueError, TypeError, SyntaxError):
-                pass
+            self.prev_sd_value = str(script_data_str).strip()
+            self.script_data = func.sd_data(script_data_str)
+            if self.script_data:
+                self.coord_source = self.script_data.get('coord_source', '')
+                self.first_datetime = func.string_to_datetime(self.script_data['first_dt'], '%Y:%m:%d %H:%M:%S') \
+                    if 'first_dt' in self.script_data else None
+                self.gr_id = self.script_data.get('gr_id', '')
+                self.f_id = self.script_data.get('f_id', '')
+                self.prev_sd_value = self.script_data.get('prev_value', '')
 
     @staticmethod
     def get_file_camera_key(exif_camera_id_tags_names: typing.List[str],
@@ -135,54 +243,73 @@ class PVFile(Settings):
                     camera_found = True
                     break
             camera_key = camera_key if camera_key else ('_'.join(short_keys))[:50]
-        return camera_found, camera_key, camera_full_key
+        # Files of the same camera share the strings of the keys.
+        return camera_found, sys.intern(camera_key), sys.intern(camera_full_key)
+
+    @staticmethod
+    def get_exif_datetime(exif_tags: typing.Dict[str, typing.Any]) -> typing.Tuple[typing.Optional[datetime], float]:
+        """
+        Get creation date and time from the first tag of 'EXIF_create_dt_tag_name' with a valid value.
+        :return: (datetime, epoch seconds) or (None, nan), see func.parse_exif_datetime
+        """
+        for t_name in PVFile.get_par([], 'EXIF_create_dt_tag_name'):
+            if t_name in exif_tags:
+                date_time, seconds = func.parse_exif_datetime(exif_tags[t_name])
+                if date_time:
+                    return date_time, seconds
+        return None, math.nan
 
     def get_file_info(self) -> typing.NoReturn:
-        # Read EXIF tags from file
-        self.get_file_exif_tags()
+        # Read EXIF tags from file. Only in 'full' read mode they are all tags of the file.
+        exif_tags = self.get_file_exif_tags()
+        if self.get_par('full', 'exif_read_mode') != 'lean':
+            self.all_exif_tags = exif_tags
         # Get previous results. First of all 'coord_source'.
-        self.get_exif_script_data()
+        self.get_exif_script_data(exif_tags)
 
         cam_info = self.get_file_camera_key(self.get_par([], 'EXIF_camera_id_tags_names'),
                                             self.get_par({}, 'cameras'),
-                                            self.exif_tags)
+                                            exif_tags)
         self.camera_found, self.camera_key, self.camera_full_key = cam_info
 
-        # Get creation date and time from EXIF from fields in descending order of precedence.
-        for t_name in self.get_par([], 'EXIF_create_dt_tag_name'):
-            if t_name in self.exif_tags:
-                # self.file_datetime = func.exif_gpx_string_to_datetime(self.exif_tags[t_name])
-                self.file_datetime = func.string_to_datetime(self.exif_tags[t_name], '%Y:%m:%d %H:%M:%S')
-                if self.file_datetime:
-                    self.dt_source = 'exif'
-                    self.first_datetime = self.first_datetime if self.first_datetime else self.file_datetime
-                    break
+        # Get creation date and time from EXIF from fields in descending order of precedence. They are parsed for the
+        # whole folder at once, if the metadata was read in batch.
+        pv_folder = self.pv_group.pv_folder if self.pv_group else None
+        if pv_folder and self.file_path in pv_folder.file_datetimes_by_file_path:
+            self.file_datetime, self.file_ts = pv_folder.file_datetimes_by_file_path.pop(self.file_path)
+        else:
+            self.file_datetime, self.file_ts = self.get_exif_datetime(exif_tags)
+        if self.file_datetime:
+            self.dt_source = 'exif'
+            self.first_datetime = self.first_datetime if self.first_datetime else self.file_datetime
 
         # Get coordinates from EXIF.
-        if 'Composite:GPSLatitude' in self.exif_tags and self.exif_tags['Composite:GPSLatitude'] and \
-                'Composite:GPSLongitude' in self.exif_tags and self.exif_tags['Composite:GPSLongitude']:
+        if 'Composite:GPSLatitude' in exif_tags and exif_tags['Composite:GPSLatitude'] and \
+                'Composite:GPSLongitude' in exif_tags and exif_tags['Composite:GPSLongitude']:
             try:
-                self.prev_coord = self.coord = (float(self.exif_tags['Composite:GPSLatitude']),
-                                                float(self.exif_tags['Composite:GPSLongitude']))
+                self.prev_coord = self.coord = (float(exif_tags['Composite:GPSLatitude']),
+                                                float(exif_tags['Composite:GPSLongitude']))
             except ValueError:
                 self.print_log('e', 'main', '(get_pv_info) GPSPosition ' + self.file_path)
         # Get altitude from EXIF.
-        if 'Composite:GPSAltitude' in self.exif_tags and self.exif_tags['Composite:GPSAltitude']:
+        if 'Composite:GPSAltitude' in exif_tags and exif_tags['Composite:GPSAltitude']:
             try:
-                self.prev_alt = self.alt = float(self.exif_tags['Composite:GPSAltitude'])
+                self.prev_alt = self.alt = float(exif_tags['Composite:GPSAltitude'])
             except ValueError:
                 self.print_log('e', 'main', '(get_pv_info) GPSAltitude ' + self.file_path)
 
         # If there is still not datetime value, we get it from the operating system statistics.
         if not self.file_datetime:
-            file_stat = os.stat(self.file_path)
-            birthtime = file_stat.st_birthtime
-            if birthtime and birthtime != '':
+            snapshot = self.get_folder_snapshot()
+            birthtime, mtime = snapshot.get_file_times(self.file_path) if snapshot \
+                else FileTimes.get_file_times(self.file_path)
+            if not math.isnan(birthtime):
                 self.dt_source = 'st_birthtime'
                 self.file_datetime = datetime.fromtimestamp(int(birthtime))
             else:
                 self.dt_source = 'st_mtime'
-                self.file_datetime = datetime.fromtimestamp(int(file_stat.st_mtime))
+                self.file_datetime = datetime.fromtimestamp(int(mtime))
+            self.file_ts = func.datetime_to_epoch(self.file_datetime)
 
         if self.check_par('os', 'macOS'):
             self.mac_tags_names = [str(tag.name) for tag in macos_tags.get_all(file=self.file_path) if len(tag.name)]
@@ -195,23 +322,76 @@ class PVFile(Settings):
             return False
         except FileNotFoundError:
             os.rename(self.file_path, new_file_path)
+            ExifCache.rename_file(self.file_path, new_file_path)
+            self.update_folder_snapshot(self.file_path, new_file_path)
             self.print_log('i', 'main', f"{self.file_path} moved to {new_file_path}")
             self.file_path = new_file_path
+            self.move_sidecar(new_file_path)
             return True
 
+    def get_sidecar_new_path(self, new_file_path: str) -> str:
+        """
+        Get the new path of the XMP sidecar, which is moved together with the file, if the sidecar is not a file of
+        the group itself.
+        :param new_file_path: new path of the file
+        :return: new path of the sidecar or empty string if the sidecar is not moved
+        """
+        group_files = self.pv_group.group_files if self.pv_group else []
+        if not self.sidecar_path or not os.path.exists(self.sidecar_path) or \
+                any(pv_file.file_path == self.sidecar_path for pv_file in group_files):
+            return ''
+        return os.path.splitext(new_file_path)[0] + os.path.splitext(self.sidecar_path)[1]
+
+    def get_planned_renames(self, new_file_path: str) -> typing.List[typing.List[str]]:
+        """
+        Get the list of [path, new path] of the file and its sidecar for the journal, see Journal.plan.
+        """
+        renames = [[self.file_path, new_file_path]] if self.file_path != new_file_path else []
+        new_sidecar_path = self.get_sidecar_new_path(new_file_path) if renames else ''
+        if new_sidecar_path:
+            renames.append([self.sidecar_path, new_sidecar_path])
+        return renames
+
+    def get_folder_snapshot(self) -> typing.Optional[FolderSnapshot]:
+        return self.pv_group.pv_folder.snapshot if self.pv_group and self.pv_group.pv_folder else None
+
+    def update_folder_snapshot(self, file_path: str, new_file_path: str) -> typing.NoReturn:
+        snapshot = self.get_folder_snapshot()
+        if snapshot:
+            snapshot.move_file(file_path, new_file_path)
+
+    def move_sidecar(self, new_file_path: str, job_sing: str = '') -> typing.NoReturn:
+        """
+        Move or rename the XMP sidecar together with the file, if the sidecar is not a file of the group itself.
+        :param new_file_path: new path of the file
+        :param job_sing: technological rename sign, see file_rename
+        """
+        new_sidecar_path = self.get_sidecar_new_path(new_file_path)
+        if not new_sidecar_path:
+            return
+        if os.path.exists(new_sidecar_path):
+            self.print_log('w', 'main', f"Can't move sidecar: {self.sidecar_path} to {new_sidecar_path} - file exist.")
+            return
+        os.rename(self.sidecar_path, new_sidecar_path + job_sing)
+        ExifCache.rename_file(self.sidecar_path, new_sidecar_path)
+        self.update_folder_snapshot(self.sidecar_path, new_sidecar_path + job_sing)
+        self.print_log('i', 'rename', f"{self.sidecar_path} -> {new_sidecar_path}")
+        self.sidecar_path = new_sidecar_path
+
     def get_new_file_name(self, name_core: str, num: str, naming_datetime: datetime) -> str:
-        if self.no_empty_par('new_name_order'):
+        snapshot = self.get_snapshot()
+        if snapshot.new_name_order:
             self.file_naming_datetime = naming_datetime
             self.new_name_parts['num'] = num
             self.new_name_parts['name_core'] = name_core
             file_ext = os.path.splitext(self.file_name)[1]
             self.new_name_parts['ext'] = self.new_name_parts['ext'] if self.new_name_parts['ext'] else file_ext
             self.new_file_name = ''
-            for name_part in self.get_par([], 'new_name_order'):
+            for name_part in snapshot.new_name_order:
                 self.new_file_name += self.new_name_parts[name_part]
             self.new_file_name += self.new_name_parts['ext']
 
-            new_name_case = self.get_par('as_is', 'new_name_case')
+            new_name_case = snapshot.new_name_case
             if new_name_case == 'lower':
                 self.new_file_name = self.new_file_name.lower()
             elif new_name_case == 'upper':
@@ -280,7 +460,8 @@ class PVFile(Settings):
                                              'GPSAltitude': ''})
 
     def set_new_sd_and_coord_for_erase_coord(self) -> typing.NoReturn:
-        script_data = self.script_data
+        # Copy, so that the script data read from the file is kept to compare with the new one.
+        script_data = dict(self.script_data)
         if 'coord_source' in script_data:
             del script_data['coord_source']
         if 'coord_type' in script_data:
@@ -301,10 +482,11 @@ class PVFile(Settings):
         :return:
         """
         gr = self.pv_group
+        snapshot = self.get_snapshot()
         # At first keep only macOS tags with one of signs from par['keep_mac_tag'] in the beginning of tag.
         macos_tag_list = []
         for tag in macos_tags.get_all(file=self.file_path):
-            for keep_sing in self.get_par([], 'mactag_keep_signs'):
+            for keep_sing in snapshot.mactag_keep_signs:
                 if func.str_after_sing(tag.name, keep_sing):
                     macos_tag_list.append(tag)
         try:
@@ -316,11 +498,11 @@ class PVFile(Settings):
         for macos_tag in macos_tag_list:
             macos_tags.add(macos_tag, file=self.file_path)
 
-        for step_tag in self.get_par([], 'mactag_order'):
+        for step_tag in snapshot.mactag_order:
             # If the addr_if_obj_to_mac_tag not set, then address tags are not saved if there are calculated
             # object tags.
             if step_tag == 'mactag_address' and gr.address.tags and \
-                    (not gr.object_tags or self.check_par('set', 'addr_if_obj_to_mac_tag')):
+                    (not gr.object_tags or 'addr_if_obj_to_mac_tag' in snapshot.set):
                 for address_tag in gr.address.tags:
                     self.set_macos_tag('mactag_address', address_tag)
 
@@ -408,17 +590,22 @@ class PVFile(Settings):
         return True
 
     def set_macos_tag(self, tag_settings_name: str, *args: str) -> typing.NoReturn:
-        if self.get_par(False, tag_settings_name, 'active'):
+        active, prefix, color = self.get_snapshot().mactags.get(tag_settings_name, (False, '', 0))
+        if active:
             text = args[0] if args and args[0] else ''
-            tag = macos_tags.Tag(name=self.get_par('', tag_settings_name, 'prefix') + text,
-                                 color=func.get_macos_tag_color_code(self.get_par('NONE', tag_settings_name, 'color')))
+            tag = macos_tags.Tag(name=prefix + text, color=color)
             macos_tags.add(tag, file=self.file_path)
 
     def file_rename(self, *args: str) -> typing.NoReturn:
         new_file_p = args[0] if args and args[0] else self.new_file_path
         if self.file_path != new_file_p:
-            os.rename(self.file_path, new_file_p + self.get_par('-_t_-', 'job_sing'))
+            job_sing = self.get_snapshot().job_sing
+            os.rename(self.file_path, new_file_p + job_sing)
+            # The technological rename sign is removed from the name at the end of the folder processing.
+            ExifCache.rename_file(self.file_path, new_file_p)
+            self.update_folder_snapshot(self.file_path, new_file_p + job_sing)
             self.print_log('i', 'rename', f"{self.file_path} -> {new_file_p}")
+            self.move_sidecar(new_file_p, job_sing)
         else:
             self.print_log('i', 'rename', f"{self.file_path} File name has not been changed")
 
@@ -427,6 +614,7 @@ class PVFile(Settings):
         PVFile.exif_tool.execute(b"-overwrite_original",
                                  b"-TAG=",
                                  b_file_path)
+        ExifCache.remove_file(self.file_path)
 
     def clear_file_coord(self) -> typing.NoReturn:
         self.coord = ()
@@ -438,6 +626,67 @@ class PVFile(Settings):
     def set_new_script_data(self, new_script_data: dict) -> typing.NoReturn:
         self.new_script_data = new_script_data
 
+    def get_new_exif_tags_values(self) -> typing.Dict[str, typing.Any]:
+        """
+        Get values of tags as ExifTool reads them after writing new script data and coordinates to the file.
+        In the XMP sidecar, altitude is not signed, but has the reference tag.
+        :return: {tag_name: value or None if the tag is removed}
+        """
+        new_tags = {}
+        if self.new_script_data:
+            script_data_tag_name = self.get_par('XMP:UserComment', 'script_data_tag_name')
+            if self.sidecar_path:
+                script_data_tag_name = func.get_sidecar_tag_name(script_data_tag_name)
+            new_tags[script_data_tag_name] = func.encode_script_data(self.new_script_data)
+        if self.new_coord:
+            for tag_name, neg_ref in (('GPSLatitude', 'S'), ('GPSLongitude', 'W'), ('GPSAltitude', '1')):
+                if tag_name not in self.new_coord:
+                    continue
+                value = self.new_coord[tag_name]
+                ref = self.new_coord[tag_name + 'Ref']
+                signed_value = (-float(value) if ref == neg_ref else float(value)) if value else None
+                if not self.sidecar_path:
+                    new_tags['Composite:' + tag_name] = signed_value
+                elif tag_name != 'GPSAltitude':
+                    new_tags['XMP:' + tag_name] = signed_value
+                else:
+                    new_tags['XMP:GPSAltitude'] = float(value) if value else None
+                    new_tags['XMP:GPSAltitudeRef'] = int(ref) if value else None
+        return new_tags
+
+    def plan_exif_write(self) -> bool:
+        """
+        Leave in new_script_data and new_coord only the values which differ from the metadata read from the file.
+        Coordinates are compared with the precision of their storage in the file. If any coordinate differs, all of
+        them are written together, so the GPS tags of the file always hold one whole position.
+        :return: True if there is anything to write to the file
+        """
+        if self.new_script_data and self.new_script_data == self.script_data:
+            self.new_script_data = {}
+        if self.new_coord:
+            prev_lat, prev_lon = self.prev_coord if self.prev_coord else (None, None)
+            # Altitude without coordinates is not read, if it is 0.
+            prev_alt = self.prev_alt if self.prev_coord or self.prev_alt else None
+            coord_changed = False
+            for tag_name, neg_ref, prev_value, precision in (('GPSLatitude', 'S', prev_lat, 1e-6),
+                                                             ('GPSLongitude', 'W', prev_lon, 1e-6),
+                                                             ('GPSAltitude', '1', prev_alt, 1e-2)):
+                if tag_name not in self.new_coord:
+                    continue
+                value = self.new_coord[tag_name]
+                ref = self.new_coord[tag_name + 'Ref']
+                if value:
+                    new_value = -float(value) if ref == neg_ref else float(value)
+                    changed = prev_value is None or abs(new_value - prev_value) > precision
+                else:
+                    changed = prev_value is not None
+                if changed:
+                    coord_changed = True
+                    break
+            if not coord_changed:
+                self.new_coord = {}
+        return bool(self.new_script_data or self.new_coord)
+
     def get_new_f_id(self) -> typing.NoReturn:
         if not self.f_id:
             self.f_id = str(uuid.uuid4())
@@ -447,16 +696,47 @@ class PVFolder(Settings):
     def __init__(self, folder_path: str):
         self.folder_path = folder_path
         self.folder_name = os.path.split(folder_path)[1]
+        # Entries of the folder read once and served to all stages of the folder processing
+        self.snapshot = FolderSnapshot(folder_path)
         self.pv_groups = {}
         self.folder_files = {}
         self.pv_group_name_by_file_name = {}
         self.pv_groups_by_name_key = {}
+        # Metadata read in batch before creating of groups and creation date and time parsed from it
+        self.exif_tags_by_file_path = {}
+        self.file_datetimes_by_file_path = {}
+        # XMP sidecars of the files, whose script data and coordinates are stored in sidecars.
+        self.sidecar_path_by_file_path = {}
         # Manual data for update photo/video files
         self.manual_data = ManualData()
         self.manual_data.load_folder_manual_data_file(folder_path)
         self.path_phrases_tags = self.get_path_phrases_tags()
         self.cameras = {}
         self.multi_track = GeoMultiTrack()
+        # Paths of the subfolders to process after this folder, see PVFolder.run_process_tree
+        self.subfolders_paths = []
+
+    @staticmethod
+    def run_process_tree(folder_path: str, plan: TreePlan) -> typing.NoReturn:
+        """
+        Process the folder and its subfolders in the order of the plan: the subfolders of a folder are ready after
+        the folder is finished, and the ready folder with the highest priority of the plan is processed next.
+        Folders wait only as paths: a folder is finished and all its data is released before the next one is started.
+        Done folders of the plan are skipped without reading them.
+        """
+        ready = [(plan.get_priority(folder_path), folder_path)]
+        while ready:
+            folder_path = heapq.heappop(ready)[1]
+            if plan.is_done(folder_path):
+                PVFolder.print_log('i', 'main', f'Skipped done: {folder_path}')
+                subfolders_paths = plan.jobs[folder_path].subfolders_paths
+            else:
+                pv_folder = PVFolder(folder_path)
+                pv_folder.run_process_folder()
+                subfolders_paths = pv_folder.subfolders_paths
+                del pv_folder
+            for subfolder_path in subfolders_paths:
+                heapq.heappush(ready, (plan.get_priority(subfolder_path), subfolder_path))
 
     def run_process_folder(self) -> bool:
         """
@@ -464,10 +744,9 @@ class PVFolder(Settings):
         """
 
         # Check that this folder has not been worked on yet.
-        done_folders_list = func.load_pickle_file_as_struct(PVFolder.get_par('', 'done_folders_pickle_file_path'), [])
-        if self.folder_path in done_folders_list:
+        if DoneFolders.is_done(self.folder_path):
             self.print_log('i', 'main', f'Skipped done: {self.folder_path}')
-            self.run_subfolders_process()
+            self.plan_subfolders_process()
             return False
 
         self.print_log('i', 'main', f'=== Start working on ===: {self.folder_path}')
@@ -499,7 +778,7 @@ class PVFolder(Settings):
 
         if not self.pv_groups:
             self.print_log('i', 'main', f'Skipped empty: {self.folder_path}')
-            self.run_subfolders_process()
+            self.plan_subfolders_process()
             return False
 
         # Get all cameras keys
@@ -527,7 +806,7 @@ class PVFolder(Settings):
         # Load all .gpx files from current folder
         if self.check_par('get', 'get_coord_by_gpx_file'):
             gpx_multi_track = GeoMultiTrack()
-            gpx_multi_track.load_gpx_folder(self.folder_path)
+            gpx_multi_track.load_gpx_folder(self.folder_path, self.snapshot)
             self.multi_track.add_multi_track(gpx_multi_track)
 
         if self.check_par('get', 'get_utc_calibrate_by_track') and self.multi_track:
@@ -552,7 +831,7 @@ class PVFolder(Settings):
                 return False
         if not self.pv_groups:
             self.print_log('i', 'main', f'Skipped devastated: {self.folder_path}')
-            self.run_subfolders_process()
+            self.plan_subfolders_process()
             return False
 
         # For each file group without coordinates gt coordinates by utc datetime
@@ -620,36 +899,46 @@ class PVFolder(Settings):
             if not self.set_macos_tags():
                 return False
 
-        # According to the settings and previous calculations set EXIF data.
+        # If something went wrong, and we got duplicate new filenames, don't start the renaming process.
+        if self.check_par('set', 'rename_set') and not self.final_check_files_names_before_rename():
+            return False
+
+        # According to the settings and previous calculations get new EXIF data.
+        files_exif_data = []
         if self.check_par('set', 'exif_set'):
             self.get_new_sd_and_coord()
-            self.set_folder_exif_tags()
+            files_exif_data = self.plan_folder_exif_writes()
 
-        # If something went wrong, and we got duplicate new filenames, don't start the renaming process.
-        if not self.final_check_files_names_before_rename():
-            return False
+        # Modify information about by hand coordinates in photo/video files.
+        if self.check_par('set', 'rename_set'):
+            self.manual_data.rename_before_save_manual_data_file({pv_group.name: pv_group.new_name for
+                                                                  pv_group in self.pv_groups.values()})
+        self.manual_data.sort_manual_data_file()
+
+        # Record all changes of the folder files in the journal before making them.
+        journal_id = self.plan_folder_changes(files_exif_data)
+
+        # According to the settings and previous calculations set EXIF data.
+        if self.check_par('set', 'exif_set'):
+            self.set_folder_exif_tags(files_exif_data, journal_id)
 
         # Renaming file plus adding a technological rename sign 'job_sing'
         # 1 of 2 step renaming to temporary names
         if self.check_par('set', 'rename_set'):
             self.final_rename()
+            Journal.progress(journal_id, renamed=True)
 
         # Clean up after current rename job - remove technological rename sign from files names.
         self.file_names_clean_up()
 
         # Save by hand coordinates to file settings['manual_data_file'] in current folder
-        if self.check_par('set', 'rename_set'):
-            # Modify information about by hand coordinates in photo/video files.
-            self.manual_data.rename_before_save_manual_data_file({pv_group.name: pv_group.new_name for
-                                                                  pv_group in self.pv_groups.values()})
-        self.manual_data.sort_manual_data_file()
         self.manual_data.save_folder_manual_data_file()
 
         # Write the current folder to the list of processed ones.
-        done_folders_list.append(self.folder_path)
-        func.save_struct_as_txt_file(self.get_par('', 'done_folders_txt_file_path'),
-                                     done_folders_list, 'done_folders')
-        func.save_struct_as_pickle_file(self.get_par('', 'done_folders_pickle_file_path'), done_folders_list)
+        DoneFolders.add(self.folder_path)
+        Journal.end(journal_id)
+        # Save changes of the metadata cache after writing tags and renaming.
+        ExifCache.save_exif_cache()
         # Save address cache to the file.
         if self.check_par('get', 'get_address') and Address.addr_cache:
             Address.save_address_cache()
@@ -665,7 +954,7 @@ class PVFolder(Settings):
 
         self.print_log('i', 'main', f'Processed: {self.folder_path}')
 
-        self.run_subfolders_process()
+        self.plan_subfolders_process()
 
     def add_group_to_folder(self, pv_group_name: str, pv_group: PVGroup) -> typing.NoReturn:
         self.pv_groups[pv_group_name] = pv_group
@@ -683,7 +972,7 @@ class PVFolder(Settings):
 
     # Sorting of the main data structure of photo/video files.
     def sort(self) -> typing.NoReturn:
-        self.pv_groups = {s_n: pv_g for s_n, pv_g in sorted(self.pv_groups.items(), key=lambda li: li[1].sort_key)}
+        self.pv_groups = {s_n: pv_g for s_n, pv_g in sorted(self.pv_groups.items(), key=lambda li: li[1].sort_ts)}
 
     def file_names_clean_up(self) -> typing.NoReturn:
         """
@@ -692,84 +981,75 @@ class PVFolder(Settings):
         """
         job_sing = PVFolder.get_par('-_t_-', 'job_sing')
         self.print_log('i', 'stage', f"{self.folder_path}: Start cleanup after rename.")
-        job_list = [f for f in listdir(self.folder_path) if
-                    isfile(join(self.folder_path, f)) and job_sing in f]
+        job_list = [f for f in self.snapshot.get_files_names() if job_sing in f]
         for file in job_list:
             os.rename(join(self.folder_path, file), join(self.folder_path, file.replace(job_sing, '')))
+            self.snapshot.move_file(join(self.folder_path, file), join(self.folder_path, file.replace(job_sing, '')))
         self.print_log('i', 'stage', f"{self.folder_path}: Finished cleanup after rename.")
 
-    def run_subfolders_process(self) -> typing.NoReturn:
+    def plan_subfolders_process(self) -> typing.NoReturn:
         """
-        Starting recurrent process on all subfolders.
+        Plan the recurrent process of all subfolders, they are processed by PVFolder.run_process_tree after this folder.
         Process ignore folders which name started by 'ignore' and all their subfolders.
         :return:
         """
         if self.get_par(True, 'recurrent'):
             ignore_sing = self.get_par('', 'ignore_sing')
             ignor_sign_len = len(ignore_sing)
-            for folder in [folder for folder in listdir(self.folder_path) if isdir(join(self.folder_path, folder))]:
+            for folder in self.snapshot.folders:
                 if len(folder) >= ignor_sign_len and folder[:ignor_sign_len] != ignore_sing:
-                    folder_path = join(self.folder_path, folder)
-                    rec_folder = PVFolder(folder_path)
-                    rec_folder.run_process_folder()
+                    self.subfolders_paths.append(join(self.folder_path, folder))
 
     def add_masters_to_main_data_structures(self, file_list: typing.List[str]) -> bool:
-        case_sens = self.get_par(False, 'group_pattern_case_sensitive')
         # Creating groups by master files settings. 'masters'
-        files_count = 0
-        for file in file_list:
-            files_count += 1
-            for pattern, scheme in self.get_par({}, 'masters').items():
-                name_key_re = re.findall(pattern, file) if case_sens else re.findall(pattern.upper(), file.upper())
-                if name_key_re:
-                    name_key = name_key_re[0]
-                    if file in self.pv_groups:
-                        self.print_log('w', 'main', f"According to the settings, {file} is included in more than "
-                                                    f"one group as the master one. Probably incorrect 'masters' "
-                                                    f"setting.")
-                        return False
-                    pv_group = PVGroup(self, file, self.folder_path)
-                    pv_group.add_file_to_group(join(self.folder_path, file),
-                                               name_prefix=scheme['prefix'],
-                                               name_suffix=scheme['suffix'],
-                                               name_ext=scheme['ext'])
-                    self.add_group_to_folder(file, pv_group)
-                    self.pv_groups_by_name_key[name_key] = pv_group
-                    self.pv_group_name_by_file_name[file] = file
-            self.print_counter(f"{self.folder_path}: Creating main data structure - masters. {files_count} file "
-                               f"from {len(file_list)} files. Created {len(self.pv_groups)} groups.")
+        masters = GroupPatterns(self.get_par({}, 'masters'), self.get_par(False, 'group_pattern_case_sensitive'))
+        for files_count, file in enumerate(file_list, 1):
+            for name_key, scheme in masters.get_name_keys(file):
+                if file in self.pv_groups:
+                    self.print_log('w', 'main', f"According to the settings, {file} is included in more than "
+                                                f"one group as the master one. Probably incorrect 'masters' "
+                                                f"setting.")
+                    return False
+                pv_group = PVGroup(self, file, self.folder_path)
+                pv_group.add_file_to_group(join(self.folder_path, file),
+                                           name_prefix=scheme['prefix'],
+                                           name_suffix=scheme['suffix'],
+                                           name_ext=scheme['ext'])
+                self.add_group_to_folder(file, pv_group)
+                self.pv_groups_by_name_key[name_key] = pv_group
+                self.pv_group_name_by_file_name[file] = file
+            if not files_count % 1000 or files_count == len(file_list):
+                self.print_counter(f"{self.folder_path}: Creating main data structure - masters. {files_count} file "
+                                   f"from {len(file_list)} files. Created {len(self.pv_groups)} groups.")
         if file_list:
             self.print_counter('')
         return True
 
     def add_pair_to_main_data_structures(self, file_list: typing.List[str], pair_type: str) -> bool:
-        case_sens = self.get_par(False, 'group_pattern_case_sensitive')
-        files_count = 0
+        pairs = GroupPatterns(self.get_par({}, pair_type), self.get_par(False, 'group_pattern_case_sensitive'))
         added_count = 0
-        for file in file_list:
-            files_count += 1
-            for pattern, scheme in self.get_par({}, pair_type).items():
-                name_key_re = re.findall(pattern, file) if case_sens else re.findall(pattern.upper(), file.upper())
-                if name_key_re:
-                    name_key = name_key_re[0]
-                    # Add file to the pv_group
-                    if name_key in self.pv_groups_by_name_key.keys() and \
-                            file not in self.pv_group_name_by_file_name.keys():
-                        self.pv_groups_by_name_key[name_key].add_file_to_group(join(self.folder_path, file),
-                                                                               name_prefix=scheme['prefix'],
-                                                                               name_suffix=scheme['suffix'],
-                                                                               name_ext=scheme['ext'])
-                        self.pv_group_name_by_file_name[file] = self.pv_groups_by_name_key[name_key].name
-                        added_count += 1
-                    # Found another pv_group for the file. This situation is not true in the current data model.
-                    elif name_key in self.pv_groups_by_name_key.keys() and \
-                            file in self.pv_group_name_by_file_name.keys():
-                        self.print_log('w', 'main', f"According to the settings, {file} is included in more than "
-                                                    f"one group as the paired one: "
-                                                    f"{self.pv_group_name_by_file_name[file]}  and "
-                                                    f"{self.pv_groups_by_name_key[name_key].name}. Probably incorrect "
-                                                    f"'slave' setting.")
-                        return False
+        for files_count, file in enumerate(file_list, 1):
+            for name_key, scheme in pairs.get_name_keys(file):
+                pv_group = self.pv_groups_by_name_key.get(name_key)
+                if not pv_group:
+                    continue
+                # Add file to the pv_group
+                if file not in self.pv_group_name_by_file_name:
+                    pv_group.add_file_to_group(join(self.folder_path, file),
+                                               name_prefix=scheme['prefix'],
+                                               name_suffix=scheme['suffix'],
+                                               name_ext=scheme['ext'])
+                    self.pv_group_name_by_file_name[file] = pv_group.name
+                    added_count += 1
+                # Found another pv_group for the file. This situation is not true in the current data model.
+                else:
+                    self.print_log('w', 'main', f"According to the settings, {file} is included in more than "
+                                                f"one group as the paired one: "
+                                                f"{self.pv_group_name_by_file_name[file]}  and "
+                                                f"{pv_group.name}. Probably incorrect "
+                                                f"'slave' setting.")
+                    return False
+            if not files_count % 1000 or files_count == len(file_list):
                 self.print_counter(f"{self.folder_path}: Creating main data structure - {pair_type}. "
                                    f"{files_count} file from {len(file_list)} files. Added {added_count} "
                                    f"{pair_type} files to the {len(self.pv_groups)} groups.")
@@ -791,9 +1071,10 @@ class PVFolder(Settings):
             self.pv_groups_by_name_key[name_key] = pv_group
             files_count += 1
 
-            self.print_counter(f"{self.folder_path}: Creating main data structure - non pair. {files_count} file "
-                               f"from {len(file_list)} files. Added {files_count} non pair files and groups. "
-                               f"Total groups: {len(self.pv_groups)}.")
+            if not files_count % 1000 or files_count == len(file_list):
+                self.print_counter(f"{self.folder_path}: Creating main data structure - non pair. {files_count} "
+                                   f"file from {len(file_list)} files. Added {files_count} non pair files and groups. "
+                                   f"Total groups: {len(self.pv_groups)}.")
         if file_list:
             self.print_counter('')
 
@@ -803,10 +1084,16 @@ class PVFolder(Settings):
         start = time()
         # getting a file list of expected types from current folder
         media_types_list = [file_type.upper() for file_type in self.get_par([], 'media_types')]
-        file_list = [f for f in listdir(self.folder_path) if
-                     isfile(join(self.folder_path, f)) and f.split('.')[-1].upper() in media_types_list]
+        file_list = self.snapshot.get_files_names(media_types_list)
         if not file_list:
             return True
+        add_types_list = [file_type.upper() for file_type in self.get_par([], 'add_types')]
+        add_file_list = self.snapshot.get_files_names(add_types_list)
+
+        # Read metadata of all files before creating groups.
+        self.find_sidecars(file_list)
+        self.prefetch_folder_exif_tags(file_list + (add_file_list if self.no_empty_par('additions') else []))
+
         # ------------masters------------------
         if self.no_empty_par('masters'):
             if not self.add_masters_to_main_data_structures(file_list):
@@ -825,19 +1112,132 @@ class PVFolder(Settings):
 
         # ------------- all additional files ---------------
         # Adding additional files to the pv_groups. For example .XMP
-        add_types_list = [file_type.upper() for file_type in self.get_par([], 'add_types')]
-        file_list = [f for f in listdir(self.folder_path) if
-                     isfile(join(self.folder_path, f)) and f.split('.')[-1].upper() in add_types_list]
-        if file_list and self.pv_groups and self.no_empty_par('additions'):
-            if not self.add_pair_to_main_data_structures(file_list, 'additions'):
+        if add_file_list and self.pv_groups and self.no_empty_par('additions'):
+            if not self.add_pair_to_main_data_structures(add_file_list, 'additions'):
                 return False
 
+        self.exif_tags_by_file_path.clear()
+        self.file_datetimes_by_file_path.clear()
         self.rebuild_folder_files()
+        ExifCache.save_exif_cache()
 
         self.print_log('i', 'stage', f"{self.folder_path}: Finished creating main folder data structure in "
                                      f"{timedelta(seconds=int(time() - start))}. ")
         return True
 
+    def prefetch_folder_exif_tags(self, file_list: typing.List[str]) -> typing.NoReturn:
+        """
+        Read metadata of the folder files before the PVFile objects are created.
+        Files that could not be read in chunks are read one by one when the PVFile objects are created.
+        """
+        if file_list:
+            files_paths = [join(self.folder_path, file) for file in file_list]
+            files_paths += [sidecar_path for sidecar_path in self.sidecar_path_by_file_path.values()
+                            if self.snapshot.is_file(sidecar_path) and sidecar_path not in files_paths]
+            self.exif_tags_by_file_path = self.read_files_exif_tags(files_paths, PVFile.get_exif_read_args())
+            # Script data and coordinates are read from the sidecar first.
+            for file_path, sidecar_path in self.sidecar_path_by_file_path.items():
+                if file_path in self.exif_tags_by_file_path and sidecar_path in self.exif_tags_by_file_path:
+                    self.exif_tags_by_file_path[file_path] = PVFile.merge_sidecar_exif_tags(
+                        self.exif_tags_by_file_path[file_path], self.exif_tags_by_file_path[sidecar_path])
+            self.parse_folder_datetimes()
+
+    def find_sidecars(self, file_list: typing.List[str]) -> typing.NoReturn:
+        """
+        Find XMP sidecars of the files with types from 'exif_sidecar_types'. If a file has no sidecar, the sidecar
+        with the name of the file and '.xmp' extension is created when the metadata is written.
+        """
+        self.sidecar_path_by_file_path = {}
+        sidecar_types = [file_type.upper() for file_type in self.get_par([], 'exif_sidecar_types')]
+        if not sidecar_types:
+            return
+        sidecar_by_name = {os.path.splitext(file)[0].upper(): file
+                           for file in self.snapshot.get_files_names(['XMP'])}
+        for file in file_list:
+            name = os.path.splitext(file)[0]
+            if file.split('.')[-1].upper() in sidecar_types:
+                self.sidecar_path_by_file_path[join(self.folder_path, file)] = \
+                    join(self.folder_path, sidecar_by_name.get(name.upper(), name + '.xmp'))
+
+    def parse_folder_datetimes(self) -> typing.NoReturn:
+        """
+        Parse creation date and time of all files read in batch at once: the values of each tag from
+        'EXIF_create_dt_tag_name' are parsed together for the files without date and time from the previous tags.
+        """
+        self.file_datetimes_by_file_path = {}
+        exif_tags_by_file_path = self.exif_tags_by_file_path
+        files_paths = list(exif_tags_by_file_path.keys())
+        for t_name in self.get_par([], 'EXIF_create_dt_tag_name'):
+            tag_files_paths = [file_path for file_path in files_paths if t_name in exif_tags_by_file_path[file_path]]
+            if not tag_files_paths:
+                continue
+            datetimes, epoch_seconds = func.parse_exif_datetimes(exif_tags_by_file_path[file_path][t_name]
+                                                                 for file_path in tag_files_paths)
+            for file_path, date_time, seconds in zip(tag_files_paths, datetimes, epoch_seconds):
+                if date_time:
+                    self.file_datetimes_by_file_path[file_path] = date_time, seconds
+            files_paths = [file_path for file_path in files_paths if file_path not in self.file_datetimes_by_file_path]
+        # Files without valid values get the date and time from the file system.
+        for file_path in files_paths:
+            self.file_datetimes_by_file_path[file_path] = None, math.nan
+        self.snapshot.load_files_times(files_paths)
+
+    def load_folder_all_exif_tags(self) -> typing.NoReturn:
+        """
+        Read all metadata tags of the folder files in chunks. Used when all tags of all files are needed, instead of
+        reading them file by file on demand.
+        """
+        pv_files = [pv_file for pv_file in self.folder_files.values() if pv_file.all_exif_tags is None]
+        if pv_files:
+            exif_tags_by_file_path = self.read_files_exif_tags([pv_file.file_path for pv_file in pv_files], [])
+            for pv_file in pv_files:
+                if pv_file.file_path in exif_tags_by_file_path:
+                    pv_file.exif_tags = exif_tags_by_file_path[pv_file.file_path]
+
+    def read_files_exif_tags(self,
+                             files_paths: typing.List[str],
+                             read_args: typing.List[str]) -> typing.Dict[str, dict]:
+        """
+        Read metadata of the files by chunks of 'exif_read_chunk_size' files in one ExifTool call.
+        If 'exif_read_processes' is more than 1, the chunks are read in parallel by the pool of ExifTool processes.
+        :param files_paths: full paths of the files
+        :param read_args: ExifTool read arguments, see PVFile.get_exif_read_args
+        :return: {file_path: exif_tags}. Files that could not be read are missing in the result.
+        """
+        # Unchanged files are taken from the metadata cache.
+        exif_tags_by_file_path = ExifCache.get_files_tags(files_paths, read_args, self.snapshot.get_stat)
+        if exif_tags_by_file_path:
+            self.print_log('i', 'stage', f"{self.folder_path}: Metadata of {len(exif_tags_by_file_path)} "
+                                         f"files taken from the cache.")
+        files_paths = [file_path for file_path in files_paths if file_path not in exif_tags_by_file_path]
+        chunk_size = self.get_par(0, 'exif_read_chunk_size')
+        if chunk_size <= 0 or not files_paths:
+            return exif_tags_by_file_path
+        num_proc = self.get_par(0, 'exif_read_processes')
+        start = time()
+        # Reading through the pool of ExifTool processes
+        if num_proc > 1 and len(files_paths) > 1:
+            self.print_log('i', 'stage', f"{self.folder_path}: Start reading metadata from {len(files_paths)} files "
+                                         f"by {num_proc} processes.")
+            ExifToolPool.start(num_proc)
+            read_exif_tags = ExifToolPool.get_files_exif_tags(files_paths, chunk_size, num_proc, *read_args)
+        # Reading through one ExifTool process
+        else:
+            self.print_log('i', 'stage', f"{self.folder_path}: Start reading metadata from {len(files_paths)} files "
+                                         f"by {chunk_size} files.")
+            if not PVFile.exif_tool.running:
+                PVFile.exif_tool.run()
+            read_exif_tags = func.get_files_exif_tags(PVFile.exif_tool, files_paths, chunk_size, *read_args)
+        ExifCache.put_files_tags(read_exif_tags, read_args, self.snapshot.get_stat)
+        exif_tags_by_file_path.update(read_exif_tags)
+        missed_num = len(files_paths) - len(read_exif_tags)
+        if missed_num:
+            self.print_log('w', 'main', f"{self.folder_path}: Can't read metadata of {missed_num} files by chunks. "
+                                        f"They will be read one by one.")
+        self.print_log('i', 'stage', f"{self.folder_path}: Finished reading metadata in "
+                                     f"{timedelta(seconds=int(time() - start))}")
+        return exif_tags_by_file_path
+
     def shift_file_datetime_by_folder_settings(self) -> typing.NoReturn:
         # If current folder settings has information about the time difference for a particular photo-device
         # by the value from the time_shift_by_settings -> camera_key parameter or for all files , apply that.
@@ -867,16 +1267,24 @@ class PVFolder(Settings):
                 sub_folder_path = join(self.folder_path, pv_group.folder_dt_name)
                 if sub_folder_path not in subfolders:
                     func.create_new_folder(sub_folder_path)
+                    self.snapshot.add_folder(pv_group.folder_dt_name)
                     subfolders.append(sub_folder_path)
                 groups_to_move[group_name] = sub_folder_path
 
-        # Moving selected files
+        # Moving selected files. The moves are recorded in the journal, so interrupted moves are finished by
+        # the next run.
         if groups_to_move:
+            journal_id = Journal.plan('moves', self.folder_path, moves=[
+                rename for group_name, new_folder_path in groups_to_move.items()
+                for pv_file in self.pv_groups[group_name].group_files
+                for rename in pv_file.get_planned_renames(join(new_folder_path, pv_file.file_name))])
             for group_name, new_folder_path in groups_to_move.items():
                 if not self.pv_groups[group_name].move_group_to_folder(new_folder_path):
                     self.print_log('w', 'main', f'Skipped {self.folder_path} and all subfolders.')
+                    Journal.end(journal_id)
                     return False
                 del self.pv_groups[group_name]
+            Journal.end(journal_id)
 
         self.rebuild_pv_group_name_by_file_name()
         self.rebuild_folder_files()
@@ -1149,109 +1557,131 @@ class PVFolder(Settings):
             pv_file.set_new_sd_and_coord_from_group()
         self.print_log('i', 'stage', f"{self.folder_path}: Finished getting new data for exif tags in files.")
 
-    def set_folder_exif_tags_one_proc(self) -> typing.NoReturn:
-        script_data_tag_name = self.get_par('script_data_tag_name')
-        num_file = 0
+    def plan_folder_exif_writes(self) -> typing.List[dict]:
+        """
+        Get the data to store in metadata of the folder files: only the files with changes compared to the metadata
+        read from them and only the changed values, see PVFile.plan_exif_write.
+        """
+        files_exif_data = []
+        # A sidecar is written only for the first file of the group that uses it, and not by itself.
+        sidecars_paths = set()
         for pv_file in self.folder_files.values():
-            num_file += 1
-            self.print_counter(f'Setting exif tags to {num_file} of {len(self.folder_files.values())} files.')
-            exif_error = func.set_script_data_and_coord_to_file_exif_tags(PVFile.exif_tool,
-                                                                          pv_file.file_path,
-                                                                          pv_file.new_coord,
-                                                                          pv_file.new_script_data,
-                                                                          script_data_tag_name)
-            if exif_error:
-                self.print_log('e', 'main', exif_error)
-        self.print_counter('')
-
-    def set_folder_exif_tags_multi_proc(self, num_proc: int) -> typing.NoReturn:
-        mp.get_context('spawn')
-        exif_data_q = mp.Queue()
-        exif_errors_q = mp.Queue()
-        exif_answer_q = mp.Queue()
-        script_data_tag_name = self.get_par('XMP:UserComment', 'script_data_tag_name')
-        # Start process
-        processes = []
-        for _ in range(num_proc):
-            p = mp.Process(target=self.execute_exif_tool_mp,
-                           args=(exif_data_q, exif_errors_q, exif_answer_q, script_data_tag_name,))
-            p.start()
-            processes.append(p)
-
-        # Send data
+            if pv_file.sidecar_path and pv_file.sidecar_path not in sidecars_paths:
+                sidecars_paths.add(pv_file.sidecar_path)
+            elif pv_file.sidecar_path:
+                pv_file.set_new_script_data({})
+                pv_file.set_new_coord_for_exif({})
         for pv_file in self.folder_files.values():
-            exif_data = {'file_path': pv_file.file_path,
-                         'new_script_data': pv_file.new_script_data,
-                         'new_coord': pv_file.new_coord}
-            exif_data_q.put(exif_data)
-        for _ in range(num_proc):
-            exif_data_q.put(None)
-
-        # Receive answers
-        answers_nones = num_proc
-        num_file = 0
-        while answers_nones:
-            exif_answer = exif_answer_q.get()
-            if exif_answer:
-                num_file += 1
-                self.print_counter(f'{num_proc} process: Setting exif tags to {num_file} of '
-                                   f'{len(self.folder_files.values())} files.')
-            elif exif_answer is None:
-                answers_nones -= 1
+            if pv_file.file_path in sidecars_paths:
+                pv_file.set_new_script_data({})
+                pv_file.set_new_coord_for_exif({})
+            if pv_file.plan_exif_write():
+                file_path = pv_file.sidecar_path if pv_file.sidecar_path else pv_file.file_path
+                files_exif_data.append({'file_path': file_path,
+                                        'sidecar': bool(pv_file.sidecar_path),
+                                        'new_script_data': pv_file.new_script_data,
+                                        'new_coord': pv_file.new_coord})
+        return files_exif_data
+
+    def plan_folder_changes(self, files_exif_data: typing.List[dict]) -> int:
+        """
+        Record in the journal all changes of the folder files to make: metadata writes, renames and the manual data
+        file. If the job is interrupted, they are finished by the next run without processing the folder again.
+        :return: id of the plan in the journal
+        """
+        renames = []
+        if self.check_par('set', 'rename_set'):
+            for pv_file in self.folder_files.values():
+                renames += pv_file.get_planned_renames(pv_file.new_file_path)
+        return Journal.plan('folder', self.folder_path,
+                            exif=files_exif_data,
+                            script_data_tag_name=self.get_par('XMP:UserComment', 'script_data_tag_name'),
+                            renames=renames,
+                            job_sing=self.get_par('-_t_-', 'job_sing'),
+                            manual_data_file_path=self.manual_data.get_manual_data_file_path(),
+                            manual_data_lines=self.manual_data.get_manual_data_file_lines()
+                            if self.manual_data.manual_data else None)
+
+    def set_folder_exif_tags_one_proc(self, files_exif_data: typing.List[dict], journal_id: int = 0) -> int:
+        """
+        :param journal_id: id of the plan in the journal to record written files
+        :return: number of files with errors
+        """
+        script_data_tag_name = self.get_par('XMP:UserComment', 'script_data_tag_name')
+        errors_num = 0
+        chunk_size = max(self.get_par(100, 'exif_write_chunk_size'), 1)
+        for chunk_begin in range(0, len(files_exif_data), chunk_size):
+            self.print_counter(f'Setting exif tags to {chunk_begin + 1} of {len(files_exif_data)} files.')
+            exif_errors = func.set_files_exif_tags(PVFile.exif_tool,
+                                                   files_exif_data[chunk_begin:chunk_begin + chunk_size],
+                                                   script_data_tag_name)
+            Journal.progress(journal_id, exif=list(range(chunk_begin,
+                                                         min(chunk_begin + chunk_size, len(files_exif_data)))))
+            for file_path, exif_error in exif_errors.items():
+                self.print_log('e', 'main', f"{file_path}: Setting exif tags error: {exif_error}")
+            errors_num += len(exif_errors)
         self.print_counter('')
+        return errors_num
 
-        # Receive errors
-        exif_errors_nones = num_proc
-        while exif_errors_nones:
-            exif_error = exif_errors_q.get()
-            if exif_error:
-                self.print_log('e', 'main', exif_error)
-            elif exif_error is None:
-                exif_errors_nones -= 1
-
-        for p in processes:
-            p.join()
+    def set_folder_exif_tags_multi_proc(self,
+                                        num_proc: int,
+                                        files_exif_data: typing.List[dict],
+                                        journal_id: int = 0) -> int:
+        """
+        Write metadata of the files by the pool of ExifTool processes, which is started once for the whole run.
+        :param journal_id: id of the plan in the journal to record written files
+        :return: number of files with errors
+        """
+        written_num = 0
+
+        def chunk_written(chunk_begin: int, chunk_len: int) -> typing.NoReturn:
+            nonlocal written_num
+            written_num += chunk_len
+            Journal.progress(journal_id, exif=list(range(chunk_begin, chunk_begin + chunk_len)))
+            self.print_counter(f'{num_proc} process: Setting exif tags to {written_num} of '
+                               f'{len(files_exif_data)} files.')
+
+        ExifToolPool.start(num_proc)
+        exif_errors = ExifToolPool.set_files_exif_tags(files_exif_data,
+                                                       self.get_par(100, 'exif_write_chunk_size'),
+                                                       num_proc,
+                                                       self.get_par('XMP:UserComment', 'script_data_tag_name'),
+                                                       chunk_written)
+        self.print_counter('')
+        for file_path, exif_error in exif_errors.items():
+            self.print_log('e', 'main', f"{file_path}: Multiprocess setting exif tags error: {exif_error}")
+        return len(exif_errors)
 
-    def set_folder_exif_tags(self) -> typing.NoReturn:
+    def set_folder_exif_tags(self, files_exif_data: typing.List[dict], journal_id: int = 0) -> typing.NoReturn:
+        """
+        :param files_exif_data: data to store in metadata of the files, see plan_folder_exif_writes
+        :param journal_id: id of the plan in the journal to record written files
+        """
         self.print_log('i', 'stage', f"{self.folder_path}: Start setting exif tags in files.")
         start = time()
         if self.pv_groups:
+            errors_num = 0
             num_proc = self.get_par(0, 'num_multi_processes')
             # Setting exif tags to files through one process
-            if num_proc == 0:
-                self.set_folder_exif_tags_one_proc()
+            if num_proc == 0 or len(files_exif_data) <= 1:
+                errors_num = self.set_folder_exif_tags_one_proc(files_exif_data, journal_id)
             # Setting exif tags to files through many processes
             elif num_proc > 0:
-                self.set_folder_exif_tags_multi_proc(num_proc)
+                errors_num = self.set_folder_exif_tags_multi_proc(num_proc, files_exif_data, journal_id)
+            # Written files are changed and new sidecars are created.
+            for exif_data in files_exif_data:
+                self.snapshot.add_file(exif_data['file_path'])
+            ExifCache.update_files_tags({pv_file.sidecar_path if pv_file.sidecar_path else pv_file.file_path:
+                                         pv_file.get_new_exif_tags_values()
+                                         for pv_file in self.folder_files.values()
+                                         if pv_file.new_script_data or pv_file.new_coord})
+            self.print_log('i', 'stage', f"{self.folder_path}: Metadata of files: {len(files_exif_data)} planned, "
+                                         f"{len(self.folder_files) - len(files_exif_data)} skipped without changes, "
+                                         f"{len(files_exif_data) - errors_num} written.")
 
         self.print_log('i', 'stage', f"{self.folder_path}: Finished setting exif tags in files in "
                                      f"{timedelta(seconds=int(time() - start))}")
 
-    @staticmethod
-    def execute_exif_tool_mp(exif_data_q: mp.Queue,
-                             exif_errors_q: mp.Queue,
-                             exif_answer_q: mp.Queue,
-                             script_data_tag_name: str) -> typing.NoReturn:
-        mp_exif_tool = exiftool.ExifTool()
-        mp_exif_tool.run()
-
-        exif_data = True
-        while exif_data is not None:
-            exif_data = exif_data_q.get()
-            if exif_data:
-
-                error = func.set_script_data_and_coord_to_file_exif_tags(mp_exif_tool,
-                                                                         exif_data['file_path'],
-                                                                         exif_data['new_coord'],
-                                                                         exif_data['new_script_data'],
-                                                                         script_data_tag_name)
-                if error:
-                    exif_errors_q.put(f"{exif_data['file_path']}: Multiprocess setting exif tags error: {error}")
-                exif_answer_q.put(1)
-        exif_answer_q.put(None)
-        exif_errors_q.put(None)
-        mp_exif_tool.terminate()
-
     # Set macOS tags in to the files
     def set_macos_tags(self) -> bool:
         self.print_log('i', 'stage', f"{self.folder_path}: Start setting macOS tags in files.")
@@ -1355,6 +1785,11 @@ class PVFolder(Settings):
 class PVGroup(Settings):
     tf = TimezoneFinder()
     time_get_data_from_file = 0
+    __slots__ = ('gr_id', 'pv_folder', 'name', 'new_name', 'folder_path', 'folder_dt_name', 'group_files',
+                 'file_datetime', 'utc_datetime', 'utc_relative_base_time', 'naming_datetime', 'local_datetime',
+                 'local_datetime_type', 'dt_offset', 'naming_warning', 'camera_key', 'camera_found', 't_zone', 'coord',
+                 'coord_source', 'alt', 'dt_source', 'address', 'sort_key', 'sort_ts', 'mac_tags_names', 'num',
+                 'object_tags', 'new_f_name_core')
 
     def __init__(self,
                  pv_folder: PVFolder,
@@ -1383,8 +1818,11 @@ class PVGroup(Settings):
         self.coord_source = ''
         self.alt = 0
         self.dt_source = ''
-        self.address = Address()
+        # Groups without address share the empty address. The group gets its own address when it is set.
+        self.address = Address.get_empty_address()
         self.sort_key = ''
+        # Epoch seconds of sort_key. Groups are sorted by it.
+        self.sort_ts = math.inf
         self.mac_tags_names = []
         self.num = ''
         self.object_tags = []
@@ -1449,14 +1887,19 @@ class PVGroup(Settings):
         if coord_source and new_coord:
             self.coord = new_coord
             self.coord_source = coord_source
-            self.address.clear_address()
+            self.address = Address.get_empty_address()
             self.alt = alt
             alt_msg = str(alt) + ' ' if alt else ''
             self.print_log('i', 'coord',
                            f"{self.folder_path}: {self.name} got coordinates {new_coord} {alt_msg}from {source}.")
 
+    def get_own_address(self) -> Address:
+        if self.address is Address.get_empty_address():
+            self.address = Address()
+        return self.address
+
     def set_group_address(self, new_address: typing.Dict[str, str]) -> typing.NoReturn:
-        self.address.set_address(new_address)
+        self.get_own_address().set_address(new_address)
 
     def get_utc_relative_base_time(self) -> typing.NoReturn:
         # Wrong UTC time, but it is needed to create a relative time array to calibrate the time of the pv files.
@@ -1514,12 +1957,13 @@ class PVGroup(Settings):
         self.coord = ()
         self.alt = 0
         self.coord_source = ''
-        self.address.clear_address()
+        self.address = Address.get_empty_address()
 
     def set_group_utc_datetime(self, utc_datetime: datetime, source: str) -> typing.NoReturn:
         utc_dt = self.utc_datetime
         self.utc_datetime = utc_datetime
         self.sort_key = str(utc_datetime)
+        self.sort_ts = func.datetime_to_epoch(utc_datetime)
         self.print_log('i', 'datetime',
                        f"{self.folder_path}: {self.name} got UTC time {utc_dt} -> {self.utc_datetime} from {source}.")
 
@@ -1572,7 +2016,7 @@ class PVGroup(Settings):
 
     def get_group_address_by_coordinates(self) -> typing.NoReturn:
         if self.coord:
-            self.address.get_address_by_coordinates(self.coord)
+            self.get_own_address().get_address_by_coordinates(self.coord)
             if self.address.address:
                 if 'geo_point' in self.address.address:
                     self.print_log('i', 'address', f"{self.folder_path}: {self.name} No address for coordinates: "
@@ -1585,11 +2029,18 @@ class PVGroup(Settings):
                 self.print_log('i', 'address', f"{self.folder_path}: {self.name} No address for coordinates: "
                                                f"{str(self.coord)}")
         else:
-            self.address.clear_address()
+            self.address = Address.get_empty_address()
             self.print_log('i', 'address', f"{self.folder_path}: {self.name} No coordinates - address cleared.")
 
     def set_group_sort_key(self) -> typing.NoReturn:
         self.sort_key = str(self.utc_datetime) if self.utc_datetime else str(self.file_datetime)
+        if self.utc_datetime:
+            self.sort_ts = func.datetime_to_epoch(self.utc_datetime)
+        else:
+            # Subseconds of the file creation time order the burst shots.
+            self.sort_ts = next((pv_file.file_ts for pv_file in self.group_files
+                                 if pv_file.file_datetime == self.file_datetime and pv_file.file_datetime),
+                                func.datetime_to_epoch(self.file_datetime))
 
     def set_gr_id(self, gr_id: str) -> typing.NoReturn:
         self.gr_id = gr_id
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import heapq
+import math
+import os
+import typing
+from time import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from src import func
+from src.done_folders import DoneFolders
+from src.settings import Settings
+
+
+class FolderJob:
+    """
+    Planned processing of one folder.
+    """
+    __slots__ = ('folder_path', 'files_num', 'files_size', 'device', 'subfolders_paths', 'done')
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        # Number and total size of the media files of the folder
+        self.files_num = 0
+        self.files_size = 0
+        self.device = 0
+        # Subfolders to process after the folder, ignored ones are not included
+        self.subfolders_paths: typing.List[str] = []
+        # The folder is in the done folders registry, it is not processed
+        self.done = False
+
+
+class TreePlan(Settings):
+    """
+    Plan of the systematization of the folders tree, made by one pass over the tree before the run. The folders of
+    each level are listed by parallel threads, os.scandir does not hold the interpreter lock while it reads the disk.
+    The media files of each folder are counted and their size is summed up, the done folders and the ignored
+    subfolders, see 'ignore_sing', are marked.
+    The jobs are ordered by the 'plan_order' setting, but a folder is always started after its parent folder is
+    finished, see TreePlan.get_priority. The runtime is estimated by the throughput measured in the previous runs.
+    The folder settings files are not read by the plan: they are applied when the folder is processed.
+    """
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+        # {folder path: job}, in the order of the recursive run
+        self.jobs: typing.Dict[str, FolderJob] = {}
+        self.priorities: typing.Dict[str, typing.Tuple] = {}
+        self.start_time = 0.0
+
+    def walk(self) -> typing.NoReturn:
+        """
+        List all folders of the tree level by level.
+        """
+        media_types = frozenset(file_type.upper() for file_type in self.get_par([], 'media_types'))
+        ignore_sing = self.get_par('', 'ignore_sing') if self.get_par(True, 'recurrent') else None
+        check_done = not self.get_par(True, 'new_job_reset')
+        jobs = {self.root_path: FolderJob(self.root_path)}
+        level = [self.root_path]
+        with ThreadPoolExecutor(thread_name_prefix='tree_plan') as executor:
+            while level:
+                next_level = []
+                for folder_path, job in zip(level, executor.map(TreePlan.scan_folder, level,
+                                                                [media_types] * len(level),
+                                                                [ignore_sing] * len(level))):
+                    job.done = check_done and DoneFolders.is_done(folder_path)
+                    jobs[folder_path] = job
+                    next_level.extend(job.subfolders_paths)
+                level = next_level
+                self.print_counter(f"{self.root_path}: Planning. Found {len(jobs)} folders.")
+        self.print_counter('')
+
+        # Jobs in the order of the recursive run
+        self.jobs = {}
+        stack = [self.root_path]
+        while stack:
+            job = jobs[stack.pop()]
+            self.jobs[job.folder_path] = job
+            stack.extend(reversed(job.subfolders_paths))
+        self.set_priorities()
+
+    @staticmethod
+    def scan_folder(folder_path: str,
+                    media_types: typing.FrozenSet[str],
+                    ignore_sing: typing.Optional[str]) -> FolderJob:
+        """
+        :param media_types: upper case extensions of media files
+        :param ignore_sing: subfolders, whose names begin with it, are ignored; None - subfolders are not processed
+        """
+        job = FolderJob(folder_path)
+        try:
+            job.device = os.stat(folder_path).st_dev
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        if entry.name.split('.')[-1].upper() in media_types:
+                            job.files_num += 1
+                            job.files_size += entry.stat().st_size
+                    elif entry.is_dir() and ignore_sing is not None and \
+                            len(entry.name) >= len(ignore_sing) and entry.name[:len(ignore_sing)] != ignore_sing:
+                        job.subfolders_paths.append(join(folder_path, entry.name))
+        except OSError:
+            pass
+        return job
+
+    def set_priorities(self) -> typing.NoReturn:
+        """
+        Priorities of the jobs by the 'plan_order' setting, the job with the least value is started first:
+        'tree' - the order of the recursive run, 'size' - the largest folders first, 'device' - the largest folders
+        first, taking one folder of each disk device in turn, so the folders processed at the same time are on
+        different devices.
+        """
+        plan_order = self.get_par('tree', 'plan_order')
+        if plan_order == 'size':
+            self.priorities = {path: (-job.files_size, num) for num, (path, job) in enumerate(self.jobs.items())}
+        elif plan_order == 'device':
+            device_jobs_nums = {}
+            self.priorities = {}
+            for num, (path, job) in enumerate(sorted(self.jobs.items(), key=lambda item: -item[1].files_size)):
+                device_job_num = device_jobs_nums.get(job.device, 0)
+                device_jobs_nums[job.device] = device_job_num + 1
+                self.priorities[path] = (device_job_num, num)
+        else:
+            self.priorities = {path: (num,) for num, path in enumerate(self.jobs)}
+
+    def get_priority(self, folder_path: str) -> typing.Tuple:
+        """
+        Folders not found by the plan, for example created by 'sort_files', are started first.
+        """
+        return self.priorities.get(folder_path, (-math.inf,))
+
+    def is_done(self, folder_path: str) -> bool:
+        return folder_path in self.jobs and self.jobs[folder_path].done
+
+    def get_ordered_jobs(self) -> typing.List[FolderJob]:
+        """
+        :return: jobs not done in the order they are started by one process
+        """
+        ordered_jobs = []
+        ready = [(self.get_priority(self.root_path), self.root_path)]
+        while ready:
+            job = self.jobs[heapq.heappop(ready)[1]]
+            if not job.done:
+                ordered_jobs.append(job)
+            for subfolder_path in job.subfolders_paths:
+                heapq.heappush(ready, (self.get_priority(subfolder_path), subfolder_path))
+        return ordered_jobs
+
+    def get_seconds_per_file(self) -> typing.Optional[float]:
+        """
+        :return: time of processing of one media file measured in the previous runs
+        """
+        plan_stat = func.load_txt_file_as_struct(self.get_par('', 'plan_stat_file_path'), {})
+        if plan_stat.get('files') and plan_stat.get('seconds'):
+            return plan_stat['seconds'] / plan_stat['files']
+        return None
+
+    def start_run(self) -> typing.NoReturn:
+        self.start_time = time()
+
+    def save_throughput(self) -> typing.NoReturn:
+        """
+        Add the files and the time of the finished run to the measured throughput.
+        """
+        files_num = sum(job.files_num for job in self.jobs.values() if not job.done)
+        if not files_num or not self.start_time:
+            return
+        plan_stat_file_path = self.get_par('', 'plan_stat_file_path')
+        plan_stat = func.load_txt_file_as_struct(plan_stat_file_path, {})
+        # Time of one process: the folders processed at the same time by several processes are counted separately.
+        seconds = (time() - self.start_time) * max(self.get_par(1, 'folder_processes'), 1)
+        plan_stat = {'files': plan_stat.get('files', 0) + files_num,
+                     'seconds': plan_stat.get('seconds', 0) + seconds}
+        func.save_struct_as_txt_file(plan_stat_file_path, plan_stat, 'plan_stat')
+
+    def print_plan(self, print_jobs: bool) -> typing.NoReturn:
+        """
+        :param print_jobs: print each job, otherwise only the totals
+        """
+        ordered_jobs = self.get_ordered_jobs()
+        seconds_per_file = self.get_seconds_per_file()
+        num_proc = max(self.get_par(1, 'folder_processes'), 1)
+        if print_jobs:
+            for job in ordered_jobs:
+                estimate = f", ~{timedelta(seconds=int(job.files_num * seconds_per_file))}" if seconds_per_file else ''
+                self.print_log('i', 'main', f"Plan: {job.folder_path}: {job.files_num} files, "
+                                            f"{round(job.files_size / 2 ** 20)} MB{estimate}")
+        files_num = sum(job.files_num for job in ordered_jobs)
+        files_size = sum(job.files_size for job in ordered_jobs)
+        done_num = sum(job.done for job in self.jobs.values())
+        estimate = f" Estimated time: {timedelta(seconds=int(files_num * seconds_per_file / num_proc))}." \
+            if seconds_per_file else " Estimated time is unknown until the first run is measured."
+        self.print_log('i', 'main', f"Plan: {len(ordered_jobs)} folders, {files_num} media files, "
+                                    f"{round(files_size / 2 ** 20)} MB, {done_num} done folders skipped.{estimate}")